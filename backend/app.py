@@ -4,63 +4,1244 @@ Thai-HandMate Backend API
 FastAPI application สำหรับสร้างประโยคไทยด้วย Typhoon LLM
 """
 
-from fastapi import FastAPI, HTTPException
+import time
+IMPORT_STARTED = time.perf_counter()  # ใช้วัดเวลาตั้งแต่เริ่ม import จนพร้อมรับ request
+
+from fastapi import FastAPI, HTTPException, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 import os
 import json
+import re
 import httpx
-import time
-import queue
-import threading
 import asyncio
+import socket
+import email.utils
+import base64
+import binascii
+from collections import deque
 from dotenv import load_dotenv
+from result_cache import ResultCache, MemoryLRUCache, SQLiteCache, make_cache_key
+from metrics import MetricsRegistry
+from token_bucket import LocalTokenBucket, SQLiteTokenBucket
+from sessions import SessionStore, SessionLimitError, InvalidCaptureError
+from sentence_engine import SentenceEngine
+from prompt_compaction import CaptureCompactor, compact_data_json, estimate_tokens, sentence_max_tokens
+
+# NumPy เป็น dependency เสริม ใช้เฉพาะ /api/predict/hand (import ตอนโหลดโมเดล ไม่ให้ import แอปช้าลง)
+np = None
 
 # โหลด environment variables
 load_dotenv()
 
+# การตั้งค่า
+TYPHOON_API_KEY = os.getenv('TYPHOON_API_KEY', '')
+TYPHOON_API_BASE = os.getenv('TYPHOON_API_BASE', 'https://api.typhoon.io/v1/chat/completions')
+
+# การตั้งค่า connection pool สำหรับ Typhoon API
+TYPHOON_HTTP2 = os.getenv('TYPHOON_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+TYPHOON_MAX_CONNECTIONS = int(os.getenv('TYPHOON_MAX_CONNECTIONS', '20'))
+TYPHOON_MAX_KEEPALIVE = int(os.getenv('TYPHOON_MAX_KEEPALIVE', '10'))
+TYPHOON_KEEPALIVE_EXPIRY = float(os.getenv('TYPHOON_KEEPALIVE_EXPIRY', '60'))
+TYPHOON_CONNECT_TIMEOUT = float(os.getenv('TYPHOON_CONNECT_TIMEOUT', '5'))
+TYPHOON_READ_TIMEOUT = float(os.getenv('TYPHOON_READ_TIMEOUT', '30'))
+TYPHOON_POOL_TIMEOUT = float(os.getenv('TYPHOON_POOL_TIMEOUT', '5'))
+
+# การตั้งค่า rate limit (token bucket)
+TYPHOON_RATE_LIMIT = float(os.getenv('TYPHOON_RATE_LIMIT', '10'))  # requests ต่อนาที
+TYPHOON_RATE_BURST = int(os.getenv('TYPHOON_RATE_BURST', '1'))  # จำนวน request ที่ยิงติดกันได้
+TYPHOON_QUEUE_TIMEOUT = float(os.getenv('TYPHOON_QUEUE_TIMEOUT', '10'))  # วินาทีที่ยอมรอคิวก่อนใช้ fallback
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'local').lower()  # local หรือ sqlite (แชร์ระหว่าง worker)
+RATE_LIMIT_DB_PATH = os.getenv('RATE_LIMIT_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'ratelimit.sqlite3'))
+RATE_LIMIT_BUSY_TIMEOUT_MS = float(os.getenv('RATE_LIMIT_BUSY_TIMEOUT_MS', '5'))  # ms ที่รอ lock ของ worker อื่น (รันบน event loop)
+
+# การตั้งค่า upstream หลายตัว (ไม่ระบุ TYPHOON_ENDPOINTS = ใช้ TYPHOON_API_BASE/TYPHOON_API_KEY ตัวเดียว)
+TYPHOON_MODEL = os.getenv('TYPHOON_MODEL', 'typhoon-v2.1-12b-instruct')
+TYPHOON_ENDPOINTS = os.getenv('TYPHOON_ENDPOINTS', '')  # JSON list หรือ path ของไฟล์ JSON
+ROUTER_EWMA_ALPHA = float(os.getenv('ROUTER_EWMA_ALPHA', '0.3'))  # น้ำหนักของ latency ล่าสุดใน EWMA
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')  # ส่ง request สำรองไป endpoint อื่นเมื่อตัวแรกช้า
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '0.95'))  # ส่ง request สำรองเมื่อช้ากว่า percentile นี้ของ endpoint
+HEDGE_MIN_DELAY_MS = float(os.getenv('HEDGE_MIN_DELAY_MS', '300'))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv('HEDGE_DEFAULT_DELAY_MS', '3000'))  # ใช้จนกว่าจะมี latency ของ endpoint มากพอ
+
+# การตั้งค่า cache ผลลัพธ์ (memory LRU + SQLite บนดิสก์)
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CACHE_MEMORY_ENTRIES = int(os.getenv('CACHE_MEMORY_ENTRIES', '1024'))
+CACHE_MEMORY_TTL = float(os.getenv('CACHE_MEMORY_TTL', '3600'))  # วินาที
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'results.sqlite3'))
+CACHE_DISK_MAX_BYTES = int(os.getenv('CACHE_DISK_MAX_BYTES', str(16 * 1024 * 1024)))
+CACHE_DISK_TTL = float(os.getenv('CACHE_DISK_TTL', str(7 * 24 * 3600)))  # วินาที
+CACHE_CONFIDENCE_BUCKET = float(os.getenv('CACHE_CONFIDENCE_BUCKET', '0.1'))
+
+# การตั้งค่า batch generation
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '200'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))  # จำนวน upstream call พร้อมกันสูงสุดต่อ batch
+BATCH_MAX_PACK_SIZE = int(os.getenv('BATCH_MAX_PACK_SIZE', '10'))
+
+# งบเวลาต่อ request (ms) ถ้า Typhoon ตอบไม่ทันจะตอบด้วย fallback ทันที (0 = รอจนจบ)
+LATENCY_BUDGET_MS = float(os.getenv('LATENCY_BUDGET_MS', '5000'))
+
+# การตั้งค่า circuit breaker ของ Typhoon upstream
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', '60'))  # ช่วงเวลาที่ใช้คิด error rate
+BREAKER_MIN_REQUESTS = int(os.getenv('BREAKER_MIN_REQUESTS', '5'))  # จำนวน request ขั้นต่ำก่อนตัดวงจร
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))  # สัดส่วน error ที่ทำให้ตัดวงจร
+BREAKER_SLOW_MS = float(os.getenv('BREAKER_SLOW_MS', '15000'))  # ตอบช้ากว่านี้นับเป็น error
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))  # เวลาก่อนลอง probe (half-open)
+HEALTH_REFRESH_SECONDS = float(os.getenv('HEALTH_REFRESH_SECONDS', '1'))
+
+# การย่อข้อมูล capture ใน prompt และขนาดคำตอบ (max_tokens) ของ Typhoon
+PROMPT_COMPACTION = os.getenv('PROMPT_COMPACTION', 'true').lower() in ('1', 'true', 'yes')
+PROMPT_CONFIDENCE_FLOOR = float(os.getenv('PROMPT_CONFIDENCE_FLOOR', '0.3'))  # ตัด capture ที่ confidence ของคำต่ำกว่านี้
+PROMPT_CONFIDENCE_PRECISION = int(os.getenv('PROMPT_CONFIDENCE_PRECISION', '2'))  # จำนวนทศนิยมของ confidence
+TYPHOON_MAX_TOKENS = int(os.getenv('TYPHOON_MAX_TOKENS', '700'))  # เพดาน max_tokens ต่อคำตอบ 3 ประโยค
+TYPHOON_SENTENCE_TOKENS = int(os.getenv('TYPHOON_SENTENCE_TOKENS', '40'))  # token พื้นฐานต่อประโยค
+TYPHOON_WORD_TOKENS = int(os.getenv('TYPHOON_WORD_TOKENS', '8'))  # token เพิ่มต่อคำภาษามือที่ต้องใช้ในประโยค
+
+# การตั้งค่า capture session (client ส่ง capture ทีละภาพ แล้วสร้างประโยคจาก session id)
+SESSION_TTL = float(os.getenv('SESSION_TTL', '1800'))  # วินาทีที่ session ไม่ถูกใช้ก่อนหมดอายุ
+SESSION_MAX_SESSIONS = int(os.getenv('SESSION_MAX_SESSIONS', '1000'))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', str(8 * 1024 * 1024)))  # เพดานหน่วยความจำรวมของทุก session
+SESSION_MAX_CAPTURES = int(os.getenv('SESSION_MAX_CAPTURES', '100'))  # จำนวน capture สูงสุดต่อ session
+
+# การตั้งค่าการสร้างประโยคล่วงหน้า (เมื่อลำดับคำใน session ไม่เปลี่ยนนานพอ)
+SPECULATION_ENABLED = os.getenv('SPECULATION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SPECULATION_STABLE_MS = float(os.getenv('SPECULATION_STABLE_MS', '1500'))  # ลำดับคำต้องคงที่นานเท่านี้ก่อนเริ่ม
+SPECULATION_QUEUE_TIMEOUT = float(os.getenv('SPECULATION_QUEUE_TIMEOUT', '60'))  # วินาทีที่งานเบื้องหลังยอมรอคิว
+SPECULATION_MAX_INFLIGHT = int(os.getenv('SPECULATION_MAX_INFLIGHT', '1'))  # จำนวนงานล่วงหน้าที่รอ/เรียก upstream พร้อมกัน
+
+# การตั้งค่า hand model inference ฝั่ง backend (/api/predict/hand ต้องติดตั้ง numpy)
+HAND_MODEL_ENABLED = os.getenv('HAND_MODEL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+HAND_MODEL_DIR = os.getenv('HAND_MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'public', 'hand-model'))
+HAND_MODEL_MMAP = os.getenv('HAND_MODEL_MMAP', 'false').lower() in ('1', 'true', 'yes')  # อ่าน weights.bin แบบ memory-map
+HAND_BATCH_MAX = int(os.getenv('HAND_BATCH_MAX', '64'))  # จำนวนแถวสูงสุดต่อ micro-batch
+HAND_BATCH_WAIT_MS = float(os.getenv('HAND_BATCH_WAIT_MS', '2'))  # เวลารอรวม request ก่อนรัน batch
+HAND_MAX_VECTORS = int(os.getenv('HAND_MAX_VECTORS', '256'))  # จำนวน vector สูงสุดต่อ request
+
+# การตั้งค่าตัวสร้างประโยคแบบ offline (ใช้เป็น fallback และโหมด offline ของ batch)
+OFFLINE_METADATA_PATH = os.getenv('OFFLINE_METADATA_PATH', os.path.join(HAND_MODEL_DIR, 'metadata.json'))  # label ของ hand model
+OFFLINE_MIN_CONFIDENCE = float(os.getenv('OFFLINE_MIN_CONFIDENCE', '0.5'))  # ไม่ใช้คำที่ confidence ต่ำกว่านี้ (ถ้ายังเหลือคำอื่น)
+OFFLINE_PRECOMPUTE_WORDS = int(os.getenv('OFFLINE_PRECOMPUTE_WORDS', '3'))  # สร้างตารางล่วงหน้าสำหรับลำดับคำยาวไม่เกินนี้
+
+# แนบ header Server-Timing (เวลาของแต่ละขั้นตอน) ในทุก response
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+
+# การตั้งค่าการรันเซิร์ฟเวอร์ด้วย python app.py
+SERVER_MODE = os.getenv('SERVER_MODE', 'development').lower()  # development = reload เมื่อแก้ไฟล์, production = ไม่ reload
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8000'))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '1'))  # จำนวน worker process (เฉพาะ production)
+UPSTREAM_WARMUP = os.getenv('UPSTREAM_WARMUP', 'true').lower() in ('1', 'true', 'yes')  # resolve DNS และเปิด connection ไว้ตอน startup
+UPSTREAM_WARMUP_CONNECTIONS = int(os.getenv('UPSTREAM_WARMUP_CONNECTIONS', '2'))  # จำนวน connection ที่เปิดไว้ต่อ endpoint
+
+# Metrics (Prometheus text format ที่ /metrics)
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    "thai_handmate_stage_seconds",
+    "Time spent in each sentence generation stage",
+    ["stage"]
+)
+REQUEST_SECONDS = metrics.histogram(
+    "thai_handmate_http_request_seconds",
+    "HTTP request latency by route",
+    ["method", "path"]
+)
+RESPONSES_TOTAL = metrics.counter(
+    "thai_handmate_responses_total",
+    "Generated sentence sets by provider",
+    ["provider"]
+)
+UPSTREAM_429_TOTAL = metrics.counter(
+    "thai_handmate_upstream_429_total",
+    "HTTP 429 responses received from the Typhoon API"
+)
+UPSTREAM_REQUESTS_TOTAL = metrics.counter(
+    "thai_handmate_upstream_requests_total",
+    "Requests sent to each upstream endpoint by outcome (success, failure, cancelled)",
+    ["endpoint", "outcome"]
+)
+TYPHOON_FAILURES_TOTAL = metrics.counter(
+    "thai_handmate_typhoon_failures_total",
+    "Typhoon calls that ended in fallback, by reason",
+    ["reason"]
+)
+SPECULATION_TOTAL = metrics.counter(
+    "thai_handmate_speculation_total",
+    "Speculative pre-generation events by outcome (started, hit, cancelled, wasted)",
+    ["outcome"]
+)
+PROMPT_CHARS_TOTAL = metrics.counter(
+    "thai_handmate_prompt_chars_total",
+    "Characters of Typhoon prompts before and after compaction",
+    ["stage"]
+)
+IN_FLIGHT = metrics.gauge(
+    "thai_handmate_in_flight_requests",
+    "HTTP requests currently being handled"
+)
+metrics.gauge(
+    "thai_handmate_limiter_queue_depth",
+    "Requests waiting in the Typhoon rate limiter queue",
+    function=lambda: len(typhoon_limiter.waiters)
+)
+metrics.gauge(
+    "thai_handmate_limiter_tokens",
+    "Rate limiter tokens currently available",
+    function=lambda: typhoon_limiter.bucket.snapshot()["tokens"]
+)
+metrics.gauge(
+    "thai_handmate_websocket_connections",
+    "Open /ws connections",
+    function=lambda: ws_stats["active"]
+)
+metrics.gauge(
+    "thai_handmate_sessions_active",
+    "Capture sessions currently held in memory",
+    function=lambda: len(capture_sessions.sessions)
+)
+
+# เวลาของแต่ละขั้นตอนใน request ปัจจุบัน (ใช้ทำ Server-Timing)
+request_timings = ContextVar("request_timings", default=None)
+
+# ticket ของงานเบื้องหลังที่กำลังเรียก Typhoon (None = request ของผู้ใช้) ใช้เลือกคิวใน rate limiter
+background_ticket = ContextVar("background_ticket", default=None)
+
+# เวลาสิ้นสุดงบเวลาของ request ปัจจุบัน (time.monotonic) ใช้จำกัดเวลารอคิวใน rate limiter
+budget_deadline = ContextVar("budget_deadline", default=None)
+
+def observe_stage(stage: str, seconds: float):
+    """บันทึกเวลาของขั้นตอนหนึ่งลง histogram และลง Server-Timing ของ request ปัจจุบัน"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def stage_timer(stage: str):
+    """จับเวลาโค้ดในบล็อก with แล้วบันทึกเป็นขั้นตอน stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
 # Rate Limiting System
+class RateLimitExceeded(Exception):
+    """รอคิว rate limit ไม่ทันกำหนด (deadline) ของ request"""
+
+def parse_retry_after(value, default: float) -> float:
+    """แปลง header Retry-After (วินาที หรือ HTTP-date) เป็นจำนวนวินาที"""
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(retry_at.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
 class TyphoonAPIRateLimiter:
-    def __init__(self, requests_per_minute=10):
+    """Rate limiter แบบ asyncio: token bucket (local หรือแชร์ข้าม process) พร้อมคิว FIFO และ deadline ต่อ request
+
+    มีคิวสองระดับ: waiters (request ของผู้ใช้) ได้ token ก่อนเสมอ ส่วน background (งานเบื้องหลัง
+    เช่นการสร้างประโยคล่วงหน้า) ได้ token เฉพาะตอนที่ไม่มีผู้ใช้รออยู่
+    """
+
+    def __init__(self, requests_per_minute=10, burst=1, max_wait=10.0, bucket=None):
         self.requests_per_minute = requests_per_minute
         self.interval = 60 / requests_per_minute  # วินาทีระหว่างการ request
-        self.last_request_time = 0
-        self.request_queue = queue.Queue()
-        self.lock = threading.Lock()
-        self.is_processing = False
-        
-    async def make_request_async(self, payload, headers, timeout=30.0):
+        self.rate = requests_per_minute / 60  # token ต่อวินาที
+        self.burst = max(int(burst), 1)
+        self.max_wait = max_wait
+        self.bucket = bucket or LocalTokenBucket(self.rate, self.burst)
+        self.waiters = deque()
+        self.background = deque()
+        self._dispatcher = None
+
+        # สถิติ (นับเฉพาะ worker นี้)
+        self.acquired = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.max_queue_depth = 0
+        self.background_acquired = 0
+        self.promoted = 0
+
+    def _record_wait(self, waited: float):
+        observe_stage("limiter_wait", waited)
+        self.acquired += 1
+        self.total_wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+
+    def _next_queue(self):
+        """คิวที่จะได้ token ตัวถัดไป (ผู้ใช้ก่อน background) หรือ None ถ้าไม่มีใครรอ"""
+        for queue in (self.waiters, self.background):
+            while queue and queue[0].done():
+                queue.popleft()
+            if queue:
+                return queue
+        return None
+
+    async def _dispatch(self):
+        """ปล่อย request ในคิวทีละตัวตามจังหวะที่ token เติมเข้ามา"""
+        try:
+            while True:
+                queue = self._next_queue()
+                if queue is None:
+                    break
+                wait = self.bucket.take()
+                if wait == 0:
+                    queue.popleft().set_result(None)
+                    continue
+                # ตื่นมาแล้วเลือกคิวใหม่ เผื่อมี request ของผู้ใช้เข้ามาระหว่างรอ
+                await asyncio.sleep(wait)
+        finally:
+            self._dispatcher = None
+
+    def _start_dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def acquire(self, deadline: float = None, ticket=None):
+        """ขอ token หนึ่งตัว ถ้าได้ไม่ทัน deadline (time.monotonic) จะ raise RateLimitExceeded ทันที
+
+        ticket: ถ้าระบุ (และยังไม่ถูก promote) จะรอในคิว background
+        limiter จะเก็บ future ที่รออยู่ไว้ใน ticket.waiter และนับ ticket.granted เมื่อได้ token
+        """
+        now = time.monotonic()
+        if deadline is None:
+            deadline = now + self.max_wait
+        low_priority = ticket is not None and not ticket.promoted
+
+        if not self.waiters and not (low_priority and self.background):
+            wait = self.bucket.take()
+            if wait == 0:
+                self._granted(ticket, low_priority, 0.0)
+                return
+        else:
+            wait = self.bucket.wait_time()
+
+        # ประเมินเวลารอก่อน ถ้าไม่ทันแน่ๆ ให้ fail fast ไป fallback เลย
+        ahead = len(self.waiters) + (len(self.background) if low_priority else 0)
+        if now + wait + ahead / self.rate > deadline:
+            self.rejected += 1
+            raise RateLimitExceeded("Rate limit exceeded - queue wait exceeds request deadline")
+
+        waiter = asyncio.get_running_loop().create_future()
+        if low_priority:
+            self.background.append(waiter)
+            ticket.waiter = waiter
+        else:
+            self.waiters.append(waiter)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiters))
+        self._start_dispatcher()
+
+        try:
+            await asyncio.wait_for(waiter, timeout=max(deadline - now, 0.0))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RateLimitExceeded("Rate limit exceeded - request deadline reached while queued")
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            if ticket is not None:
+                ticket.waiter = None
+        self._granted(ticket, low_priority, time.monotonic() - now)
+
+    def _granted(self, ticket, low_priority: bool, waited: float):
+        if ticket is not None:
+            ticket.granted += 1
+        if low_priority:
+            # เวลารอของงานเบื้องหลังไม่นับรวมกับ latency ของผู้ใช้
+            self.background_acquired += 1
+            return
+        self._record_wait(waited)
+
+    def promote(self, ticket):
+        """ย้าย request ของ ticket จากคิว background ไปคิวผู้ใช้ (เมื่อมีผู้ใช้รอผลของมันอยู่)"""
+        if ticket.promoted:
+            return
+        ticket.promoted = True
+        waiter = ticket.waiter
+        if waiter is None or waiter.done():
+            return
+        try:
+            self.background.remove(waiter)
+        except ValueError:
+            return
+        self.waiters.append(waiter)
+        self.promoted += 1
+        self._start_dispatcher()
+
+    def expected_wait(self) -> float:
+        """ประเมินเวลารอคิว (วินาที) ถ้าขอ token ตอนนี้ ใช้เลือก endpoint"""
+        return self.bucket.wait_time() + len(self.waiters) / self.rate
+
+    def on_rate_limited(self, response) -> float:
+        """บันทึก 429 จาก upstream และหยุดปล่อย token ตาม Retry-After (มีผลกับทุก worker ถ้าใช้ bucket แบบแชร์)"""
+        retry_after = parse_retry_after(response.headers.get("Retry-After"), self.interval)
+        UPSTREAM_429_TOTAL.inc()
+        self.rate_limited += 1
+        self.bucket.block(retry_after)
+        return retry_after
+
+    async def make_request_async(self, payload, headers, timeout=None, deadline=None, ticket=None, url=None):
         """ทำ API request แบบ async พร้อม rate limiting"""
-        
-        # ตรวจสอบ rate limit
-        current_time = time.time()
-        with self.lock:
-            time_since_last = current_time - self.last_request_time
-            
-            if time_since_last < self.interval:
-                sleep_time = self.interval - time_since_last
-                await asyncio.sleep(sleep_time)
-            
-            self.last_request_time = time.time()
-        
-        # ทำ API request
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TYPHOON_API_BASE,
-                json=payload,
-                headers=headers,
-                timeout=timeout
+        await self.acquire(deadline, ticket)
+
+        # ทำ API request ผ่าน client ที่แชร์ทั้งแอป (reuse connection)
+        return await typhoon_http.post(
+            url or TYPHOON_API_BASE,
+            json=payload,
+            headers=headers,
+            timeout=timeout
+        )
+
+    def stats(self):
+        """สถิติคิวและ token ปัจจุบัน"""
+        bucket = self.bucket.snapshot()
+        return {
+            "backend": "shared" if self.bucket.shared else "local",
+            "pid": os.getpid(),
+            "requests_per_minute": self.requests_per_minute,
+            "burst": self.burst,
+            "tokens_available": round(bucket["tokens"], 3),
+            "blocked_for": round(bucket["blocked_for"], 3),
+            "queue_depth": len(self.waiters),
+            "max_queue_depth": self.max_queue_depth,
+            "background_queue_depth": sum(1 for waiter in self.background if not waiter.done()),
+            "background_acquired": self.background_acquired,
+            "promoted": self.promoted,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "upstream_429": self.rate_limited,
+            "avg_wait_time": round(self.total_wait_time / self.acquired, 4) if self.acquired else 0.0,
+            "max_wait_time": round(self.max_wait_time, 4)
+        }
+
+def create_rate_bucket(requests_per_minute: float = TYPHOON_RATE_LIMIT, burst: int = TYPHOON_RATE_BURST,
+                       name: str = "typhoon"):
+    """สร้าง token bucket ตาม RATE_LIMIT_BACKEND (local = ต่อ process, sqlite = แชร์ทุก worker บนเครื่อง)"""
+    rate = requests_per_minute / 60
+    burst = max(burst, 1)
+    if RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteTokenBucket(RATE_LIMIT_DB_PATH, rate, burst, name=name, busy_timeout=RATE_LIMIT_BUSY_TIMEOUT_MS / 1000)
+    if RATE_LIMIT_BACKEND != "local":
+        print(f"[WARNING] Unknown RATE_LIMIT_BACKEND '{RATE_LIMIT_BACKEND}' - using local")
+    return LocalTokenBucket(rate, burst)
+
+# Upstream HTTP Client (connection pool)
+class TyphoonHTTPClient:
+    """httpx.AsyncClient ตัวเดียวที่ใช้ทั้งแอป พร้อม keep-alive และสถิติการ reuse connection"""
+
+    def __init__(self):
+        self.client = None
+        self.http2 = False
+        self.total_requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def start(self):
+        """สร้าง client (เรียกตอน FastAPI startup)"""
+        if self.client is not None:
+            return self.client
+
+        http2 = TYPHOON_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("[WARNING] HTTP/2 requested but 'h2' is not installed - using HTTP/1.1")
+                http2 = False
+        self.http2 = http2
+
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=TYPHOON_MAX_CONNECTIONS,
+                max_keepalive_connections=TYPHOON_MAX_KEEPALIVE,
+                keepalive_expiry=TYPHOON_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                connect=TYPHOON_CONNECT_TIMEOUT,
+                read=TYPHOON_READ_TIMEOUT,
+                write=TYPHOON_CONNECT_TIMEOUT,
+                pool=TYPHOON_POOL_TIMEOUT
             )
-            return response
+        )
+        return self.client
+
+    async def close(self):
+        """ปิด client และ connection ทั้งหมด (เรียกตอน FastAPI shutdown)"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def _trace(self, event_name, info):
+        # httpcore จะเรียก event นี้เฉพาะตอนเปิด connection ใหม่เท่านั้น
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def _request_kwargs(self, json=None, headers=None, timeout=None):
+        kwargs = {"json": json, "headers": headers, "extensions": {"trace": self._trace}}
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(
+                connect=TYPHOON_CONNECT_TIMEOUT,
+                read=timeout,
+                write=TYPHOON_CONNECT_TIMEOUT,
+                pool=TYPHOON_POOL_TIMEOUT
+            )
+        return kwargs
+
+    async def post(self, url, json=None, headers=None, timeout=None):
+        """POST ผ่าน connection pool (ถ้ายังไม่ start จะสร้างให้อัตโนมัติ)"""
+        client = self.client or self.start()
+        self.total_requests += 1
+        return await client.post(url, **self._request_kwargs(json, headers, timeout))
+
+    def stream(self, url, json=None, headers=None, timeout=None):
+        """POST แบบอ่าน response เป็น stream (ใช้กับ async with)"""
+        client = self.client or self.start()
+        self.total_requests += 1
+        return client.stream("POST", url, **self._request_kwargs(json, headers, timeout))
+
+    async def warm(self, url, connections=1) -> int:
+        """เปิด connection (TCP + TLS) ไปยัง url ไว้ใน pool ด้วย HEAD request พร้อมกัน คืนจำนวนที่เปิดได้
+
+        status code ไม่สำคัญ (401/405 ก็ใช้ได้) ขอแค่ handshake สำเร็จ connection จะกลับเข้า pool
+        และถูกใช้ซ้ำโดย request แรกจนกว่าจะหมด keep-alive
+        """
+        client = self.client or self.start()
+        connections = max(1, min(connections, TYPHOON_MAX_KEEPALIVE))
+
+        async def open_connection():
+            self.total_requests += 1
+            await client.head(url, timeout=TYPHOON_CONNECT_TIMEOUT, extensions={"trace": self._trace})
+
+        results = await asyncio.gather(*(open_connection() for _ in range(connections)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if len(errors) == len(results):
+            raise errors[0]
+        return len(results) - len(errors)
+
+    def stats(self):
+        """สถิติการใช้ connection pool"""
+        reused = max(self.total_requests - self.new_connections, 0)
+        return {
+            "started": self.client is not None,
+            "http2": self.http2,
+            "total_requests": self.total_requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / self.total_requests, 4) if self.total_requests else 0.0,
+            "limits": {
+                "max_connections": TYPHOON_MAX_CONNECTIONS,
+                "max_keepalive_connections": TYPHOON_MAX_KEEPALIVE,
+                "keepalive_expiry": TYPHOON_KEEPALIVE_EXPIRY
+            }
+        }
+
+typhoon_http = TyphoonHTTPClient()
+
+# Result Cache (ประโยคที่เคยสร้างจาก Typhoon)
+result_cache = ResultCache(
+    MemoryLRUCache(max_entries=CACHE_MEMORY_ENTRIES, ttl=CACHE_MEMORY_TTL),
+    SQLiteCache(CACHE_DB_PATH, max_bytes=CACHE_DISK_MAX_BYTES, ttl=CACHE_DISK_TTL) if CACHE_DB_PATH else None
+)
+
+# Capture sessions (สรุปและ prompt fragment ที่อัปเดตทีละ capture)
+capture_sessions = SessionStore(
+    ttl=SESSION_TTL,
+    max_sessions=SESSION_MAX_SESSIONS,
+    max_bytes=SESSION_MAX_BYTES,
+    max_captures=SESSION_MAX_CAPTURES,
+    compactor_factory=(lambda: new_capture_compactor()) if PROMPT_COMPACTION else None
+)
+
+# Single-flight (รวม request ที่เหมือนกันซึ่งกำลังรอ Typhoon อยู่ให้ใช้ผลลัพธ์เดียวกัน)
+class SingleFlight:
+    """ให้ request ที่มี key เดียวกันและเกิดพร้อมกัน รอผลจาก upstream call เดียว"""
+
+    def __init__(self):
+        self.inflight = {}  # key -> asyncio.Task
+        self.waiters = {}  # key -> จำนวน request ที่รอผลอยู่
+        self.leaders = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def _done(self, key, task):
+        self.inflight.pop(key, None)
+        self.waiters.pop(key, None)
+        # อ่าน exception ไว้เสมอ กันคำเตือน "exception was never retrieved" เมื่อไม่มีใครรอแล้ว
+        if not task.cancelled():
+            task.exception()
+
+    def start(self, key, factory) -> asyncio.Task:
+        """เริ่ม call ของ key นี้โดยไม่รอผล (ถ้ามีอยู่แล้วคืน task เดิม)"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self.inflight[key] = task
+            self.waiters[key] = 0
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.leaders += 1
+        return task
+
+    async def do(self, key, factory):
+        """ถ้ามี call ของ key นี้อยู่แล้วให้รอผลเดียวกัน ไม่งั้นเริ่ม call ใหม่ในฐานะ leader"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.start(key, factory)
+            self.waiters[key] = 1
+        else:
+            self.waiters[key] += 1
+            self.coalesced += 1
+            self.max_waiters = max(self.max_waiters, self.waiters[key])
+        # shield: ถ้า client ของ leader ตัดการเชื่อมต่อ follower ยังได้ผลลัพธ์ตามปกติ
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "inflight": len(self.inflight),
+            "waiting": sum(self.waiters.values()),
+            "leaders": self.leaders,
+            "coalesced_waiters": self.coalesced,
+            "max_waiters_per_key": self.max_waiters
+        }
+
+typhoon_flights = SingleFlight()
+
+def cached_typhoon_call(cache_key: str, factory):
+    """ห่อ factory ให้เก็บผลลัพธ์ลง cache เมื่อ Typhoon ตอบสำเร็จ"""
+    async def call():
+        sentences = await factory()
+        if CACHE_ENABLED:
+            result_cache.put(cache_key, sentences)
+        return sentences
+    return call
+
+async def run_typhoon(cache_key: str, factory) -> List[str]:
+    """เรียก Typhoon แบบ single-flight ตาม cache key แล้วเก็บผลลัพธ์ลง cache"""
+    return await typhoon_flights.do(cache_key, cached_typhoon_call(cache_key, factory))
+
+# Circuit Breaker (Typhoon upstream)
+class CircuitOpenError(Exception):
+    """วงจรเปิดอยู่ ข้ามการเรียก Typhoon ไปใช้ fallback"""
+
+class CircuitBreaker:
+    """Circuit breaker แบบ closed / open / half-open ตาม error rate และ latency ในช่วงเวลาล่าสุด"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window_seconds=60.0, min_requests=5, error_rate=0.5, slow_ms=15000.0,
+                 open_seconds=30.0, max_samples=500):
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_ms = slow_ms
+        self.open_seconds = open_seconds
+        self.samples = deque(maxlen=max_samples)  # (time, ok, latency_ms)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_inflight = False
+        self.on_change = None
+
+        # สถิติ
+        self.times_opened = 0
+        self.rejected = 0
+        self.probes = 0
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        print(f"[WARNING] Typhoon circuit {self.state} -> {state}")
+        self.state = state
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+        elif state == self.CLOSED:
+            self.samples.clear()
+        if self.on_change is not None:
+            self.on_change()
 
-# สร้าง rate limiter instance
-typhoon_limiter = TyphoonAPIRateLimiter(requests_per_minute=10)  # 10 requests ต่อนาที
+    def _trim(self, now: float):
+        while self.samples and self.samples[0][0] < now - self.window_seconds:
+            self.samples.popleft()
+
+    def _evaluate(self):
+        now = time.monotonic()
+        self._trim(now)
+        if len(self.samples) < self.min_requests:
+            return
+        failures = sum(1 for _, ok, _ in self.samples if not ok)
+        if failures / len(self.samples) >= self.error_rate:
+            self._set_state(self.OPEN)
+
+    def probe_due(self) -> bool:
+        """ถึงเวลาส่ง probe หรือยัง (วงจรเปิดครบเวลาและยังไม่มี probe ค้างอยู่)"""
+        return (self.state != self.CLOSED and not self.probe_inflight
+                and time.monotonic() - self.opened_at >= self.open_seconds)
+
+    def allow(self) -> bool:
+        """อนุญาตให้เรียก upstream หรือไม่ (ตอน half-open ให้ผ่านทีละหนึ่ง request เป็น probe)"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.probe_inflight:
+            self.rejected += 1
+            return False
+        self.probe_inflight = True
+        self.probes += 1
+        return True
+
+    def reject(self):
+        """นับ request ที่ไม่ได้ส่งมาที่ upstream นี้เพราะวงจรเปิดอยู่ (router เลือก endpoint อื่นหรือใช้ fallback)"""
+        self.rejected += 1
+
+    def release(self):
+        """คืนสิทธิ์ probe เมื่อ request ไม่ได้ไปถึง upstream (เช่นรอคิวไม่ทัน หรือโดน 429)"""
+        self.probe_inflight = False
+
+    def record_success(self, latency_ms: float):
+        ok = latency_ms <= self.slow_ms
+        self.samples.append((time.monotonic(), ok, latency_ms))
+        self.probe_inflight = False
+        if self.state == self.HALF_OPEN:
+            self._set_state(self.CLOSED if ok else self.OPEN)
+        else:
+            self._evaluate()
+
+    def record_failure(self, latency_ms: float = None):
+        self.samples.append((time.monotonic(), False, latency_ms))
+        self.probe_inflight = False
+        if self.state == self.HALF_OPEN:
+            self._set_state(self.OPEN)
+        elif self.state == self.CLOSED:
+            self._evaluate()
+
+    def stats(self):
+        self._trim(time.monotonic())
+        latencies = sorted(latency for _, ok, latency in self.samples if latency is not None)
+        failures = sum(1 for _, ok, _ in self.samples if not ok)
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(latencies[min(int(q * len(latencies)), len(latencies) - 1)], 1)
+
+        return {
+            "state": self.state,
+            "window_requests": len(self.samples),
+            "error_rate": round(failures / len(self.samples), 4) if self.samples else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "probes": self.probes
+        }
+
+# Upstream router (เลือก endpoint จาก latency และ token ที่เหลือ พร้อม hedged request)
+def upstream_endpoint_configs() -> List[dict]:
+    """รายการ endpoint จาก TYPHOON_ENDPOINTS (JSON list หรือ path ของไฟล์ JSON)
+
+    แต่ละรายการ: {"name", "url", "apiKey" หรือ "apiKeyEnv", "model", "rateLimit", "burst"}
+    field ที่ไม่ระบุใช้ค่าเดียวกับ endpoint เดี่ยว (TYPHOON_API_BASE, TYPHOON_MODEL, TYPHOON_RATE_LIMIT, ...)
+    """
+    single = [{
+        "name": "typhoon",
+        "url": TYPHOON_API_BASE,
+        "apiKey": TYPHOON_API_KEY,
+        "model": TYPHOON_MODEL,
+        "rateLimit": TYPHOON_RATE_LIMIT,
+        "burst": TYPHOON_RATE_BURST
+    }]
+    value = TYPHOON_ENDPOINTS.strip()
+    if not value:
+        return single
+    try:
+        if not value.startswith("["):
+            with open(value, encoding="utf-8") as f:
+                value = f.read()
+        configs = []
+        for index, entry in enumerate(json.loads(value)):
+            api_key = entry.get("apiKey")
+            if api_key is None:
+                api_key = os.getenv(entry.get("apiKeyEnv", "TYPHOON_API_KEY"), "")
+            configs.append({
+                "name": entry.get("name") or f"endpoint{index + 1}",
+                "url": entry.get("url", TYPHOON_API_BASE),
+                "apiKey": api_key,
+                "model": entry.get("model", TYPHOON_MODEL),
+                "rateLimit": float(entry.get("rateLimit", TYPHOON_RATE_LIMIT)),
+                "burst": int(entry.get("burst", TYPHOON_RATE_BURST))
+            })
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"[ERROR] Invalid TYPHOON_ENDPOINTS ({e}) - using TYPHOON_API_BASE only")
+        return single
+    return configs or single
+
+class UpstreamEndpoint:
+    """upstream หนึ่งตัว (URL + API key + model) พร้อม rate limiter, circuit breaker และ latency ของตัวเอง"""
+
+    def __init__(self, name: str, url: str, api_key: str, model: str, limiter: TyphoonAPIRateLimiter,
+                 breaker: CircuitBreaker, ewma_alpha: float = 0.3):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.limiter = limiter
+        self.breaker = breaker
+        self.ewma_alpha = ewma_alpha
+        self.ewma_ms = None  # None = ยังไม่เคยวัด (จะถูกเลือกก่อนเพื่อให้ได้ค่าเริ่มต้น)
+        self.latencies = deque(maxlen=200)
+        self.inflight = 0
+
+        # สถิติ
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def available(self) -> bool:
+        """เลือกใช้ได้หรือไม่ (มี key และวงจรปิด หรือถึงเวลา probe แล้ว)"""
+        return bool(self.api_key) and (self.breaker.state == CircuitBreaker.CLOSED or self.breaker.probe_due())
+
+    def expected_ms(self) -> float:
+        """เวลาที่คาดว่าจะได้คำตอบ = EWMA latency + เวลารอ token ของ endpoint นี้"""
+        return (self.ewma_ms or 0.0) + self.limiter.expected_wait() * 1000
+
+    def observe(self, latency_ms: float):
+        self.latencies.append(latency_ms)
+        if self.ewma_ms is None:
+            self.ewma_ms = latency_ms
+        else:
+            self.ewma_ms += self.ewma_alpha * (latency_ms - self.ewma_ms)
+
+    def latency_percentile(self, q: float, min_samples: int = 10) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "model": self.model,
+            "has_api_key": bool(self.api_key),
+            "ewma_ms": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "p95_ms": self.latency_percentile(0.95, min_samples=1),
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rate_limiter": self.limiter.stats(),
+            "circuit_breaker": self.breaker.stats()
+        }
+
+class UpstreamRouter:
+    """เลือก upstream endpoint ต่อ request ตามเวลาที่คาดว่าจะได้คำตอบ (EWMA latency + เวลารอ token)
+
+    ถ้า endpoint แรกล้มเหลวจะลอง endpoint ถัดไป และถ้าเปิด hedging จะส่ง request สำรองไป endpoint ถัดไป
+    เมื่อตัวแรกช้ากว่า percentile ที่กำหนด แล้วยกเลิกตัวที่ตอบช้ากว่า
+    """
+
+    def __init__(self, endpoints: List[UpstreamEndpoint], hedge_enabled: bool = False, hedge_percentile: float = 0.95,
+                 hedge_min_delay_ms: float = 300.0, hedge_default_delay_ms: float = 3000.0):
+        self.endpoints = endpoints
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_ms = hedge_min_delay_ms
+        self.hedge_default_delay_ms = hedge_default_delay_ms
+
+        # สถิติ
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def primary(self) -> UpstreamEndpoint:
+        return self.endpoints[0]
+
+    @property
+    def enabled(self) -> bool:
+        """มี endpoint ที่ตั้ง API key ไว้อย่างน้อยหนึ่งตัว"""
+        return any(endpoint.api_key for endpoint in self.endpoints)
+
+    def candidates(self) -> List[UpstreamEndpoint]:
+        """endpoint ที่ใช้ได้ เรียงจากที่คาดว่าจะตอบเร็วที่สุด"""
+        if len(self.endpoints) == 1:
+            return [endpoint for endpoint in self.endpoints if endpoint.available()]
+        return sorted((endpoint for endpoint in self.endpoints if endpoint.available()),
+                      key=lambda endpoint: endpoint.expected_ms())
+
+    def route(self) -> List[UpstreamEndpoint]:
+        """candidates สำหรับ request จริง (นับ rejected ให้ endpoint ที่ถูกข้ามเพราะวงจรเปิด)"""
+        candidates = self.candidates()
+        for endpoint in self.endpoints:
+            if endpoint.api_key and endpoint not in candidates:
+                endpoint.breaker.reject()
+        return candidates
+
+    def select(self) -> UpstreamEndpoint:
+        candidates = self.route()
+        if not candidates:
+            raise CircuitOpenError("Circuit open - Typhoon upstream is unavailable")
+        return candidates[0]
+
+    def healthy(self) -> bool:
+        """มี endpoint ที่วงจรปิดอยู่ (ใช้ตัดสินใจเรื่องงานเบื้องหลัง)"""
+        return any(endpoint.api_key and endpoint.breaker.state == CircuitBreaker.CLOSED for endpoint in self.endpoints)
+
+    def state(self) -> str:
+        states = {endpoint.breaker.state for endpoint in self.endpoints if endpoint.api_key}
+        for state in (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN):
+            if state in states:
+                return state
+        return CircuitBreaker.OPEN if states else self.primary.breaker.state
+
+    def promote(self, ticket):
+        """ย้าย request ของ ticket ไปคิวผู้ใช้ของ endpoint ที่มันรออยู่"""
+        for endpoint in self.endpoints:
+            if ticket.waiter is not None and ticket.waiter in endpoint.limiter.background:
+                endpoint.limiter.promote(ticket)
+                return
+        ticket.promoted = True
+
+    def hedge_delay(self, endpoint: UpstreamEndpoint) -> float:
+        """วินาทีที่รอ endpoint แรกก่อนส่ง request สำรอง"""
+        delay_ms = endpoint.latency_percentile(self.hedge_percentile)
+        if delay_ms is None:
+            delay_ms = self.hedge_default_delay_ms
+        return max(delay_ms, self.hedge_min_delay_ms) / 1000
+
+    async def request(self, payload: dict, deadline: float, ticket=None) -> str:
+        candidates = self.route()
+        if not candidates:
+            raise CircuitOpenError("Circuit open - Typhoon upstream is unavailable")
+        # งานเบื้องหลังไม่ hedge เพื่อไม่ใช้ quota เพิ่ม
+        if self.hedge_enabled and ticket is None and len(candidates) > 1:
+            return await self._hedged(candidates, payload, deadline)
+        return await self._failover(candidates, payload, deadline, ticket)
+
+    async def _failover(self, candidates: List[UpstreamEndpoint], payload: dict, deadline: float, ticket=None) -> str:
+        error = None
+        for endpoint in candidates:
+            if error is not None:
+                if time.monotonic() >= deadline:
+                    break
+                self.failovers += 1
+                print(f"[WARNING] Upstream {endpoint.name} used after failure: {error}")
+            try:
+                return await request_endpoint_content(endpoint, payload, deadline, ticket)
+            except Exception as e:
+                error = e
+        raise error
+
+    async def _hedged(self, candidates: List[UpstreamEndpoint], payload: dict, deadline: float) -> str:
+        primary, secondary = candidates[0], candidates[1]
+        started = time.perf_counter()
+        first = asyncio.ensure_future(request_endpoint_content(primary, payload, deadline))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(primary))
+        if done:
+            if first.exception() is None:
+                return first.result()
+            # ล้มเหลวก่อนถึงเวลา hedge: ลอง endpoint ถัดไปตามปกติ
+            self.failovers += 1
+            return await self._failover(candidates[1:], payload, deadline)
+
+        self.hedges += 1
+        secondary.hedges += 1
+        second = asyncio.ensure_future(request_endpoint_content(secondary, payload, deadline))
+        owners = {first: primary, second: secondary}
+        started_at = {first: started, second: time.perf_counter()}
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is second:
+                        self.hedge_wins += 1
+                        secondary.hedge_wins += 1
+                    # ยกเลิกตัวที่ยังไม่ตอบ และบันทึกเวลาที่รอไปแล้วเป็น latency ขั้นต่ำของมัน
+                    # (ไม่งั้น endpoint ที่แพ้ตลอดจะไม่มี EWMA และถูกเลือกเป็นตัวแรกซ้ำๆ)
+                    for loser in pending:
+                        loser.cancel()
+                        owners[loser].cancelled += 1
+                        owners[loser].observe((time.perf_counter() - started_at[loser]) * 1000)
+                        UPSTREAM_REQUESTS_TOTAL.inc(endpoint=owners[loser].name, outcome="cancelled")
+                    pending = set()
+                    return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "hedge_enabled": self.hedge_enabled,
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "endpoints": {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+        }
+
+def create_upstream_endpoint(config: dict) -> UpstreamEndpoint:
+    limiter = TyphoonAPIRateLimiter(
+        requests_per_minute=config["rateLimit"],
+        burst=config["burst"],
+        max_wait=TYPHOON_QUEUE_TIMEOUT,
+        bucket=create_rate_bucket(config["rateLimit"], config["burst"], name=config["name"])
+    )
+    breaker = CircuitBreaker(
+        window_seconds=BREAKER_WINDOW_SECONDS,
+        min_requests=BREAKER_MIN_REQUESTS,
+        error_rate=BREAKER_ERROR_RATE,
+        slow_ms=BREAKER_SLOW_MS,
+        open_seconds=BREAKER_OPEN_SECONDS
+    )
+    return UpstreamEndpoint(config["name"], config["url"], config["apiKey"], config["model"], limiter, breaker,
+                            ewma_alpha=ROUTER_EWMA_ALPHA)
+
+typhoon_router = UpstreamRouter(
+    [create_upstream_endpoint(config) for config in upstream_endpoint_configs()],
+    hedge_enabled=HEDGE_ENABLED,
+    hedge_percentile=HEDGE_PERCENTILE,
+    hedge_min_delay_ms=HEDGE_MIN_DELAY_MS,
+    hedge_default_delay_ms=HEDGE_DEFAULT_DELAY_MS
+)
+
+# limiter และ breaker ของ endpoint หลัก (ใช้ใน health, metrics และ stats แบบเดิม)
+typhoon_limiter = typhoon_router.primary.limiter
+typhoon_breaker = typhoon_router.primary.breaker
+
+# Health payload (คำนวณไว้ล่วงหน้า ให้ /api/health ที่ถูก poll ทุกวินาทีแค่ส่ง bytes ออกไป)
+health_payload = b""
+
+def refresh_health() -> bytes:
+    """คำนวณ payload ของ /api/health ใหม่"""
+    global health_payload
+    # ตัวเลข latency ของ endpoint ที่ router จะเลือกตอนนี้ (หรือ endpoint หลักถ้าไม่มีตัวไหนใช้ได้)
+    candidates = typhoon_router.candidates()
+    breaker = (candidates[0] if candidates else typhoon_router.primary).breaker.stats()
+    health_payload = json.dumps({
+        "status": "ok",
+        "service": "thai-handmate-backend",
+        "version": "1.0.0",
+        "has_api_key": typhoon_router.enabled,
+        "upstream": {
+            "state": typhoon_router.state(),
+            "error_rate": breaker["error_rate"],
+            "p50_ms": breaker["p50_ms"],
+            "p95_ms": breaker["p95_ms"],
+            "endpoints": len(typhoon_router.endpoints),
+            "endpoints_available": len(candidates)
+        },
+        "queue_depth": sum(len(endpoint.limiter.waiters) for endpoint in typhoon_router.endpoints),
+        "updated_at": round(time.time(), 3)
+    }).encode("utf-8")
+    return health_payload
+
+for upstream_endpoint in typhoon_router.endpoints:
+    upstream_endpoint.breaker.on_change = refresh_health
+
+async def probe_typhoon(endpoint: UpstreamEndpoint):
+    """ส่ง request เล็กๆ ไปทดสอบ endpoint ตอนวงจรเปิด (ผลลัพธ์ถูกบันทึกใน breaker ของ endpoint นั้น)"""
+    payload = {
+        "model": endpoint.model,
+        "messages": [{"role": "user", "content": "ping"}],
+        "max_tokens": 1
+    }
+    deadline = time.monotonic() + endpoint.limiter.max_wait
+    try:
+        await request_endpoint_content(endpoint, payload, deadline)
+        print(f"[INFO] Typhoon probe succeeded ({endpoint.name})")
+    except Exception as e:
+        print(f"[WARNING] Typhoon probe failed ({endpoint.name}): {e}")
+
+async def upstream_monitor():
+    """งานเบื้องหลัง: อัปเดต health payload, ส่ง probe เป็นระยะเมื่อวงจรเปิด และลบ session ที่หมดอายุ"""
+    probe_tasks = {}
+    while True:
+        # error รอบเดียวต้องไม่หยุด task นี้ ไม่งั้น /health ค้าง probe หยุด และ session ไม่หมดอายุ
+        try:
+            refresh_health()
+            capture_sessions.evict_expired()
+            for endpoint in typhoon_router.endpoints:
+                probe_task = probe_tasks.get(endpoint.name)
+                if endpoint.api_key and endpoint.breaker.probe_due() and (probe_task is None or probe_task.done()):
+                    probe_tasks[endpoint.name] = asyncio.create_task(probe_typhoon(endpoint))
+        except Exception as e:
+            print(f"[ERROR] Upstream monitor iteration failed: {e}")
+        await asyncio.sleep(HEALTH_REFRESH_SECONDS)
+
+# สถิติ cold start: เวลา import, startup และ request แรก (เทียบระหว่างโหมด development/production)
+startup_stats = {
+    "pid": os.getpid(),
+    "mode": SERVER_MODE,
+    "loop": None,
+    "import_ms": None,
+    "startup_ms": None,
+    "ready_ms": None,
+    "warmup": [],
+    "first_request": None
+}
+
+# request จาก probe (health check, scrape metrics) ไม่นับเป็น request แรก
+FIRST_REQUEST_IGNORED_PATHS = {"/api/health", "/metrics"}
+
+async def warm_upstream(endpoint: UpstreamEndpoint) -> dict:
+    """resolve DNS และเปิด connection ไปยัง endpoint ไว้ก่อน request แรก (ไม่ผ่าน rate limit และ breaker)"""
+    url = httpx.URL(endpoint.url)
+    port = url.port or (443 if url.scheme == "https" else 80)
+    result = {"endpoint": endpoint.name, "addresses": 0, "dns_ms": None, "connections": 0, "connect_ms": None, "error": None}
+    try:
+        started = time.perf_counter()
+        addresses = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM)
+        result["addresses"] = len(addresses)
+        result["dns_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        result["connections"] = await typhoon_http.warm(endpoint.url, UPSTREAM_WARMUP_CONNECTIONS)
+        result["connect_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    return result
+
+async def warm_upstreams():
+    """warm-up ทุก endpoint ที่มี API key พร้อมกัน (ถ้าไม่สำเร็จ request แรกจะเปิด connection เองตามปกติ)"""
+    endpoints = [endpoint for endpoint in typhoon_router.endpoints if endpoint.api_key]
+    if not UPSTREAM_WARMUP or not endpoints:
+        return
+    startup_stats["warmup"] = await asyncio.gather(*(warm_upstream(endpoint) for endpoint in endpoints))
+    for result in startup_stats["warmup"]:
+        if result["error"]:
+            print(f"[WARNING] Upstream warm-up failed ({result['endpoint']}): {result['error']}")
+        else:
+            print(f"[INFO] Upstream warm-up ({result['endpoint']}): {result['connections']} connections "
+                  f"(dns {result['dns_ms']}ms, connect {result['connect_ms']}ms)")
+
+def record_first_request(method: str, path: str, seconds: float):
+    """บันทึก latency ของ request แรกที่ตอบเสร็จหลัง startup (ไม่นับ health check และ metrics)"""
+    after_ready = None
+    if startup_stats["ready_ms"] is not None:
+        after_ready = round((time.perf_counter() - IMPORT_STARTED) * 1000 - startup_stats["ready_ms"], 1)
+    startup_stats["first_request"] = {
+        "method": method,
+        "path": path,
+        "ms": round(seconds * 1000, 1),
+        "after_ready_ms": after_ready
+    }
+    print(f"[INFO] First request {method} {path} served in {seconds * 1000:.1f}ms "
+          f"({after_ready}ms after ready)")
+
+# ตัวสร้างประโยคแบบ offline (สร้างตารางตอน startup ก่อนหน้านั้นประกอบประโยคตามกฎได้อยู่แล้ว)
+sentence_engine = SentenceEngine(min_confidence=OFFLINE_MIN_CONFIDENCE, precompute_length=OFFLINE_PRECOMPUTE_WORDS)
+
+def load_sentence_engine():
+    try:
+        sentence_engine.load(OFFLINE_METADATA_PATH)
+        print(f"[INFO] Offline sentence table built in {sentence_engine.build_ms:.1f}ms "
+              f"({len(sentence_engine.table)} entries)")
+    except Exception as e:
+        print(f"[WARNING] Offline sentence table not built, composing on demand: {e}")
+
+# Hand model (โหลดตอน startup ถ้ามี numpy และไฟล์ weights)
+hand_model = None
+hand_batcher = None
+hand_model_error = None
+
+def load_hand_model():
+    """โหลด hand model จาก HAND_MODEL_DIR ถ้าโหลดไม่ได้ endpoint จะตอบ 503 แต่แอปส่วนอื่นยังทำงานปกติ"""
+    global hand_model, hand_batcher, hand_model_error, np
+    if not HAND_MODEL_ENABLED:
+        hand_model_error = "disabled"
+        return
+    try:
+        import numpy as np
+        from hand_model import HandModel, MicroBatcher
+    except ImportError:
+        hand_model_error = "numpy is not installed"
+        print("[WARNING] numpy not installed - /api/predict/hand disabled")
+        return
+    try:
+        started = time.perf_counter()
+        hand_model = HandModel.load(HAND_MODEL_DIR, mmap=HAND_MODEL_MMAP)
+        hand_batcher = MicroBatcher(hand_model, max_batch=HAND_BATCH_MAX, max_wait_ms=HAND_BATCH_WAIT_MS)
+        hand_model_error = None
+        print(f"[INFO] Hand model loaded in {(time.perf_counter() - started) * 1000:.1f}ms "
+              f"({hand_model.input_size} features, {len(hand_model.labels)} labels)")
+    except Exception as e:
+        hand_model_error = str(e)
+        print(f"[WARNING] Hand model not loaded: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """เปิด/ปิดทรัพยากรที่ใช้ร่วมกันทั้งแอป"""
+    started = time.perf_counter()
+    typhoon_http.start()
+    if CACHE_ENABLED:
+        result_cache.open()
+    load_sentence_engine()
+    load_hand_model()
+    # warm-up ทำเบื้องหลัง ถ้า upstream ติดต่อไม่ได้จะไม่หน่วงเวลาพร้อมรับ request ไปถึง connect timeout
+    warmup_task = asyncio.create_task(warm_upstreams())
+    monitor_task = asyncio.create_task(upstream_monitor())
+
+    loop_module = type(asyncio.get_running_loop()).__module__
+    startup_stats["loop"] = "uvloop" if loop_module.startswith("uvloop") else "asyncio"
+    startup_stats["startup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    startup_stats["ready_ms"] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+    print(f"[INFO] Ready in {startup_stats['ready_ms']}ms (import {startup_stats['import_ms']}ms, "
+          f"startup {startup_stats['startup_ms']}ms, loop {startup_stats['loop']}, pid {startup_stats['pid']})")
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        monitor_task.cancel()
+        await typhoon_http.close()
+        result_cache.close()
+        for endpoint in typhoon_router.endpoints:
+            endpoint.limiter.bucket.close()
+        if hand_batcher is not None:
+            await hand_batcher.close()
 
 app = FastAPI(
     title="Thai-HandMate Backend",
     description="API สำหรับสร้างประโยคไทยจากคำภาษามือ",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # ตั้งค่า CORS
@@ -72,9 +1253,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# การตั้งค่า
-TYPHOON_API_KEY = os.getenv('TYPHOON_API_KEY', '')
-TYPHOON_API_BASE = os.getenv('TYPHOON_API_BASE', 'https://api.typhoon.io/v1/chat/completions')
+# Metrics middleware (ASGI ตรงๆ เพื่อให้ contextvar ของ request ส่งต่อถึง endpoint)
+class MetricsMiddleware:
+    """วัดเวลาต่อ request, นับ in-flight และแนบ Server-Timing เมื่อเปิดใช้"""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def route_path(scope) -> str:
+        # ใช้ path template ของ route เป็น label เพื่อไม่ให้ label แตกตาม id
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        IN_FLIGHT.inc()
+
+        async def send_with_timing(message):
+            if SERVER_TIMING and message["type"] == "http.response.start":
+                entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+                entries.append(f"total;dur={(time.perf_counter() - started) * 1000:.2f}")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(entries).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            IN_FLIGHT.dec()
+            request_timings.reset(token)
+            elapsed = time.perf_counter() - started
+            path = self.route_path(scope)
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], path=path)
+            if startup_stats["first_request"] is None and path not in FIRST_REQUEST_IGNORED_PATHS:
+                record_first_request(scope["method"], path, elapsed)
+
+app.add_middleware(MetricsMiddleware)
 
 # Models
 class LLMData(BaseModel):
@@ -99,22 +1324,142 @@ class GenerateRequest(BaseModel):
 class GenerateResponse(BaseModel):
     sentences: List[str]
     provider: str
+    timing: Optional[dict] = None  # เวลาที่ใช้ของแต่ละเส้นทาง (typhoon/fallback) และงบเวลา
+    prompt: Optional[dict] = None  # ขนาด prompt ก่อน/หลังย่อ (เฉพาะ request ที่สร้าง prompt ส่ง Typhoon)
+
+class BatchRequest(BaseModel):
+    """Request สำหรับสร้างประโยคหลายชุดในครั้งเดียว (แต่ละ item เป็น format เก่าหรือใหม่ก็ได้)"""
+    items: List[dict]
+    mode: str = "fanout"  # "fanout" = ยิงแยกทีละ item พร้อมกัน, "pack" = รวมหลาย item ใน prompt เดียว, "offline" = ไม่เรียก Typhoon
+    packSize: int = 5  # จำนวน item ต่อหนึ่ง prompt ในโหมด pack
+
+class BatchItemResult(BaseModel):
+    index: int
+    sentences: List[str] = []
+    provider: str
+    latencyMs: float
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    mode: str
+    results: List[BatchItemResult]
+    totalMs: float
+
+class HandPredictRequest(BaseModel):
+    """pose feature vector ของ hand model (ส่งเป็นตัวเลข หรือ float32 little-endian แบบ base64 ก็ได้)"""
+    features: List[List[float]] = []
+    featuresBase64: List[str] = []
+    topK: int = 3
+
+class HandPrediction(BaseModel):
+    label: str
+    confidence: float
+
+class HandPredictResponse(BaseModel):
+    predictions: List[List[HandPrediction]]
+    latencyMs: float
 
 # Health check endpoint
 @app.get("/api/health")
 async def health_check():
-    """ตรวจสอบสถานะ API"""
+    """ตรวจสอบสถานะ API (รวมสถานะ upstream, latency และความยาวคิว)"""
+    return Response(content=health_payload or refresh_health(), media_type="application/json")
+
+# Admin stats endpoint
+@app.get("/api/admin/stats")
+async def admin_stats():
+    """สถิติภายในของ backend สำหรับตรวจสอบประสิทธิภาพ"""
     return {
-        "status": "ok",
-        "service": "thai-handmate-backend",
-        "version": "1.0.0",
-        "has_api_key": bool(TYPHOON_API_KEY)
+        "upstream": typhoon_http.stats(),
+        "rate_limiter": typhoon_limiter.stats(),
+        "cache": dict(result_cache.stats(), enabled=CACHE_ENABLED),
+        "circuit_breaker": typhoon_breaker.stats(),
+        "upstream_router": typhoon_router.stats(),
+        "single_flight": typhoon_flights.stats(),
+        "sessions": capture_sessions.stats(),
+        "speculation": speculator.stats(),
+        "websocket": dict(ws_stats),
+        "offline_engine": sentence_engine.stats(),
+        "prompt": dict(
+            prompt_stats,
+            compaction=PROMPT_COMPACTION,
+            confidence_floor=PROMPT_CONFIDENCE_FLOOR,
+            saved_ratio=round(1 - prompt_stats["chars_after"] / prompt_stats["chars_before"], 4)
+            if prompt_stats["chars_before"] else 0.0
+        ),
+        "hand_model": {
+            "loaded": hand_model is not None,
+            "error": hand_model_error,
+            "model": hand_model.info() if hand_model is not None else None,
+            "batching": hand_batcher.stats() if hand_batcher is not None else None
+        },
+        "startup": startup_stats,
+        "latency_budget": dict(budget_stats, default_ms=LATENCY_BUDGET_MS),
+        "streaming": {
+            "streams": stream_stats["streams"],
+            "early_stops": stream_stats["early_stops"],
+            "avg_first_sentence_ms": round(
+                stream_stats["first_sentence_ms_total"] / stream_stats["first_sentence_count"], 1
+            ) if stream_stats["first_sentence_count"] else 0.0
+        }
     }
 
-# Generate sentences endpoint
-@app.post("/api/generate", response_model=GenerateResponse)
-async def generate_sentences(request: dict):
-    """สร้างประโยคไทยจากรายการคำ (รองรับทั้ง format เก่าและใหม่)"""
+# Prometheus metrics endpoint
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Metrics ในรูปแบบ Prometheus text format"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.delete("/api/admin/cache")
+async def admin_clear_cache():
+    """ล้าง cache ผลลัพธ์ทั้งในหน่วยความจำและบนดิสก์"""
+    result_cache.clear()
+    return {"status": "ok"}
+
+# Generate job (แปลง request ทั้ง format เก่าและใหม่ให้อยู่ในรูปเดียวกัน)
+class GenerateJob:
+    """ข้อมูลที่ใช้สร้างประโยคหนึ่งชุด หลังแปลงจาก request แล้ว"""
+
+    def __init__(self, words: List[str], emotion: str = "neutral", word_confidences: List[float] = None,
+                 emotion_confidences: List[float] = None, unified_req: UnifiedRequest = None):
+        self.words = words
+        self.emotion = emotion
+        self.word_confidences = word_confidences or []
+        self.emotion_confidences = emotion_confidences or []
+        self.unified_req = unified_req
+        self.is_unified = unified_req is not None
+        self.prompt_usage = None
+        self.cache_key = make_cache_key(
+            "unified" if self.is_unified else "legacy",
+            words,
+            emotion,
+            self.word_confidences,
+            self.emotion_confidences,
+            bucket_step=CACHE_CONFIDENCE_BUCKET
+        )
+
+    def build_payload(self) -> dict:
+        """payload สำหรับ Typhoon API (บันทึกขนาด prompt ไว้ที่ prompt_usage)"""
+        with stage_timer("prompt"):
+            if self.is_unified:
+                original_json, data_json = unified_prompt_data(self.unified_req.capturedData, self.unified_req.summary)
+                payload = build_typhoon_unified_payload_from_json(data_json, self.words)
+                self.prompt_usage = record_prompt_usage(payload, original_json, data_json)
+            else:
+                payload = build_typhoon_payload(self.words, self.emotion, self.word_confidences, self.emotion_confidences)
+                self.prompt_usage = record_prompt_usage(payload)
+            return payload
+
+    async def generate_typhoon(self) -> List[str]:
+        """สร้างประโยคด้วย Typhoon (ถ้ามี unified data ให้ส่งไปด้วย)"""
+        return await request_typhoon(self.build_payload())
+
+    def fallback(self) -> List[str]:
+        """สร้างประโยคแบบง่ายเมื่อใช้ Typhoon ไม่ได้"""
+        return generate_fallback_sentences(self.words, self.emotion, self.word_confidences)
+
+def parse_generate_request(request: dict) -> GenerateJob:
+    """แปลง request (รองรับทั้ง format เก่าและใหม่) เป็น GenerateJob"""
     
     # ตรวจสอบ format ของ request
     if "capturedData" in request and "summary" in request:
@@ -137,6 +1482,7 @@ async def generate_sentences(request: dict):
     else:
         # Format เดิม
         gen_req = GenerateRequest(**request)
+        unified_req = None
         words = gen_req.words
         emotion = gen_req.emotion
         word_confidences = gen_req.wordConfidences
@@ -145,39 +1491,856 @@ async def generate_sentences(request: dict):
     if not words:
         raise HTTPException(status_code=400, detail="ต้องระบุคำอย่างน้อย 1 คำ")
     
+    return GenerateJob(words, emotion, word_confidences, emotion_confidences, unified_req)
+
+class SessionGenerateJob(GenerateJob):
+    """GenerateJob จาก capture session: ใช้ข้อมูลที่ session serialize ไว้แล้วแทนการสร้าง prompt ใหม่ทั้งหมด"""
+
+    def __init__(self, session):
+        # คัดลอกสถานะ ณ ตอนนี้ เผื่อมี capture ใหม่เข้ามาระหว่างรอ Typhoon
+        self.words = list(session.words)
+        self.emotion = session.overall_emotion
+        self.word_confidences = list(session.word_confidences)
+        self.emotion_confidences = list(session.emotion_confidences)
+        self.unified_req = None
+        self.is_unified = True
+        self.session_id = session.id
+        self.original_json = session.data_json()
+        self.data_json = session.compact_json()
+        self.cache_key = session.cache_key(session_cache_key)
+        self.prompt_usage = None
+
+    def build_payload(self) -> dict:
+        with stage_timer("prompt"):
+            payload = build_typhoon_unified_payload_from_json(self.data_json, self.words)
+            self.prompt_usage = record_prompt_usage(payload, self.original_json, self.data_json)
+            return payload
+
+    async def generate_typhoon(self) -> List[str]:
+        return await request_typhoon(self.build_payload())
+
+def packed_cache_key(job: GenerateJob) -> str:
+    """key ของ result cache สำหรับคำตอบจากโหมด pack (สร้างจาก prompt รวมที่มี context น้อยกว่า จึงไม่ใช้ key ร่วมกับ request เดี่ยว)"""
+    return make_cache_key(
+        "packed-unified" if job.is_unified else "packed-legacy",
+        job.words,
+        job.emotion,
+        job.word_confidences,
+        job.emotion_confidences,
+        bucket_step=CACHE_CONFIDENCE_BUCKET
+    )
+
+def session_cache_key(session) -> str:
+    """key ของ result cache สำหรับ session (prompt ต่างจาก unified request จึงใช้ kind แยก)"""
+    return make_cache_key(
+        "session",
+        session.words,
+        session.overall_emotion,
+        session.word_confidences,
+        session.emotion_confidences,
+        bucket_step=CACHE_CONFIDENCE_BUCKET
+    )
+
+def get_session_or_404(session_id: str):
+    session = capture_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="ไม่พบ session หรือ session หมดอายุแล้ว")
+    return session
+
+# Speculative generation (สร้างประโยคล่วงหน้าเมื่อลำดับคำใน session นิ่งแล้ว)
+class Speculation:
+    """งานสร้างประโยคล่วงหน้าของ session หนึ่ง ณ version หนึ่ง (ใช้เป็น ticket ของ rate limiter ด้วย)"""
+
+    def __init__(self, session):
+        self.session = session
+        self.session_id = session.id
+        self.version = session.version
+        self.job = None  # SessionGenerateJob สร้างหลังคำนิ่งแล้วเท่านั้น (serialize ทั้ง session ครั้งเดียวต่อ version)
+        self.state = "waiting"  # waiting → (deferred →) running → ready / failed
+        self.task = None  # task ที่รอให้ลำดับคำนิ่งแล้วเรียก Typhoon
+        self.flight = None  # task ของ single-flight ที่เรียก Typhoon จริง
+        self.result = None
+        self.hit = False
+
+        # ใช้โดย rate limiter
+        self.promoted = False
+        self.waiter = None
+        self.granted = 0  # จำนวน upstream call ที่ได้ token ไปแล้ว
+
+class SpeculativeGenerator:
+    """จัดการงานล่วงหน้าทุก session: เริ่มเมื่อคำนิ่ง ยกเลิกเมื่อคำเปลี่ยน และนับ hit / call ที่เสียเปล่า"""
+
+    def __init__(self, stable_ms: float = 1500.0, max_inflight: int = 1, enabled: bool = True):
+        self.stable_ms = stable_ms
+        self.max_inflight = max_inflight
+        self.enabled = enabled
+        self.by_session = {}  # session_id -> Speculation
+        self.listeners = {}  # session_id -> set ของ callback(version, sentences, provider) -> ส่งถึง client หรือไม่
+        self.deferred = deque()  # งานที่คำนิ่งแล้วแต่งานล่วงหน้าเต็ม รอ slot ว่าง
+
+        # สถิติ
+        self.scheduled = 0
+        self.started = 0
+        self.skipped = 0
+        self.deferred_total = 0
+        self.hits = 0
+        self.cancelled = 0
+        self.upstream_calls = 0
+        self.wasted_calls = 0
+
+    def inflight(self) -> int:
+        return sum(1 for spec in self.by_session.values() if spec.state == "running")
+
+    def schedule(self, session):
+        """เรียกทุกครั้งที่ session เปลี่ยน: ทิ้งงานของ version เก่าแล้วตั้งเวลาสำหรับ version ใหม่"""
+        self.discard(session.id)
+        if not self.enabled or not typhoon_router.enabled or not session.words:
+            return
+        spec = Speculation(session)
+        spec.task = asyncio.create_task(self._run(spec))
+        self.by_session[session.id] = spec
+        self.scheduled += 1
+
+    async def _run(self, spec: Speculation, delay: bool = True):
+        if delay:
+            await asyncio.sleep(self.stable_ms / 1000)
+        if spec.session.version != spec.version:
+            spec.state = "skipped"
+            return
+        if spec.job is None:
+            spec.job = SessionGenerateJob(spec.session)
+        key = spec.job.cache_key
+
+        # ไม่ต้องเรียกถ้ามีผลอยู่แล้ว กำลังมี call เดียวกันอยู่ หรือวงจรเปิด
+        cached = result_cache.memory.get(key) if CACHE_ENABLED else None
+        if cached is not None or key in typhoon_flights.inflight or not typhoon_router.healthy():
+            self.skipped += 1
+            spec.state = "skipped"
+            if cached is not None:
+                self._notify(spec, list(cached), "typhoon-cache")
+            return
+        if self.inflight() >= self.max_inflight:
+            # งานล่วงหน้าเต็ม: รอจนงานที่ทำอยู่จบแล้วค่อยเริ่ม (ถ้าลำดับคำยังไม่เปลี่ยน)
+            spec.state = "deferred"
+            self.deferred.append(spec)
+            self.deferred_total += 1
+            return
+
+        async def speculative_call():
+            background_ticket.set(spec)
+            return await spec.job.generate_typhoon()
+
+        spec.state = "running"
+        spec.flight = typhoon_flights.start(key, cached_typhoon_call(key, speculative_call))
+        self.started += 1
+        SPECULATION_TOTAL.inc(outcome="started")
+        try:
+            spec.result = await asyncio.shield(spec.flight)
+            spec.state = "ready"
+            if self._notify(spec, list(spec.result), "typhoon-speculative"):
+                self._hit(spec)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            spec.state = "failed"
+            print(f"[WARNING] Speculative generation failed: {e}")
+        finally:
+            self.upstream_calls += spec.granted
+            self._resume()
+
+    def _resume(self):
+        """เริ่มงานที่รอ slot อยู่ เท่าจำนวน slot ที่ว่าง"""
+        free = self.max_inflight - self.inflight()
+        while free > 0 and self.deferred:
+            spec = self.deferred.popleft()
+            if self.by_session.get(spec.session_id) is not spec or spec.state != "deferred":
+                continue
+            spec.state = "waiting"
+            spec.task = asyncio.create_task(self._run(spec, delay=False))
+            free -= 1
+
+    def _hit(self, spec: Speculation):
+        if not spec.hit:
+            spec.hit = True
+            self.hits += 1
+            SPECULATION_TOTAL.inc(outcome="hit")
+
+    def _notify(self, spec: Speculation, sentences: List[str], provider: str) -> bool:
+        """ส่งผลให้ client ที่ติดตาม session อยู่ ถ้างานนี้ยังเป็นของลำดับคำปัจจุบัน คืนว่าส่งถึง client อย่างน้อยหนึ่งตัวหรือไม่"""
+        listeners = self.listeners.get(spec.session_id)
+        if not listeners or self.by_session.get(spec.session_id) is not spec:
+            return False
+        delivered = [listener(spec.version, sentences, provider) for listener in list(listeners)]
+        return any(delivered)
+
+    def subscribe(self, session_id: str, listener):
+        self.listeners.setdefault(session_id, set()).add(listener)
+
+    def unsubscribe(self, session_id: str, listener):
+        listeners = self.listeners.get(session_id)
+        if listeners is not None:
+            listeners.discard(listener)
+            if not listeners:
+                del self.listeners[session_id]
+
+    def claim(self, session) -> Optional[List[str]]:
+        """เรียกตอนผู้ใช้กดสร้างประโยค คืนประโยคที่สร้างเสร็จแล้วถ้าตรงกับลำดับคำปัจจุบัน
+
+        ถ้ายังทำอยู่ จะเลื่อนขึ้นคิวผู้ใช้ แล้ว request ของผู้ใช้จะรอผลเดียวกันผ่าน single-flight
+        """
+        spec = self.by_session.get(session.id)
+        if spec is None or spec.version != session.version:
+            return None
+        if spec.state in ("waiting", "deferred"):
+            # ผู้ใช้กดก่อนคำจะนิ่ง (หรือก่อนงานล่วงหน้าได้เริ่ม): ยกเลิกงานล่วงหน้า ให้ request ของผู้ใช้ทำเอง
+            self.discard(session.id)
+            return None
+        if spec.state not in ("running", "ready"):
+            return None
+        self._hit(spec)
+        if spec.state == "ready":
+            return list(spec.result)
+        typhoon_router.promote(spec)
+        return None
+
+    def discard(self, session_id: str):
+        """ทิ้งงานล่วงหน้าของ session (ลำดับคำเปลี่ยนหรือ session ถูกลบ)"""
+        spec = self.by_session.pop(session_id, None)
+        if spec is None:
+            return
+        if spec.state in ("waiting", "deferred"):
+            spec.task.cancel()
+            self.cancelled += 1
+            SPECULATION_TOTAL.inc(outcome="cancelled")
+            return
+        if spec.state == "running" and spec.granted == 0 and typhoon_flights.waiters.get(spec.job.cache_key, 0) == 0:
+            # ยังรอคิวอยู่และไม่มีผู้ใช้รอผล: ยกเลิกได้โดยไม่เสีย quota
+            spec.flight.cancel()
+            self.cancelled += 1
+            SPECULATION_TOTAL.inc(outcome="cancelled")
+            return
+        if spec.state in ("running", "ready", "failed") and not spec.hit and spec.granted:
+            # เรียก upstream ไปแล้วแต่ไม่มีใครใช้ผล (ถ้ายังทำอยู่ ผลจะลง cache ไว้ใช้ครั้งหน้า)
+            self.wasted_calls += spec.granted
+            SPECULATION_TOTAL.inc(spec.granted, outcome="wasted")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled and typhoon_router.enabled,
+            "stable_ms": self.stable_ms,
+            "max_inflight": self.max_inflight,
+            "pending": len(self.by_session),
+            "inflight": self.inflight(),
+            "scheduled": self.scheduled,
+            "started": self.started,
+            "skipped": self.skipped,
+            "deferred": self.deferred_total,
+            "cancelled": self.cancelled,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.started, 4) if self.started else 0.0,
+            "upstream_calls": self.upstream_calls,
+            "wasted_upstream_calls": self.wasted_calls
+        }
+
+speculator = SpeculativeGenerator(
+    stable_ms=SPECULATION_STABLE_MS,
+    max_inflight=SPECULATION_MAX_INFLIGHT,
+    enabled=SPECULATION_ENABLED
+)
+capture_sessions.on_remove = lambda session: speculator.discard(session.id)
+
+def report_typhoon_error(e: Exception):
+    """พิมพ์สาเหตุที่ Typhoon ใช้ไม่ได้ก่อนตัดไปใช้ fallback"""
+    error_msg = str(e)
+    if isinstance(e, CircuitOpenError) or "Circuit open" in error_msg:
+        TYPHOON_FAILURES_TOTAL.inc(reason="circuit_open")
+        print("[WARNING] Typhoon circuit open - using fallback")
+    elif "Rate limit exceeded" in error_msg:
+        TYPHOON_FAILURES_TOTAL.inc(reason="rate_limit")
+        print("[WARNING] Rate limit exceeded - using fallback")
+    elif "Timeout" in error_msg:
+        TYPHOON_FAILURES_TOTAL.inc(reason="timeout")
+        print("[WARNING] API Timeout - using fallback")
+    else:
+        TYPHOON_FAILURES_TOTAL.inc(reason="exception")
+        print(f"[ERROR] Typhoon API failed: {e}")
+
+# สถิติการตัดไปใช้ fallback เมื่อเกินงบเวลา
+budget_stats = {
+    "budget_expired": 0,
+    "late_completions": 0,
+    "late_failures": 0
+}
+
+def on_late_typhoon(task: asyncio.Task):
+    """Typhoon ที่ตอบหลังหมดงบเวลา: ผลลัพธ์ถูกเก็บใน cache แล้ว (ใน run_typhoon) ไว้ใช้ครั้งหน้า"""
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        budget_stats["late_failures"] += 1
+    else:
+        budget_stats["late_completions"] += 1
+
+async def resolve_job(job: GenerateJob, budget_ms: float = None):
+    """สร้างประโยคของ job หนึ่งชุด: cache → Typhoon → fallback
+
+    ถ้ากำหนด budget_ms แล้ว Typhoon ตอบไม่ทัน จะคืน fallback ทันทีแต่ปล่อยให้ Typhoon ทำงานต่อเบื้องหลัง
+    คืนค่า (sentences, provider, timing)
+    """
+    started = time.perf_counter()
+    timing = {"budgetMs": budget_ms or None, "typhoonMs": None, "fallbackMs": None}
+
+    def elapsed_ms():
+        return round((time.perf_counter() - started) * 1000, 1)
+    
+    # ดูใน cache ก่อน (ประโยคที่ Typhoon เคยสร้างให้ด้วยข้อมูลแบบเดียวกัน)
+    if CACHE_ENABLED:
+        cached_sentences = result_cache.get(job.cache_key)
+        if cached_sentences:
+            timing["totalMs"] = elapsed_ms()
+            return cached_sentences, "typhoon-cache", timing
+    
     # ลองใช้ Typhoon API ก่อน
-    if TYPHOON_API_KEY:
+    if typhoon_router.enabled:
+        # task จะได้สำเนา context ตอนสร้าง ถ้ารอคิว rate limit ไม่ทันงบเวลาจะ fail ทันทีแทนที่จะรอจนหมดงบ
+        deadline_token = None
+        if budget_ms and budget_ms > 0:
+            deadline_token = budget_deadline.set(time.monotonic() + budget_ms / 1000)
         try:
-            # ถ้ามี unified data ให้ส่งไปด้วย
-            if "capturedData" in request:
-                sentences = await generate_with_typhoon_unified(
-                    unified_req.capturedData,
-                    unified_req.summary
-                )
-            else:
-                sentences = await generate_with_typhoon(
-                    words, 
-                    emotion, 
-                    word_confidences, 
-                    emotion_confidences
-                )
-            return GenerateResponse(sentences=sentences, provider="typhoon")
+            task = asyncio.ensure_future(run_typhoon(job.cache_key, job.generate_typhoon))
+        finally:
+            if deadline_token is not None:
+                budget_deadline.reset(deadline_token)
+        try:
+            if budget_ms and budget_ms > 0:
+                done, _ = await asyncio.wait({task}, timeout=budget_ms / 1000)
+                if not done:
+                    # หมดงบเวลา: ตอบด้วย fallback เลย ผลของ Typhoon จะลง cache เมื่อเสร็จ
+                    budget_stats["budget_expired"] += 1
+                    TYPHOON_FAILURES_TOTAL.inc(reason="latency_budget")
+                    task.add_done_callback(on_late_typhoon)
+                    print(f"[WARNING] Latency budget {budget_ms:.0f}ms exceeded - using fallback")
+                    fallback_started = time.perf_counter()
+                    sentences = job.fallback()
+                    timing["fallbackMs"] = round((time.perf_counter() - fallback_started) * 1000, 3)
+                    timing["totalMs"] = elapsed_ms()
+                    return sentences, "fallback", timing
+            sentences = await task
+            timing["typhoonMs"] = elapsed_ms()
+            timing["totalMs"] = timing["typhoonMs"]
+            return sentences, "typhoon", timing
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
         except Exception as e:
-            error_msg = str(e)
-            if "Rate limit exceeded" in error_msg:
-                print("[WARNING] Rate limit exceeded - using fallback")
-            elif "Timeout" in error_msg:
-                print("[WARNING] API Timeout - using fallback")
-            else:
-                print(f"[ERROR] Typhoon API failed: {e}")
+            timing["typhoonMs"] = elapsed_ms()
+            report_typhoon_error(e)
             # If API fails, use fallback
     
     # Fallback: สร้างประโยคแบบง่าย
-    fallback_sentences = generate_fallback_sentences(words, emotion, word_confidences)
-    return GenerateResponse(sentences=fallback_sentences, provider="fallback")
+    fallback_started = time.perf_counter()
+    sentences = job.fallback()
+    timing["fallbackMs"] = round((time.perf_counter() - fallback_started) * 1000, 3)
+    timing["totalMs"] = elapsed_ms()
+    return sentences, "fallback", timing
+
+def request_budget_ms(request: dict, header_value: Optional[str]) -> float:
+    """งบเวลาของ request: field latencyBudgetMs > header X-Latency-Budget-Ms > ค่า default ของ server"""
+    for value in (request.get("latencyBudgetMs"), header_value):
+        if value is None or value == "":
+            continue
+        try:
+            return max(float(value), 0.0)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="latencyBudgetMs ต้องเป็นตัวเลข (มิลลิวินาที)")
+    return LATENCY_BUDGET_MS
+
+# Generate sentences endpoint
+@app.post("/api/generate", response_model=GenerateResponse)
+async def generate_sentences(request: dict, x_latency_budget_ms: Optional[str] = Header(default=None)):
+    """สร้างประโยคไทยจากรายการคำ (รองรับทั้ง format เก่าและใหม่)"""
+    with stage_timer("parse"):
+        job = parse_generate_request(request)
+    budget_ms = request_budget_ms(request, x_latency_budget_ms)
+    sentences, provider, timing = await resolve_job(job, budget_ms)
+    RESPONSES_TOTAL.inc(provider=provider)
+    return GenerateResponse(sentences=sentences, provider=provider, timing=timing, prompt=job.prompt_usage)
+
+async def resolve_session_job(session, job: SessionGenerateJob, budget_ms: float = None):
+    """เหมือน resolve_job แต่ถ้ามีประโยคที่สร้างล่วงหน้าไว้แล้วสำหรับลำดับคำนี้ จะตอบได้ทันที"""
+    started = time.perf_counter()
+    speculative_sentences = speculator.claim(session)
+    if speculative_sentences:
+        total_ms = round((time.perf_counter() - started) * 1000, 3)
+        timing = {"budgetMs": budget_ms or None, "typhoonMs": None, "fallbackMs": None, "totalMs": total_ms}
+        return speculative_sentences, "typhoon-speculative", timing
+    return await resolve_job(job, budget_ms)
+
+# Capture session endpoints
+@app.post("/api/sessions")
+async def create_session():
+    """สร้าง capture session ใหม่"""
+    session = capture_sessions.create()
+    return session.info()
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    """ดูสรุปของ session (ลำดับคำ, histogram อารมณ์, สถิติ confidence)"""
+    return get_session_or_404(session_id).info()
+
+@app.post("/api/sessions/{session_id}/captures")
+async def append_session_capture(session_id: str, capture: LLMData):
+    """เพิ่มภาพที่จับได้หนึ่งภาพเข้า session"""
+    session = get_session_or_404(session_id)
+    try:
+        entry = capture_sessions.append(session, capture.model_dump())
+    except InvalidCaptureError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SessionLimitError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    speculator.schedule(session)
+    return {
+        "sessionId": session.id,
+        "version": session.version,
+        "totalCaptures": len(session.words),
+        "capture": entry
+    }
+
+@app.post("/api/sessions/{session_id}/generate", response_model=GenerateResponse)
+async def generate_session_sentences(session_id: str, request: Optional[dict] = None,
+                                     x_latency_budget_ms: Optional[str] = Header(default=None)):
+    """สร้างประโยคจาก capture ทั้งหมดใน session"""
+    request = request or {}
+    with stage_timer("parse"):
+        session = get_session_or_404(session_id)
+        if not session.words:
+            raise HTTPException(status_code=400, detail="ต้องระบุคำอย่างน้อย 1 คำ")
+        job = SessionGenerateJob(session)
+    budget_ms = request_budget_ms(request, x_latency_budget_ms)
+    sentences, provider, timing = await resolve_session_job(session, job, budget_ms)
+    RESPONSES_TOTAL.inc(provider=provider)
+    return GenerateResponse(sentences=sentences, provider=provider, timing=timing, prompt=job.prompt_usage)
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """ลบ session (เช่น เมื่อผู้ใช้กดล้างคำทั้งหมด)"""
+    if not capture_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="ไม่พบ session หรือ session หมดอายุแล้ว")
+    return {"status": "ok"}
+
+# WebSocket endpoint (ส่ง capture ต่อเนื่องและรับประโยคแนะนำผ่าน connection เดียว)
+ws_stats = {
+    "connections": 0,
+    "active": 0,
+    "messages_in": 0,
+    "messages_out": 0,
+    "coalesced": 0
+}
+
+class CoalescingSender:
+    """คิวส่งข้อความของ WebSocket หนึ่ง connection ที่เก็บเฉพาะข้อความล่าสุดของแต่ละชนิด
+
+    client ที่อ่านช้าจะได้ update ล่าสุดแทน update ทุกตัว หน่วยความจำต่อ connection จึงคงที่
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.pending = {}  # ชนิดข้อความ -> ข้อความล่าสุดที่ยังไม่ได้ส่ง
+        self.wakeup = asyncio.Event()
+
+    def push(self, kind: str, message: dict):
+        if kind in self.pending:
+            ws_stats["coalesced"] += 1
+        self.pending[kind] = message
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                kind = next(iter(self.pending))
+                message = self.pending.pop(kind)
+                # รอจน client รับได้ (TCP backpressure) ระหว่างนี้ข้อความใหม่ชนิดเดียวกันจะทับของเก่า
+                try:
+                    await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+                except (WebSocketDisconnect, RuntimeError):
+                    # connection ปิดแล้ว ฝั่งรับจะจบ loop เอง
+                    return
+                ws_stats["messages_out"] += 1
+
+def capture_from_frame(frame: dict) -> dict:
+    """แปลง frame จาก WebSocket เป็นรูปแบบเดียวกับ LLMData (รองรับทั้งแบบเต็มและแบบย่อ)"""
+    data = frame.get("data", frame)
+    if not isinstance(data, dict):
+        raise ValueError("capture ต้องเป็น JSON object")
+    if isinstance(data.get("signLanguage"), dict):
+        capture = data
+        word = data["signLanguage"].get("bestWord") or data["signLanguage"].get("word")
+    else:
+        # แบบย่อ: {"word": ..., "confidence": ..., "emotion": ..., "emotionConfidence": ...}
+        word = data.get("word")
+        capture = {
+            "signLanguage": {"bestWord": word, "confidence": data.get("confidence", 0)},
+            "emotion": {"emotion": data.get("emotion") or "neutral", "confidence": data.get("emotionConfidence", 0)},
+            "face": {"detected": data.get("faceDetected", False), "faceCount": data.get("faceCount", 0)}
+        }
+    if not isinstance(word, str) or not word.strip():
+        raise ValueError("word ต้องเป็นข้อความที่ไม่ว่าง")
+    return capture
+
+def session_ready_message(session) -> dict:
+    return {
+        "type": "ready",
+        "sessionId": session.id,
+        "version": session.version,
+        "totalCaptures": len(session.words)
+    }
+
+@app.websocket("/ws")
+async def capture_websocket(websocket: WebSocket):
+    """รับ capture ต่อเนื่อง (ข้อความ JSON) แล้วส่งประโยคแนะนำกลับทันทีที่พร้อม
+
+    ข้อความจาก client: capture, generate, reset, ping
+    ข้อความจาก server: ready, ack, suggestion (final=false คือ fallback ชั่วคราว), error, pong
+    """
+    await websocket.accept()
+    session = None
+    session_id = websocket.query_params.get("sessionId")
+    if session_id:
+        session = capture_sessions.get(session_id)
+    if session is None:
+        session = capture_sessions.create()
+
+    sender = CoalescingSender(websocket)
+    sender_task = asyncio.create_task(sender.run())
+    generate_task = None
+    ws_stats["connections"] += 1
+    ws_stats["active"] += 1
+
+    delivered = None  # (session id, version) ของประโยค final ล่าสุดที่ส่งไปแล้ว
+
+    def deliver(session_id: str, version: int, sentences: List[str], provider: str) -> bool:
+        """ส่งประโยค final ของ version นี้ (ครั้งเดียวต่อ version แม้ generate และงานล่วงหน้าจะเสร็จทั้งคู่)"""
+        nonlocal delivered
+        if delivered == (session_id, version):
+            return False
+        delivered = (session_id, version)
+        RESPONSES_TOTAL.inc(provider=provider)
+        sender.push("suggestion", {
+            "type": "suggestion",
+            "version": version,
+            "sentences": sentences,
+            "provider": provider,
+            "final": True
+        })
+        return True
+
+    def on_suggestion(version: int, sentences: List[str], provider: str) -> bool:
+        return deliver(session.id, version, sentences, provider)
+
+    def attach(new_session):
+        nonlocal session
+        speculator.unsubscribe(session.id, on_suggestion)
+        session = new_session
+        speculator.subscribe(session.id, on_suggestion)
+        sender.push("ready", session_ready_message(session))
+
+    async def generate_now(current):
+        version = current.version
+        job = SessionGenerateJob(current)
+        sentences, provider, _ = await resolve_session_job(current, job, LATENCY_BUDGET_MS)
+        deliver(current.id, version, sentences, provider)
+
+    speculator.subscribe(session.id, on_suggestion)
+    sender.push("ready", session_ready_message(session))
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            ws_stats["messages_in"] += 1
+            raw = frame.get("text")
+            if raw is None:
+                sender.push("error", {"type": "error", "detail": "รองรับเฉพาะข้อความแบบ text (JSON)"})
+                continue
+            try:
+                message = json.loads(raw)
+                kind = message.get("type")
+            except (ValueError, AttributeError):
+                sender.push("error", {"type": "error", "detail": "ข้อความต้องเป็น JSON object"})
+                continue
+
+            # session อาจหมดอายุหรือถูก evict ระหว่างที่ connection เปิดอยู่
+            if capture_sessions.get(session.id) is None:
+                attach(capture_sessions.create())
+
+            if kind == "capture":
+                try:
+                    entry = capture_sessions.append(session, capture_from_frame(message))
+                except (SessionLimitError, ValueError) as e:
+                    sender.push("error", {"type": "error", "detail": str(e)})
+                    continue
+                speculator.schedule(session)
+                sender.push("ack", {
+                    "type": "ack",
+                    "version": session.version,
+                    "totalCaptures": len(session.words),
+                    "word": entry["word"]
+                })
+                # ประโยคชั่วคราวจาก fallback ทันที แล้วค่อยแทนด้วยผลจาก Typhoon เมื่อพร้อม
+                sender.push("suggestion", {
+                    "type": "suggestion",
+                    "version": session.version,
+                    "sentences": generate_fallback_sentences(session.words, session.overall_emotion, session.word_confidences),
+                    "provider": "fallback",
+                    "final": False
+                })
+            elif kind == "generate":
+                if not session.words:
+                    sender.push("error", {"type": "error", "detail": "ต้องระบุคำอย่างน้อย 1 คำ"})
+                elif generate_task is None or generate_task.done():
+                    generate_task = asyncio.create_task(generate_now(session))
+            elif kind == "reset":
+                capture_sessions.delete(session.id)
+                attach(capture_sessions.create())
+            elif kind == "ping":
+                sender.push("pong", {"type": "pong"})
+            else:
+                sender.push("error", {"type": "error", "detail": f"ไม่รู้จักข้อความชนิด {kind!r}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        ws_stats["active"] -= 1
+        speculator.unsubscribe(session.id, on_suggestion)
+        sender_task.cancel()
+        if generate_task is not None:
+            generate_task.cancel()
+
+# Streaming endpoint (Server-Sent Events)
+stream_stats = {
+    "streams": 0,
+    "early_stops": 0,
+    "first_sentence_count": 0,
+    "first_sentence_ms_total": 0.0
+}
+
+def sse_event(event: str, data: dict) -> str:
+    """จัดรูปข้อความหนึ่ง event ตามรูปแบบ Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_generate_events(job: GenerateJob):
+    """ส่งประโยคออกไปทีละประโยคทันทีที่พร้อม (cache → Typhoon stream → fallback)"""
+    started = time.perf_counter()
+    first_sentence_ms = None
+    sentences = []
+    provider = "fallback"
+    stream_stats["streams"] += 1
+
+    def sentence_event(sentence: str, source: str) -> str:
+        nonlocal first_sentence_ms
+        if first_sentence_ms is None:
+            first_sentence_ms = (time.perf_counter() - started) * 1000
+            stream_stats["first_sentence_count"] += 1
+            stream_stats["first_sentence_ms_total"] += first_sentence_ms
+        sentences.append(sentence)
+        return sse_event("sentence", {"index": len(sentences) - 1, "sentence": sentence, "provider": source})
+
+    cached_sentences = result_cache.get(job.cache_key) if CACHE_ENABLED else None
+    if cached_sentences:
+        provider = "typhoon-cache"
+        for sentence in cached_sentences:
+            yield sentence_event(sentence, provider)
+    elif typhoon_router.enabled:
+        try:
+            async for sentence in stream_typhoon(job.build_payload()):
+                provider = "typhoon"
+                yield sentence_event(sentence, provider)
+            if CACHE_ENABLED and len(sentences) >= 3:
+                result_cache.put(job.cache_key, sentences)
+        except Exception as e:
+            report_typhoon_error(e)
+
+    # Fallback: เติมให้ครบ 3 ประโยค (client ใช้ code path เดียวกันเสมอ)
+    if len(sentences) < 3:
+        if not sentences:
+            provider = "fallback"
+        for sentence in job.fallback()[len(sentences):3]:
+            yield sentence_event(sentence, "fallback")
+
+    RESPONSES_TOTAL.inc(provider=provider)
+    yield sse_event("done", {
+        "sentences": sentences,
+        "provider": provider,
+        "first_sentence_ms": round(first_sentence_ms or 0.0, 1),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@app.post("/api/generate/stream")
+async def generate_sentences_stream(request: dict):
+    """สร้างประโยคไทยแบบ stream (SSE): event 'sentence' ทีละประโยค และ 'done' เมื่อจบ"""
+    with stage_timer("parse"):
+        job = parse_generate_request(request)
+    return StreamingResponse(
+        stream_generate_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Batch generation endpoint
+async def resolve_batch_fanout(jobs: dict, semaphore: asyncio.Semaphore) -> dict:
+    """โหมด fanout: สร้างประโยคทีละ item พร้อมกัน (จำกัดจำนวนด้วย semaphore และ rate limiter)"""
+    async def resolve_one(index, job):
+        started = time.perf_counter()
+        async with semaphore:
+            sentences, provider, _ = await resolve_job(job)
+        return index, sentences, provider, (time.perf_counter() - started) * 1000
+
+    results = await asyncio.gather(*(resolve_one(index, job) for index, job in jobs.items()))
+    return {index: (sentences, provider, latency) for index, sentences, provider, latency in results}
+
+async def resolve_batch_packed(jobs: dict, pack_size: int, semaphore: asyncio.Semaphore) -> dict:
+    """โหมด pack: รวมหลาย item ใน prompt เดียว แล้วแยกคำตอบกลับตามหมายเลขชุด"""
+    results = {}
+    pending = {}
+
+    # item ที่อยู่ใน cache แล้วไม่ต้องส่งไป Typhoon (ผลจาก request เดี่ยวใช้ได้ แต่ผลจาก pack ไม่ถูกใช้กลับในทางกลับกัน)
+    for index, job in jobs.items():
+        started = time.perf_counter()
+        cached_sentences = None
+        if CACHE_ENABLED:
+            cached_sentences = result_cache.get(job.cache_key) or result_cache.get(packed_cache_key(job))
+        if cached_sentences:
+            results[index] = (cached_sentences, "typhoon-cache", (time.perf_counter() - started) * 1000)
+        else:
+            pending[index] = job
+
+    async def resolve_pack(indexes):
+        started = time.perf_counter()
+        packed = []
+        if typhoon_router.enabled:
+            try:
+                with stage_timer("prompt"):
+                    payload = build_typhoon_packed_payload([pending[index] for index in indexes])
+                async with semaphore:
+                    content = await request_typhoon_content(payload)
+                packed = parse_packed_sentences(content, len(indexes))
+            except Exception as e:
+                report_typhoon_error(e)
+        latency = (time.perf_counter() - started) * 1000
+
+        for position, index in enumerate(indexes):
+            job = pending[index]
+            sentences = packed[position] if position < len(packed) else []
+            if sentences:
+                if CACHE_ENABLED:
+                    result_cache.put(packed_cache_key(job), sentences)
+                results[index] = (sentences, "typhoon-packed", latency)
+            else:
+                # ชุดที่ Typhoon ตอบไม่ครบ ให้ใช้ fallback เฉพาะชุดนั้น
+                results[index] = (job.fallback(), "fallback", latency)
 
-async def generate_with_typhoon(words: List[str], emotion: str = "neutral", word_confidences: List[float] = None, emotion_confidences: List[float] = None) -> List[str]:
-    """สร้างประโยคด้วย Typhoon LLM"""
+    indexes = list(pending)
+    await asyncio.gather(*(
+        resolve_pack(indexes[start:start + pack_size])
+        for start in range(0, len(indexes), pack_size)
+    ))
+    return results
+
+def resolve_batch_offline(jobs: dict) -> dict:
+    """สร้างประโยคทุก job ด้วยตัวสร้างแบบ offline ในครั้งเดียว (job ที่คำและอารมณ์ตรงกันประกอบประโยคครั้งเดียว)"""
+    started = time.perf_counter()
+    indexes = list(jobs)
+    with stage_timer("offline"):
+        sentence_sets = sentence_engine.generate_many([
+            (jobs[index].words, jobs[index].emotion, jobs[index].word_confidences) for index in indexes
+        ])
+    latency = (time.perf_counter() - started) * 1000
+    return {index: (sentences, "offline", latency) for index, sentences in zip(indexes, sentence_sets)}
+
+@app.post("/api/generate/batch", response_model=BatchResponse)
+async def generate_sentences_batch(batch: BatchRequest):
+    """สร้างประโยคหลายชุดในครั้งเดียว ผลลัพธ์เรียงตามลำดับ items"""
+    if batch.mode not in ("fanout", "pack", "offline"):
+        raise HTTPException(status_code=400, detail="mode ต้องเป็น 'fanout', 'pack' หรือ 'offline'")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"ส่งได้ไม่เกิน {BATCH_MAX_ITEMS} รายการต่อครั้ง")
+
+    started = time.perf_counter()
+    jobs = {}
+    errors = {}
+    for index, item in enumerate(batch.items):
+        try:
+            jobs[index] = parse_generate_request(item)
+        except HTTPException as e:
+            errors[index] = str(e.detail)
+        except ValueError as e:
+            errors[index] = str(e)
+
+    semaphore = asyncio.Semaphore(max(BATCH_CONCURRENCY, 1))
+    if batch.mode == "offline":
+        resolved = resolve_batch_offline(jobs)
+    elif batch.mode == "pack":
+        pack_size = min(max(batch.packSize, 1), BATCH_MAX_PACK_SIZE)
+        resolved = await resolve_batch_packed(jobs, pack_size, semaphore)
+    else:
+        resolved = await resolve_batch_fanout(jobs, semaphore)
+
+    results = []
+    for index in range(len(batch.items)):
+        if index in errors:
+            results.append(BatchItemResult(index=index, provider="error", latencyMs=0.0, error=errors[index]))
+            continue
+        sentences, provider, latency = resolved[index]
+        RESPONSES_TOTAL.inc(provider=provider)
+        results.append(BatchItemResult(index=index, sentences=sentences, provider=provider, latencyMs=round(latency, 1)))
+
+    return BatchResponse(mode=batch.mode, results=results, totalMs=round((time.perf_counter() - started) * 1000, 1))
+
+# Hand model prediction endpoint
+def hand_features_array(request: HandPredictRequest) -> "np.ndarray":
+    """แปลง features ใน request เป็น float32 array shape (rows, input_size)"""
+    rows = []
+    if request.features:
+        try:
+            rows.append(np.asarray(request.features, dtype=np.float32))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="features ต้องเป็นตัวเลขและทุกชุดต้องยาวเท่ากัน")
+    for encoded in request.featuresBase64:
+        try:
+            rows.append(np.frombuffer(base64.b64decode(encoded, validate=True), dtype="<f4")[None, :])
+        except (binascii.Error, ValueError):
+            raise HTTPException(status_code=400, detail="featuresBase64 ต้องเป็น float32 little-endian แบบ base64")
+    if not rows:
+        raise HTTPException(status_code=400, detail="ต้องระบุ features อย่างน้อย 1 ชุด")
+    try:
+        features = rows[0] if len(rows) == 1 else np.concatenate(rows)
+    except ValueError:
+        features = None
+    if features is None or features.ndim != 2 or features.shape[1] != hand_model.input_size:
+        raise HTTPException(status_code=400, detail=f"features แต่ละชุดต้องมี {hand_model.input_size} ค่า")
+    if features.shape[0] > HAND_MAX_VECTORS:
+        raise HTTPException(status_code=400, detail=f"ส่งได้ไม่เกิน {HAND_MAX_VECTORS} ชุดต่อครั้ง")
+    return features
+
+@app.post("/api/predict/hand", response_model=HandPredictResponse)
+async def predict_hand(request: HandPredictRequest):
+    """ทำนายคำภาษามือจาก pose features ด้วย NumPy (รวม request พร้อมกันเป็น micro-batch)"""
+    if hand_batcher is None:
+        raise HTTPException(status_code=503, detail=f"Hand model ไม่พร้อมใช้งาน: {hand_model_error}")
+    started = time.perf_counter()
+    with stage_timer("parse"):
+        features = hand_features_array(request)
+    with stage_timer("hand_inference"):
+        probabilities = await hand_batcher.predict(features)
+    predictions = [
+        [HandPrediction(label=label, confidence=round(confidence, 6)) for label, confidence in row]
+        for row in hand_model.top_k(probabilities, request.topK)
+    ]
+    return HandPredictResponse(predictions=predictions, latencyMs=round((time.perf_counter() - started) * 1000, 3))
+
+def build_typhoon_payload(words: List[str], emotion: str = "neutral", word_confidences: List[float] = None, emotion_confidences: List[float] = None) -> dict:
+    """สร้าง payload สำหรับ Typhoon LLM จากคำและอารมณ์ (format เดิม)"""
     
     # สร้าง JSON สำหรับข้อมูลภาษามือและอารมณ์ (รวม confidence)
     data_for_llm = {
@@ -234,76 +2397,45 @@ async def generate_with_typhoon(words: List[str], emotion: str = "neutral", word
 3. [ประโยคที่ 3]"""
 
     payload = {
-        "model": "typhoon-v2.1-12b-instruct",
+        "model": TYPHOON_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        "max_tokens": 700,
+        "max_tokens": typhoon_max_tokens(words or []),
         "temperature": 0.5
     }
 
-    headers = {
-        "Authorization": f"Bearer {TYPHOON_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    return payload
 
-    try:
-        # ใช้ rate limiter สำหรับการ request
-        response = await typhoon_limiter.make_request_async(payload, headers, timeout=30.0)
-        
-        if response.status_code == 429:  # Too Many Requests
-            print("[WARNING] Rate limit exceeded, waiting...")
-            await asyncio.sleep(5)  # Wait 5 seconds and retry
-            response = await typhoon_limiter.make_request_async(payload, headers, timeout=30.0)
-        
-        if response.status_code != 200:
-            raise Exception(f"API Error: {response.status_code} - {response.text}")
-        
-        data = response.json()
-        content = data['choices'][0]['message']['content']
-        
-        # แปลงการตอบกลับเป็นรายการประโยค
-        sentences = []
-        for line in content.strip().split('\n'):
-            line = line.strip()
-            if line and not line.startswith('#'):
-                # ลบหมายเลข หรือ bullet points
-                clean_line = line.lstrip('123456789.- ')
-                if clean_line:
-                    sentences.append(clean_line)
-        
-        return sentences[:3]  # เอาแค่ 3 ประโยคแรก
-        
-    except httpx.TimeoutException:
-        raise Exception("API Timeout - request took too long")
-    except httpx.HTTPStatusError as e:
-        if e.response.status_code == 429:
-            raise Exception("Rate limit exceeded - please try again later")
-        raise Exception(f"HTTP Error: {e.response.status_code}")
-    except Exception as e:
-        raise Exception(f"API Request Failed: {str(e)}")
+def unified_prompt_data(captured_data: List[LLMData], summary: dict) -> tuple:
+    """JSON ของข้อมูลสำหรับ prompt แบบ unified คืนค่า (แบบเต็ม, แบบที่ส่งจริง)
 
-async def generate_with_typhoon_unified(captured_data: List[LLMData], summary: dict) -> List[str]:
-    """สร้างประโยคด้วย Typhoon LLM จาก unified data format"""
-    
-    # สร้าง JSON สำหรับข้อมูลทั้งหมด
-    data_for_llm = {
-        "captures": [
-            {
-                "word": cap.signLanguage.get("bestWord", "Unknown"),
-                "wordConfidence": cap.signLanguage.get("confidence", 0),
-                "emotion": cap.emotion.get("emotion", "neutral"),
-                "emotionConfidence": cap.emotion.get("confidence", 0),
-                "faceDetected": cap.face.get("detected", False),
-                "faceCount": cap.face.get("faceCount", 0)
-            }
-            for cap in captured_data
-        ],
-        "summary": summary
-    }
-    
-    data_json = json.dumps(data_for_llm, ensure_ascii=False)
+    แบบเต็มคือทุก capture ตามที่รับมา ใช้รายงานขนาดก่อนย่อ ถ้าปิด PROMPT_COMPACTION สองค่านี้จะเหมือนกัน
+    """
+    captures = [
+        {
+            # frontend (createLLMJson) ส่ง signLanguage.word ส่วน client รุ่นเก่าส่ง bestWord (เหมือน sessions.py)
+            "word": cap.signLanguage.get("bestWord") or cap.signLanguage.get("word") or "Unknown",
+            "wordConfidence": cap.signLanguage.get("confidence", 0),
+            "emotion": cap.emotion.get("emotion") or cap.emotion.get("bestEmotion") or "neutral",
+            "emotionConfidence": cap.emotion.get("confidence", 0),
+            "faceDetected": cap.face.get("detected", False),
+            "faceCount": cap.face.get("faceCount", 0)
+        }
+        for cap in captured_data
+    ]
+    original_json = json.dumps({"captures": captures, "summary": summary}, ensure_ascii=False)
+    if not PROMPT_COMPACTION:
+        return original_json, original_json
+
+    compactor = new_capture_compactor()
+    for capture in captures:
+        compactor.add(capture)
+    return original_json, compact_data_json(compactor, summary)
+
+def build_typhoon_unified_payload_from_json(data_json: str, words: List[str] = None) -> dict:
+    """สร้าง payload แบบ unified จาก JSON ของข้อมูลที่ serialize แล้ว (ใช้ร่วมกับ capture session)"""
     
     # Prompt พิเศษสำหรับ unified data
     system_prompt = """คุณเป็นผู้ช่วย AI ที่เชี่ยวชาญภาษาไทยและภาษามือไทย ให้สร้างประโยคไทยที่เป็นธรรมชาติ ถูกต้องตามหลักภาษา และใช้ในชีวิตประจำวันได้จริง
@@ -314,7 +2446,7 @@ async def generate_with_typhoon_unified(captured_data: List[LLMData], summary: d
 
 กรุณาวิเคราะห์ข้อมูลทั้งหมดและสร้างประโยคไทยที่เป็นธรรมชาติ 3 ประโยค โดย:
 - พิจารณาลำดับคำภาษามือที่จับได้ตามลำดับเวลา
-- พิจารณาค่าความมั่นใจ (confidence) ของแต่ละคำ
+- พิจารณาค่าความมั่นใจ (confidence) ของแต่ละคำ (count คือจำนวนภาพติดกันที่ได้ผลเดียวกัน)
 - พิจารณาอารมณ์ที่ตรวจพบในแต่ละภาพ
 - สร้างประโยคที่สอดคล้องกับบริบทและอารมณ์
 - เป็นประโยคที่คนไทยใช้จริงในชีวิตประจำวัน
@@ -326,124 +2458,331 @@ async def generate_with_typhoon_unified(captured_data: List[LLMData], summary: d
 3. [ประโยคที่ 3]"""
 
     payload = {
-        "model": "typhoon-v2.1-12b-instruct",
+        "model": TYPHOON_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        "max_tokens": 700,
+        "max_tokens": typhoon_max_tokens(words or []),
         "temperature": 0.5
     }
 
-    headers = {
-        "Authorization": f"Bearer {TYPHOON_API_KEY}",
-        "Content-Type": "application/json"
+    return payload
+
+def new_capture_compactor() -> CaptureCompactor:
+    return CaptureCompactor(confidence_floor=PROMPT_CONFIDENCE_FLOOR, precision=PROMPT_CONFIDENCE_PRECISION)
+
+def typhoon_max_tokens(words: List[str]) -> int:
+    """max_tokens ของคำตอบ 3 ประโยค ตามจำนวนคำ (ไม่ซ้ำ) ที่ต้องใช้ในประโยค"""
+    return sentence_max_tokens(
+        len(set(words)),
+        sentences=3,
+        base_tokens=TYPHOON_SENTENCE_TOKENS,
+        word_tokens=TYPHOON_WORD_TOKENS,
+        cap=TYPHOON_MAX_TOKENS
+    )
+
+prompt_stats = {
+    "prompts": 0,
+    "compacted": 0,
+    "chars_before": 0,
+    "chars_after": 0,
+    "tokens_before": 0,
+    "tokens_after": 0,
+    "max_tokens": 0
+}
+
+def record_prompt_usage(payload: dict, original_json: str = None, data_json: str = None) -> dict:
+    """ขนาดของ prompt ที่ส่งจริงเทียบกับ prompt ที่ใช้ข้อมูลแบบเต็ม (ก่อนย่อ)"""
+    text = "".join(message["content"] for message in payload["messages"])
+    chars_after = len(text)
+    tokens_after = estimate_tokens(text)
+    chars_before, tokens_before = chars_after, tokens_after
+    if original_json is not None and original_json is not data_json:
+        # prompt แบบเต็มต่างจากที่ส่งจริงเฉพาะส่วนข้อมูล
+        chars_before += len(original_json) - len(data_json)
+        tokens_before += estimate_tokens(original_json) - estimate_tokens(data_json)
+        prompt_stats["compacted"] += 1
+
+    prompt_stats["prompts"] += 1
+    prompt_stats["chars_before"] += chars_before
+    prompt_stats["chars_after"] += chars_after
+    prompt_stats["tokens_before"] += tokens_before
+    prompt_stats["tokens_after"] += tokens_after
+    prompt_stats["max_tokens"] += payload["max_tokens"]
+    PROMPT_CHARS_TOTAL.inc(chars_before, stage="before")
+    PROMPT_CHARS_TOTAL.inc(chars_after, stage="after")
+    return {
+        "charsBefore": chars_before,
+        "charsAfter": chars_after,
+        "tokensBefore": tokens_before,
+        "tokensAfter": tokens_after,
+        "maxTokens": payload["max_tokens"]
+    }
+
+def build_typhoon_packed_payload(jobs: List[GenerateJob]) -> dict:
+    """สร้าง payload เดียวสำหรับหลายชุดคำ (โหมด pack ของ batch)"""
+    
+    # ใช้ข้อมูลรูปแบบเดียวกันทุกชุด (คำ อารมณ์ และ confidence) เพื่อให้ prompt สั้น
+    sets_text = "\n".join(
+        f"ชุดที่ {number}: " + json.dumps({
+            "words": job.words,
+            "emotion": job.emotion,
+            "wordConfidences": [round(float(conf), 2) for conf in job.word_confidences]
+        }, ensure_ascii=False)
+        for number, job in enumerate(jobs, start=1)
+    )
+    
+    system_prompt = """คุณเป็นผู้ช่วย AI ที่เชี่ยวชาญภาษาไทยและภาษามือไทย ให้สร้างประโยคไทยที่เป็นธรรมชาติ ถูกต้องตามหลักภาษา และใช้ในชีวิตประจำวันได้จริง"""
+
+    user_prompt = f"""จากข้อมูลภาษามือไทยและอารมณ์หลายชุดต่อไปนี้:
+{sets_text}
+
+กรุณาสร้างประโยคไทยที่เป็นธรรมชาติ 3 ประโยคสำหรับแต่ละชุด โดย:
+- ใช้คำภาษามือที่ให้มาทั้งหมดหรือส่วนใหญ่
+- พิจารณาอารมณ์ที่ตรวจพบเพื่อให้ประโยคสอดคล้องกับบริบท
+- เป็นประโยคที่คนไทยใช้จริงในชีวิตประจำวัน
+- หากมีคำว่า Unknown ให้ข้ามไปและใช้คำอื่นๆที่มี
+
+ตอบตามรูปแบบนี้เท่านั้น โดยขึ้นต้นแต่ละชุดด้วยหมายเลขชุดในวงเล็บเหลี่ยม:
+[1]
+1. [ประโยคที่ 1]
+2. [ประโยคที่ 2]
+3. [ประโยคที่ 3]
+[2]
+1. [ประโยคที่ 1]
+..."""
+
+    return {
+        "model": TYPHOON_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        "max_tokens": min(200 * len(jobs) + 100, 4000),
+        "temperature": 0.5
     }
 
+def clean_sentence_line(line: str) -> str:
+    """แปลงหนึ่งบรรทัดจากคำตอบของ LLM เป็นประโยค (คืนค่าว่างถ้าไม่ใช่ประโยค)"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return ""
+    # ลบหมายเลข หรือ bullet points
+    return line.lstrip('123456789.- ')
+
+def parse_sentences(content: str) -> List[str]:
+    """แปลงการตอบกลับเป็นรายการประโยค"""
+    sentences = []
+    for line in content.strip().split('\n'):
+        clean_line = clean_sentence_line(line)
+        if clean_line:
+            sentences.append(clean_line)
+    return sentences[:3]  # เอาแค่ 3 ประโยคแรก
+
+def parse_packed_sentences(content: str, count: int) -> List[List[str]]:
+    """แยกคำตอบของโหมด pack ออกเป็นประโยคของแต่ละชุดตามหัว [n]"""
+    sections = [[] for _ in range(count)]
+    current = None
+    for line in content.split('\n'):
+        header = re.match(r'^\s*\[(\d+)\]\s*$', line)
+        if header:
+            number = int(header.group(1))
+            current = number - 1 if 1 <= number <= count else None
+            continue
+        if current is not None:
+            clean_line = clean_sentence_line(line)
+            if clean_line and len(sections[current]) < 3:
+                sections[current].append(clean_line)
+    return sections
+
+async def request_typhoon_content(payload: dict) -> str:
+    """ส่ง payload ไปที่ Typhoon API (ผ่าน router) แล้วคืนข้อความคำตอบ"""
+    # งานเบื้องหลังรอคิวลำดับต่ำได้นานกว่า request ของผู้ใช้
+    ticket = background_ticket.get()
+    deadline = time.monotonic() + (SPECULATION_QUEUE_TIMEOUT if ticket is not None else TYPHOON_QUEUE_TIMEOUT)
+    # request ของผู้ใช้ที่มีงบเวลา: รอคิวได้ไม่เกินงบที่เหลือ
+    remaining_budget = budget_deadline.get()
+    if ticket is None and remaining_budget is not None:
+        deadline = min(deadline, remaining_budget)
+    return await typhoon_router.request(payload, deadline, ticket)
+
+async def request_endpoint_content(endpoint: UpstreamEndpoint, payload: dict, deadline: float, ticket=None) -> str:
+    """ส่ง payload ไปที่ endpoint หนึ่งตัว แล้วคืนข้อความคำตอบ"""
+    if not endpoint.breaker.allow():
+        raise CircuitOpenError(f"Circuit open - Typhoon upstream {endpoint.name} is unavailable")
+    headers = endpoint.headers()
+    if payload.get("model") != endpoint.model:
+        payload = dict(payload, model=endpoint.model)
+    endpoint.requests += 1
+    endpoint.inflight += 1
+    outcome = "failure"
+
     try:
-        # ใช้ rate limiter สำหรับการ request
-        response = await typhoon_limiter.make_request_async(payload, headers, timeout=30.0)
+        # ใช้ rate limiter ของ endpoint (มี deadline เดียวทั้งการรอคิวและ retry)
+        response = await endpoint.limiter.make_request_async(payload, headers, deadline=deadline, ticket=ticket,
+                                                             url=endpoint.url)
         
-        if response.status_code == 429:  # Too Many Requests
-            print("[WARNING] Rate limit exceeded, waiting...")
-            await asyncio.sleep(5)  # Wait 5 seconds and retry
-            response = await typhoon_limiter.make_request_async(payload, headers, timeout=30.0)
+        # มี endpoint เดียวให้รอแล้วลองใหม่ ถ้ามีหลายตัว router จะย้ายไป endpoint อื่นแทน
+        if response.status_code == 429 and len(typhoon_router.endpoints) == 1:  # Too Many Requests
+            retry_after = endpoint.limiter.on_rate_limited(response)
+            print(f"[WARNING] Rate limit exceeded, retry after {retry_after:.1f}s...")
+            response = await endpoint.limiter.make_request_async(payload, headers, deadline=deadline, ticket=ticket,
+                                                                 url=endpoint.url)
+        elif response.status_code == 429:
+            retry_after = endpoint.limiter.on_rate_limited(response)
+            raise Exception(f"Rate limit exceeded on {endpoint.name} - retry after {retry_after:.1f}s")
         
+        latency_ms = response.elapsed.total_seconds() * 1000
+        observe_stage("upstream", latency_ms / 1000)
         if response.status_code != 200:
+            # 429 คือโดนจำกัด quota ไม่ได้แปลว่า upstream เสีย
+            if response.status_code != 429:
+                endpoint.breaker.record_failure(latency_ms)
             raise Exception(f"API Error: {response.status_code} - {response.text}")
         
-        data = response.json()
-        content = data['choices'][0]['message']['content']
-        
-        # แปลงการตอบกลับเป็นรายการประโยค
-        sentences = []
-        for line in content.strip().split('\n'):
-            line = line.strip()
-            if line and not line.startswith('#'):
-                # ลบหมายเลข หรือ bullet points
-                clean_line = line.lstrip('123456789.- ')
-                if clean_line:
-                    sentences.append(clean_line)
-        
-        return sentences[:3]  # เอาแค่ 3 ประโยคแรก
+        with stage_timer("response_parse"):
+            data = response.json()
+            content = data['choices'][0]['message']['content']
+        endpoint.breaker.record_success(latency_ms)
+        endpoint.observe(latency_ms)
+        endpoint.successes += 1
+        outcome = "success"
+        return content
         
     except httpx.TimeoutException:
+        endpoint.breaker.record_failure()
         raise Exception("API Timeout - request took too long")
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 429:
             raise Exception("Rate limit exceeded - please try again later")
         raise Exception(f"HTTP Error: {e.response.status_code}")
+    except httpx.HTTPError as e:
+        endpoint.breaker.record_failure()
+        raise Exception(f"API Request Failed: {str(e)}")
+    except asyncio.CancelledError:
+        # ถูกยกเลิก (เช่นแพ้ hedged request) ไม่นับเป็นความล้มเหลวของ endpoint
+        outcome = None
+        raise
     except Exception as e:
         raise Exception(f"API Request Failed: {str(e)}")
+    finally:
+        endpoint.inflight -= 1
+        endpoint.breaker.release()
+        if outcome is not None:
+            if outcome == "failure":
+                endpoint.failures += 1
+            UPSTREAM_REQUESTS_TOTAL.inc(endpoint=endpoint.name, outcome=outcome)
+
+async def request_typhoon(payload: dict) -> List[str]:
+    """ส่ง payload ไปที่ Typhoon API แล้วแปลงผลลัพธ์เป็นรายการประโยค"""
+    content = await request_typhoon_content(payload)
+    with stage_timer("response_parse"):
+        return parse_sentences(content)
+
+async def stream_typhoon(payload: dict, max_sentences: int = 3):
+    """เรียก Typhoon แบบ stream=true แล้ว yield ประโยคทันทีที่จบบรรทัด
+
+    หยุดอ่าน (และปิด upstream stream) ทันทีที่ได้ครบ max_sentences ประโยค
+    """
+    # stream ใช้ endpoint ที่ router เลือกตัวเดียว (ไม่ hedge เพราะประโยคถูกส่งออกไปทีละบรรทัด)
+    endpoint = typhoon_router.select()
+    breaker = endpoint.breaker
+    if not breaker.allow():
+        raise CircuitOpenError("Circuit open - Typhoon upstream is unavailable")
+    payload = dict(payload, stream=True, model=endpoint.model)
+    headers = endpoint.headers()
+    deadline = time.monotonic() + endpoint.limiter.max_wait
+    endpoint.requests += 1
+    endpoint.inflight += 1
+    outcome = "failure"
+
+    try:
+        for attempt in range(2):
+            await endpoint.limiter.acquire(deadline)
+            started = time.perf_counter()
+            async with typhoon_http.stream(endpoint.url, json=payload, headers=headers) as response:
+                if response.status_code == 429 and attempt == 0:  # Too Many Requests
+                    retry_after = endpoint.limiter.on_rate_limited(response)
+                    print(f"[WARNING] Rate limit exceeded, retry after {retry_after:.1f}s...")
+                    continue
+
+                if response.status_code != 200:
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    if response.status_code != 429:
+                        breaker.record_failure((time.perf_counter() - started) * 1000)
+                    raise Exception(f"API Error: {response.status_code} - {body}")
+
+                # ได้ header กลับมาแล้ว ถือว่า upstream ตอบ (latency = เวลาถึง header)
+                observe_stage("upstream", time.perf_counter() - started)
+                breaker.record_success((time.perf_counter() - started) * 1000)
+                endpoint.successes += 1
+                outcome = "success"
+
+                # upstream บางตัวไม่รองรับ stream และตอบเป็น JSON ปกติ
+                if "text/event-stream" not in response.headers.get("content-type", ""):
+                    data = json.loads(await response.aread())
+                    for sentence in parse_sentences(data['choices'][0]['message']['content'])[:max_sentences]:
+                        yield sentence
+                    return
+
+                buffer = ""
+                count = 0
+                async for event_line in response.aiter_lines():
+                    if not event_line.startswith("data:"):
+                        continue
+                    data = event_line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    choices = chunk.get("choices") or [{}]
+                    buffer += (choices[0].get("delta") or {}).get("content") or ""
+
+                    # ส่งประโยคออกไปทันทีที่บรรทัดจบ
+                    while "\n" in buffer:
+                        line, buffer = buffer.split("\n", 1)
+                        sentence = clean_sentence_line(line)
+                        if sentence:
+                            count += 1
+                            yield sentence
+                        if count >= max_sentences:
+                            stream_stats["early_stops"] += 1
+                            return
+
+                sentence = clean_sentence_line(buffer)
+                if sentence and count < max_sentences:
+                    yield sentence
+                return
+
+    except httpx.TimeoutException:
+        breaker.record_failure()
+        raise Exception("API Timeout - request took too long")
+    except RateLimitExceeded:
+        raise
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        raise Exception(f"API Request Failed: {str(e)}")
+    except (asyncio.CancelledError, GeneratorExit):
+        # client ปิด stream ก่อน upstream ตอบ ไม่นับเป็นความล้มเหลวของ endpoint
+        if outcome == "failure":
+            outcome = "cancelled"
+        raise
+    finally:
+        endpoint.inflight -= 1
+        breaker.release()
+        if outcome == "failure":
+            endpoint.failures += 1
+        UPSTREAM_REQUESTS_TOTAL.inc(endpoint=endpoint.name, outcome=outcome)
 
 def generate_fallback_sentences(words: List[str], emotion: str = "neutral", word_confidences: List[float] = None) -> List[str]:
-    """สร้างประโยคแบบ fallback เมื่อ API ไม่พร้อมใช้งาน"""
-    
-    words_text = " ".join(words)
-    
-    # เลือกคำที่มี confidence สูงที่สุด (หากมีข้อมูล)
-    if word_confidences and len(word_confidences) == len(words):
-        # จับคู่คำกับ confidence
-        word_conf_pairs = list(zip(words, word_confidences))
-        # เรียงตาม confidence จากสูงไปต่ำ
-        word_conf_pairs.sort(key=lambda x: x[1], reverse=True)
-        # เอาคำที่มี confidence สูงสุด 2-3 คำ
-        high_conf_words = [word for word, conf in word_conf_pairs[:3] if conf > 0.5]
-        if high_conf_words:
-            words_text = " ".join(high_conf_words)
-    
-    # ปรับประโยคตามอารมณ์
-    emotion_suffix = ""
-    if emotion == "happy":
-        emotion_suffix = " 😊"
-    elif emotion == "sad":
-        emotion_suffix = " 😢"
-    elif emotion == "angry":
-        emotion_suffix = " 😠"
-    
-    # ตรวจสอบว่าเป็น unknown หรือไม่
-    is_unknown = all(word.lower() == "unknown" for word in words)
-    
-    if is_unknown:
-        # ประโยคตามอารมณ์สำหรับ unknown
-        if emotion == "happy":
-            return [
-                "ดีใจมากเลยครับ/ค่ะ 😊",
-                "มีความสุขจังเลย 😊",
-                "วันนี้อารมณ์ดีมากครับ/ค่ะ 😊"
-            ]
-        elif emotion == "sad":
-            return [
-                "เศร้าใจนิดหน่อยครับ/ค่ะ 😢",
-                "รู้สึกไม่ค่อยดีเท่าไหร่ 😢",
-                "วันนี้ใจไม่ค่อยดีครับ/ค่ะ 😢"
-            ]
-        elif emotion == "angry":
-            return [
-                "รู้สึกหงุดหงิดนิดหน่อย 😠",
-                "อารมณ์ไม่ค่อยดีครับ/ค่ะ 😠",
-                "รู้สึกไม่พอใจเล็กน้อย 😠"
-            ]
-        else:  # neutral หรืออื่นๆ
-            return [
-                "สวัสดีครับ/ค่ะ",
-                "ยินดีที่ได้พบกันครับ/ค่ะ",
-                "มีอะไรให้ช่วยไหมครับ/คะ"
-            ]
-    
-    # ประโยคพื้นฐาน
-    basic = f"{words_text}{emotion_suffix}"
-    
-    # เพิ่มคำสุภาพ
-    polite = f"{words_text} ครับ/ค่ะ{emotion_suffix}"
-    
-    # เพิ่มบริบท
-    contextual = f"ฉันต้องการสื่อว่า {words_text}{emotion_suffix}"
-    
-    return [basic, polite, contextual]
+    """สร้างประโยคแบบ fallback เมื่อ API ไม่พร้อมใช้งาน (ค้นจากตารางของตัวสร้างแบบ offline)"""
+    return sentence_engine.generate(words, emotion, word_confidences)
+
+startup_stats["import_ms"] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
 
 # รันเซิร์ฟเวอร์
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
     import sys
     
@@ -455,22 +2794,41 @@ if __name__ == "__main__":
     except Exception:
         pass
     
+    production = SERVER_MODE == "production"
+    options = {"host": SERVER_HOST, "port": SERVER_PORT, "log_level": "info"}
+    if production:
+        # production: ไม่มี file watcher/reload ใช้ uvloop และ httptools ถ้าติดตั้งไว้ (uvicorn[standard])
+        options["loop"] = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+        options["http"] = "httptools" if importlib.util.find_spec("httptools") else "h11"
+        if SERVER_WORKERS > 1:
+            options["workers"] = SERVER_WORKERS
+
     # ใช้ข้อความภาษาอังกฤษเพื่อหลีกเลี่ยงปัญหา encoding
     try:
         print("[INFO] Starting Thai-HandMate Backend...")
-        print("[API] Available at: http://localhost:8000")
-        print("[DOCS] API Documentation: http://localhost:8000/docs")
-        print(f"[KEY] Has API Key: {'YES' if TYPHOON_API_KEY else 'NO (will use fallback)'}")
+        print(f"[API] Available at: http://localhost:{SERVER_PORT}")
+        print(f"[DOCS] API Documentation: http://localhost:{SERVER_PORT}/docs")
+        print(f"[KEY] Has API Key: {'YES' if typhoon_router.enabled else 'NO (will use fallback)'}")
+        print(f"[UPSTREAM] Endpoints: {', '.join(endpoint.name for endpoint in typhoon_router.endpoints)}")
     except UnicodeEncodeError:
         print("[INFO] Starting Thai-HandMate Backend...")
-        print("[API] Available at: http://localhost:8000")
-        print("[DOCS] API Documentation: http://localhost:8000/docs")
-        print(f"[KEY] Has API Key: {'YES' if TYPHOON_API_KEY else 'NO'}")
-    
-    uvicorn.run(
-        "app:app", 
-        host="0.0.0.0", 
-        port=8000,
-        reload=True,
-        log_level="info"
-    )
+        print(f"[API] Available at: http://localhost:{SERVER_PORT}")
+        print(f"[DOCS] API Documentation: http://localhost:{SERVER_PORT}/docs")
+        print(f"[KEY] Has API Key: {'YES' if typhoon_router.enabled else 'NO'}")
+
+    if production:
+        print(f"[MODE] production (workers: {SERVER_WORKERS}, loop: {options['loop']}, http: {options['http']})")
+        if SERVER_WORKERS > 1:
+            # session, cache ในหน่วยความจำ และ speculation แยกกันต่อ worker
+            print("[WARNING] Multiple workers do not share capture sessions or the memory cache - "
+                  "use sticky routing for /api/session and /ws")
+            if RATE_LIMIT_BACKEND != "sqlite":
+                print("[WARNING] RATE_LIMIT_BACKEND=local gives each worker its own Typhoon quota - "
+                      "set RATE_LIMIT_BACKEND=sqlite to share it")
+            uvicorn.run("app:app", **options)
+        else:
+            # worker เดียว: ส่ง app object ที่ import แล้วไปตรงๆ ไม่ต้อง import app.py ซ้ำ
+            uvicorn.run(app, **options)
+    else:
+        print("[MODE] development (reload on file changes)")
+        uvicorn.run("app:app", reload=True, **options)
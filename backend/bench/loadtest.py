@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Load generator สำหรับ /api/generate ของ Thai-HandMate backend
+
+สร้าง payload ทั้ง format เดิมและ unified จาก label ใน public/hand-model/metadata.json
+แล้วรายงาน throughput, latency p50/p95/p99 และสัดส่วน fallback
+บันทึกผลเป็น baseline และเทียบกับ baseline เดิมได้ (exit code 1 ถ้าแย่ลงเกิน tolerance)
+
+ตัวอย่าง:
+    python bench/loadtest.py --url http://localhost:8000 --concurrency 8 --duration 30
+    python bench/loadtest.py --requests 500 --save-baseline bench/baseline.json
+    python bench/loadtest.py --requests 500 --compare bench/baseline.json --tolerance 0.15
+"""
+
+from typing import List
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+
+METADATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'public', 'hand-model', 'metadata.json')
+EMOTIONS = ["neutral", "happy", "sad", "angry", "surprised", "fear", "disgust"]
+
+
+def load_labels(path: str) -> List[str]:
+    """อ่าน label ของ hand model (คำภาษามือที่ระบบรู้จัก)"""
+    with open(path, encoding="utf-8") as f:
+        labels = json.load(f)["labels"]
+    # "สถานะว่าง" คือท่าว่าง ไม่ใช่คำที่ผู้ใช้ตั้งใจสื่อ
+    return [label for label in labels if label != "สถานะว่าง"] or labels
+
+
+class PayloadFactory:
+    """สุ่ม payload ที่ใกล้เคียงการใช้งานจริง (ลำดับคำสั้นๆ ซ้ำกันบ่อย)"""
+
+    def __init__(self, labels: List[str], unified_ratio: float = 0.5, repeat_ratio: float = 0.3,
+                 seed: int = None):
+        self.labels = labels
+        self.unified_ratio = unified_ratio
+        self.repeat_ratio = repeat_ratio
+        self.rng = random.Random(seed)
+        self.recent = []
+
+    def words(self) -> List[str]:
+        # ผู้ใช้มักทำวลีเดิมซ้ำๆ ให้มีโอกาสใช้ลำดับคำที่เคยส่งแล้ว
+        if self.recent and self.rng.random() < self.repeat_ratio:
+            return list(self.rng.choice(self.recent))
+        count = self.rng.choices([1, 2, 3, 4], weights=[4, 4, 2, 1])[0]
+        words = [self.rng.choice(self.labels) for _ in range(count)]
+        if self.rng.random() < 0.05:
+            words = ["Unknown"]
+        self.recent = (self.recent + [tuple(words)])[-20:]
+        return words
+
+    def legacy(self) -> dict:
+        words = self.words()
+        return {
+            "words": words,
+            "emotion": self.rng.choice(EMOTIONS),
+            "wordConfidences": [round(self.rng.uniform(0.5, 1.0), 3) for _ in words],
+            "emotionConfidences": [round(self.rng.uniform(0.4, 1.0), 3)]
+        }
+
+    def unified(self) -> dict:
+        # รูปแบบเดียวกับ createLLMJson (src/lib/unifiedProcessor.js) และ summary จาก RightPanel.jsx
+        words = self.words()
+        captures = []
+        emotions = []
+        for word in words:
+            emotion = self.rng.choice(EMOTIONS)
+            emotions.append(emotion)
+            captures.append({
+                "timestamp": int(time.time() * 1000),
+                "signLanguage": {"word": word, "confidence": round(self.rng.uniform(0.5, 1.0), 4),
+                                 "source": "hand-model", "details": ""},
+                "emotion": {"emotion": emotion, "confidence": round(self.rng.uniform(0.4, 1.0), 4),
+                            "source": "face-api", "details": ""},
+                "face": {"detected": True, "faceCount": 1,
+                         "bestFaceConfidence": round(self.rng.uniform(0.6, 1.0), 4),
+                         "source": "face-api", "details": ""},
+                "context": {"processingTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                            "modelVersion": "2.0.0", "systemStatus": "active"}
+            })
+        return {
+            "capturedData": captures,
+            "summary": {
+                "words": words,
+                "emotions": emotions,
+                "overallEmotion": max(set(emotions), key=emotions.count),
+                "totalCaptures": len(captures)
+            }
+        }
+
+    def next(self) -> dict:
+        return self.unified() if self.rng.random() < self.unified_ratio else self.legacy()
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def run_load(args) -> dict:
+    factory = PayloadFactory(load_labels(args.metadata), args.unified_ratio, args.repeat_ratio, args.seed)
+    latencies = []
+    providers = {}
+    errors = 0
+    sent = 0
+    stop_at = time.perf_counter() + args.duration if args.duration else None
+    headers = {}
+    if args.budget_ms is not None:
+        headers["X-Latency-Budget-Ms"] = str(args.budget_ms)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+
+        async def worker():
+            nonlocal sent, errors
+            while True:
+                if stop_at is not None and time.perf_counter() >= stop_at:
+                    return
+                if stop_at is None and sent >= args.requests:
+                    return
+                sent += 1
+                payload = factory.next()
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/api/generate", json=payload, headers=headers)
+                    elapsed = time.perf_counter() - started
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                    provider = response.json().get("provider", "unknown")
+                    providers[provider] = providers.get(provider, 0) + 1
+                    latencies.append(elapsed)
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    completed = len(latencies)
+    return {
+        "requests": sent,
+        "completed": completed,
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "duration_s": round(wall, 3),
+        "throughput_rps": round(completed / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99": round(percentile(latencies, 0.99) * 1000, 1),
+            "max": round((latencies[-1] if latencies else 0.0) * 1000, 1)
+        },
+        "providers": providers,
+        "fallback_ratio": round(providers.get("fallback", 0) / completed, 4) if completed else 0.0
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """เทียบกับ baseline คืนรายการ regression (ว่าง = ผ่าน)"""
+    regressions = []
+    for key in ("p50", "p95", "p99"):
+        old = baseline["latency_ms"][key]
+        new = result["latency_ms"][key]
+        if old > 0 and new > old * (1 + tolerance):
+            regressions.append(f"latency {key}: {old}ms -> {new}ms")
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['throughput_rps']} -> {result['throughput_rps']} req/s")
+    if result["fallback_ratio"] > baseline["fallback_ratio"] + tolerance:
+        regressions.append(f"fallback ratio: {baseline['fallback_ratio']} -> {result['fallback_ratio']}")
+    if result["errors"] > baseline["errors"]:
+        regressions.append(f"errors: {baseline['errors']} -> {result['errors']}")
+    return regressions
+
+
+def print_report(result: dict):
+    print(f"[LOAD] {result['completed']}/{result['requests']} completed in {result['duration_s']}s "
+          f"(concurrency {result['concurrency']}, errors {result['errors']})")
+    print(f"[LOAD] Throughput: {result['throughput_rps']} req/s")
+    latency = result["latency_ms"]
+    print(f"[LOAD] Latency: p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  max {latency['max']}ms")
+    print(f"[LOAD] Providers: {result['providers']}  fallback ratio {result['fallback_ratio']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test สำหรับ /api/generate")
+    parser.add_argument("--url", default="http://localhost:8000", help="URL ของ backend")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="จำนวน request ทั้งหมด (ถ้าไม่ระบุ --duration)")
+    parser.add_argument("--duration", type=float, help="ยิงต่อเนื่องกี่วินาที")
+    parser.add_argument("--unified-ratio", type=float, default=0.5, help="สัดส่วน payload แบบ unified")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="โอกาสส่งลำดับคำที่เคยส่งแล้ว")
+    parser.add_argument("--budget-ms", type=float, help="ส่ง header X-Latency-Budget-Ms")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--metadata", default=METADATA_PATH, help="metadata.json ของ hand model")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="พิมพ์ผลเป็น JSON")
+    parser.add_argument("--save-baseline", help="บันทึกผลเป็นไฟล์ baseline")
+    parser.add_argument("--compare", help="เทียบกับไฟล์ baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="ยอมให้แย่ลงได้กี่เท่า (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(args))
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"[LOAD] Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            for regression in regressions:
+                print(f"[REGRESSION] {regression}")
+            sys.exit(1)
+        print("[LOAD] No regression against baseline")
+
+
+if __name__ == "__main__":
+    main()
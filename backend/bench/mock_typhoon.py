@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Mock Typhoon API (OpenAI-compatible /v1/chat/completions) สำหรับวัดประสิทธิภาพ backend
+
+ใช้แทน Typhoon จริงโดยตั้ง TYPHOON_API_BASE=http://localhost:9001/v1/chat/completions
+รองรับ latency แบบสุ่ม, จำลอง 429 พร้อม Retry-After, จำลอง timeout และ stream=true
+
+ตัวอย่าง:
+    python bench/mock_typhoon.py --port 9001 --latency-ms 800 --jitter 0.5 --rpm 10
+"""
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+# การตั้งค่า (อ่านจาก environment เพื่อให้ใช้กับ uvicorn ตรงๆ ได้ด้วย)
+MOCK_LATENCY_MS = float(os.getenv('MOCK_LATENCY_MS', '800'))  # latency เฉลี่ย (median) ต่อ request
+MOCK_JITTER = float(os.getenv('MOCK_JITTER', '0.4'))  # sigma ของ log-normal (0 = คงที่)
+MOCK_RATE_429 = float(os.getenv('MOCK_RATE_429', '0'))  # โอกาสตอบ 429 แบบสุ่ม
+MOCK_RETRY_AFTER = float(os.getenv('MOCK_RETRY_AFTER', '2'))  # ค่า Retry-After (วินาที)
+MOCK_RPM = float(os.getenv('MOCK_RPM', '0'))  # จำกัด requests ต่อนาทีเหมือน quota จริง (0 = ไม่จำกัด)
+MOCK_TIMEOUT_RATE = float(os.getenv('MOCK_TIMEOUT_RATE', '0'))  # โอกาสที่ request ค้างจน client timeout
+MOCK_HANG_SECONDS = float(os.getenv('MOCK_HANG_SECONDS', '120'))
+MOCK_ERROR_RATE = float(os.getenv('MOCK_ERROR_RATE', '0'))  # โอกาสตอบ 500
+MOCK_STREAM_CHUNK_MS = float(os.getenv('MOCK_STREAM_CHUNK_MS', '30'))  # ระยะห่างระหว่าง chunk ตอน stream
+MOCK_SEED = os.getenv('MOCK_SEED')
+
+rng = random.Random(int(MOCK_SEED) if MOCK_SEED else None)
+
+app = FastAPI(title="Mock Typhoon API")
+
+stats = {
+    "requests": 0,
+    "streamed": 0,
+    "rate_limited": 0,
+    "hung": 0,
+    "errors": 0
+}
+
+# token bucket จำลอง quota ของ upstream
+quota_tokens = 1.0
+quota_updated_at = time.monotonic()
+
+SAMPLE_SENTENCES = [
+    "สวัสดีครับ ยินดีที่ได้รู้จัก",
+    "วันนี้อยากเรียนรู้เรื่องใหม่ๆ",
+    "ช่วยอธิบายอีกครั้งได้ไหมครับ",
+    "ขอบคุณมากที่ช่วยเหลือ",
+    "หยุดก่อนนะ แล้วไปต่อข้อถัดไป",
+    "AI ทำงานอย่างไรครับ",
+]
+
+
+def take_quota() -> bool:
+    """ใช้ quota หนึ่งหน่วย ถ้าหมดให้ตอบ 429"""
+    global quota_tokens, quota_updated_at
+    if MOCK_RPM <= 0:
+        return True
+    now = time.monotonic()
+    quota_tokens = min(1.0, quota_tokens + (now - quota_updated_at) * MOCK_RPM / 60)
+    quota_updated_at = now
+    if quota_tokens >= 1:
+        quota_tokens -= 1
+        return True
+    return False
+
+
+def sample_latency() -> float:
+    """สุ่ม latency (วินาที) แบบ log-normal รอบค่า median ที่ตั้งไว้"""
+    if MOCK_JITTER <= 0:
+        return MOCK_LATENCY_MS / 1000
+    return MOCK_LATENCY_MS / 1000 * rng.lognormvariate(0, MOCK_JITTER)
+
+
+def build_answer(prompt: str, max_tokens: int) -> str:
+    """สร้างคำตอบแบบรายการเลขข้อ (หรือหลายชุดสำหรับ prompt แบบ pack)"""
+    if max_tokens <= 1:
+        return "ok"
+    packed_sets = len(re.findall(r"ชุดที่ \d+:", prompt))
+    if packed_sets:
+        sections = []
+        for number in range(1, packed_sets + 1):
+            lines = [f"{index}. {sentence}" for index, sentence in enumerate(rng.sample(SAMPLE_SENTENCES, 3), start=1)]
+            sections.append(f"[{number}]\n" + "\n".join(lines))
+        return "\n".join(sections)
+    return "\n".join(f"{index}. {sentence}" for index, sentence in enumerate(rng.sample(SAMPLE_SENTENCES, 3), start=1))
+
+
+def completion(content: str, model: str) -> dict:
+    return {
+        "id": f"mock-{stats['requests']}",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    model = body.get("model", "mock")
+    prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+
+    if not take_quota() or rng.random() < MOCK_RATE_429:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}},
+            status_code=429,
+            headers={"Retry-After": f"{MOCK_RETRY_AFTER:g}"}
+        )
+
+    if rng.random() < MOCK_TIMEOUT_RATE:
+        stats["hung"] += 1
+        await asyncio.sleep(MOCK_HANG_SECONDS)
+
+    if rng.random() < MOCK_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "Internal error"}}, status_code=500)
+
+    content = build_answer(prompt, int(body.get("max_tokens", 700)))
+    latency = sample_latency()
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency)
+        return completion(content, model)
+
+    stats["streamed"] += 1
+
+    async def events():
+        # latency ส่วนใหญ่อยู่ก่อน token แรก ที่เหลือกระจายตาม chunk
+        await asyncio.sleep(latency * 0.3)
+        for start in range(0, len(content), 6):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content[start:start + 6]}}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(MOCK_STREAM_CHUNK_MS / 1000)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def mock_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Typhoon API สำหรับ benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, help="latency เฉลี่ย (median) ms")
+    parser.add_argument("--jitter", type=float, help="sigma ของ log-normal latency")
+    parser.add_argument("--rate-429", type=float, help="โอกาสตอบ 429 แบบสุ่ม (0-1)")
+    parser.add_argument("--retry-after", type=float, help="Retry-After ที่ส่งกลับพร้อม 429 (วินาที)")
+    parser.add_argument("--rpm", type=float, help="quota requests ต่อนาที (0 = ไม่จำกัด)")
+    parser.add_argument("--timeout-rate", type=float, help="โอกาสที่ request ค้างไม่ตอบ (0-1)")
+    parser.add_argument("--error-rate", type=float, help="โอกาสตอบ 500 (0-1)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    # ส่งค่าผ่าน environment ให้ process ของ uvicorn อ่านตอน import
+    overrides = {
+        "MOCK_LATENCY_MS": args.latency_ms,
+        "MOCK_JITTER": args.jitter,
+        "MOCK_RATE_429": args.rate_429,
+        "MOCK_RETRY_AFTER": args.retry_after,
+        "MOCK_RPM": args.rpm,
+        "MOCK_TIMEOUT_RATE": args.timeout_rate,
+        "MOCK_ERROR_RATE": args.error_rate,
+        "MOCK_SEED": args.seed
+    }
+    for key, value in overrides.items():
+        if value is not None:
+            os.environ[key] = str(value)
+
+    import uvicorn
+    uvicorn.run("mock_typhoon:app", app_dir=os.path.dirname(os.path.abspath(__file__)),
+                host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
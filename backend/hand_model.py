@@ -0,0 +1,247 @@
+"""
+Hand model inference ด้วย NumPy (ไม่ต้องใช้ TensorFlow)
+- โหลด topology (Sequential ของ Dense/Dropout) และ weights manifest ของ TF.js จาก model.json
+- เก็บ weight เป็น float32 แบบ contiguous (หรือ memory-map จาก weights.bin โดยตรง)
+- MicroBatcher รวม request ที่เข้ามาพร้อมกันเป็น batch เดียวก่อนคูณเมทริกซ์
+"""
+
+from typing import List, Optional, Tuple
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+SUPPORTED_ACTIVATIONS = ("linear", "relu", "softmax", "sigmoid", "tanh")
+
+
+def _activate(x: np.ndarray, activation: str) -> np.ndarray:
+    if activation == "relu":
+        return np.maximum(x, 0, out=x)
+    if activation == "softmax":
+        x -= x.max(axis=1, keepdims=True)
+        np.exp(x, out=x)
+        x /= x.sum(axis=1, keepdims=True)
+        return x
+    if activation == "sigmoid":
+        return 1 / (1 + np.exp(-x))
+    if activation == "tanh":
+        return np.tanh(x, out=x)
+    return x
+
+
+class DenseLayer:
+    def __init__(self, name: str, kernel: np.ndarray, bias: Optional[np.ndarray], activation: str):
+        self.name = name
+        self.kernel = kernel
+        self.bias = bias
+        self.activation = activation
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        y = x @ self.kernel
+        if self.bias is not None:
+            y += self.bias
+        return _activate(y, self.activation)
+
+
+class HandModel:
+    """โมเดล Teachable Machine (Dense layers) ที่รันด้วย NumPy"""
+
+    def __init__(self, layers: List[DenseLayer], labels: List[str], input_size: int, mmap: bool = False):
+        self.layers = layers
+        self.labels = labels
+        self.input_size = input_size
+        self.mmap = mmap
+
+    @classmethod
+    def load(cls, model_dir: str, mmap: bool = False) -> "HandModel":
+        """โหลด model.json, weights (ตาม weightsManifest) และ label จาก metadata.json"""
+        with open(os.path.join(model_dir, "model.json"), encoding="utf-8") as f:
+            model_json = json.load(f)
+        with open(os.path.join(model_dir, "metadata.json"), encoding="utf-8") as f:
+            labels = json.load(f)["labels"]
+
+        weights = cls._load_weights(model_dir, model_json["weightsManifest"], mmap)
+
+        topology = model_json["modelTopology"]
+        if "model_config" in topology:  # format ของ keras ที่ export ผ่าน converter
+            topology = topology["model_config"]
+        if topology["class_name"] != "Sequential":
+            raise Exception(f"Unsupported model class: {topology['class_name']}")
+
+        layers = []
+        input_size = None
+        for layer in topology["config"]["layers"]:
+            config = layer["config"]
+            if layer["class_name"] == "Dropout":
+                continue  # ไม่มีผลตอน inference
+            if layer["class_name"] != "Dense":
+                raise Exception(f"Unsupported layer type: {layer['class_name']}")
+            if input_size is None and config.get("batch_input_shape"):
+                input_size = config["batch_input_shape"][-1]
+            activation = config.get("activation", "linear")
+            if activation not in SUPPORTED_ACTIVATIONS:
+                raise Exception(f"Unsupported activation: {activation}")
+            name = config["name"]
+            kernel = weights[f"{name}/kernel"]
+            bias = weights.get(f"{name}/bias") if config.get("use_bias", True) else None
+            layers.append(DenseLayer(name, kernel, bias, activation))
+
+        if not layers:
+            raise Exception("Model has no Dense layers")
+        if input_size is None:
+            input_size = layers[0].kernel.shape[0]
+        if layers[-1].kernel.shape[1] != len(labels):
+            raise Exception(f"Model has {layers[-1].kernel.shape[1]} outputs but {len(labels)} labels")
+        return cls(layers, labels, input_size, mmap)
+
+    @staticmethod
+    def _load_weights(model_dir: str, manifest: list, mmap: bool) -> dict:
+        """อ่าน weight ทุกตัวตาม manifest เป็น float32 array (ต่อ shard ของแต่ละ group เข้าด้วยกัน)"""
+        weights = {}
+        for group in manifest:
+            paths = [os.path.join(model_dir, path) for path in group["paths"]]
+            if mmap and len(paths) == 1:
+                # weight ทั้ง group อยู่ในไฟล์เดียว อ่านผ่าน page cache ได้โดยไม่ต้อง copy
+                buffer = np.memmap(paths[0], dtype=np.float32, mode="r")
+            else:
+                buffer = np.concatenate([np.fromfile(path, dtype=np.float32) for path in paths])
+            offset = 0
+            for spec in group["weights"]:
+                if spec.get("dtype", "float32") != "float32" or "quantization" in spec:
+                    raise Exception(f"Unsupported weight dtype for {spec['name']}")
+                size = int(np.prod(spec["shape"]))
+                if offset + size > buffer.size:
+                    raise Exception(f"Weights file too small for {spec['name']}")
+                array = buffer[offset:offset + size].reshape(spec["shape"])
+                weights[spec["name"]] = np.asarray(array) if mmap else np.ascontiguousarray(array, dtype=np.float32)
+                offset += size
+        return weights
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """คืนความน่าจะเป็นของทุก label สำหรับ input shape (batch, input_size)"""
+        x = np.asarray(features, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        if x.shape[1] != self.input_size:
+            raise ValueError(f"Expected {self.input_size} features per vector, got {x.shape[1]}")
+        for layer in self.layers:
+            x = layer(x)
+        return x
+
+    def top_k(self, probabilities: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        """label และ confidence สูงสุด k อันดับของแต่ละแถว"""
+        k = max(1, min(k, probabilities.shape[1]))
+        if k < probabilities.shape[1]:
+            indices = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.tile(np.arange(probabilities.shape[1]), (probabilities.shape[0], 1))
+        rows = np.arange(probabilities.shape[0])[:, None]
+        order = np.argsort(-probabilities[rows, indices], axis=1)
+        indices = indices[rows, order]
+        scores = probabilities[rows, indices]
+        return [
+            [(self.labels[index], float(score)) for index, score in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices.tolist(), scores.tolist())
+        ]
+
+    def info(self) -> dict:
+        return {
+            "input_size": self.input_size,
+            "labels": self.labels,
+            "layers": [
+                {"name": layer.name, "shape": list(layer.kernel.shape), "activation": layer.activation}
+                for layer in self.layers
+            ],
+            "mmap": self.mmap,
+            "parameters": int(sum(layer.kernel.size + (layer.bias.size if layer.bias is not None else 0)
+                                  for layer in self.layers))
+        }
+
+
+class MicroBatcher:
+    """รวม request ที่เข้ามาใกล้ๆ กันเป็น batch เดียว (รอไม่เกิน max_wait_ms หรือจนครบ max_batch แถว)"""
+
+    def __init__(self, model: HandModel, max_batch: int = 64, max_wait_ms: float = 2.0):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.queue = None
+        self._worker = None
+
+        # สถิติ
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_seen = 0
+        self.inference_seconds = 0.0
+
+    async def predict(self, features: np.ndarray) -> np.ndarray:
+        """ส่ง features (rows, input_size) เข้าคิว แล้วรอความน่าจะเป็นของแถวเหล่านั้น"""
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self.requests += 1
+        await self.queue.put((features, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            items = [await self.queue.get()]
+            rows = items[0][0].shape[0]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while rows < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                rows += item[0].shape[0]
+
+            items = [(features, future) for features, future in items if not future.done()]
+            if not items:
+                continue
+            batch = items[0][0] if len(items) == 1 else np.concatenate([features for features, _ in items])
+            started = time.perf_counter()
+            try:
+                # numpy ปล่อย GIL ระหว่างคูณเมทริกซ์ จึงรันใน thread เพื่อไม่ให้ event loop ค้าง
+                probabilities = await asyncio.to_thread(self.model.predict, batch)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.inference_seconds += time.perf_counter() - started
+            self.batches += 1
+            self.rows += batch.shape[0]
+            self.max_batch_seen = max(self.max_batch_seen, batch.shape[0])
+
+            offset = 0
+            for features, future in items:
+                count = features.shape[0]
+                if not future.done():
+                    future.set_result(probabilities[offset:offset + count])
+                offset += count
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_rows": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "max_batch_rows": self.max_batch_seen,
+            "avg_inference_ms": round(self.inference_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait_ms
+        }
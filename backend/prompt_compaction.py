@@ -0,0 +1,144 @@
+"""
+ย่อข้อมูล capture ก่อนส่งเข้า prompt ของ Typhoon
+- รวม capture ที่ติดกันและได้ผลเดียวกัน (คำ อารมณ์ และสถานะใบหน้า) เป็นรายการเดียวพร้อมจำนวน (count)
+- ตัด capture ที่ confidence ของคำต่ำกว่าเกณฑ์ (ถ้าตัดหมดจะเหลือ capture ที่ดีที่สุดไว้หนึ่งรายการ)
+- ปัดเศษ confidence และละ field ที่เป็นค่าปกติ (ตรวจพบใบหน้า 1 ใบ)
+- ประเมินจำนวน token ของ prompt และกำหนด max_tokens ตามความยาวคำตอบที่คาดไว้ (3 ประโยค)
+"""
+
+from typing import Optional
+import json
+
+# field ของ summary ที่ซ้ำกับข้อมูลใน captures
+DUPLICATE_SUMMARY_FIELDS = ("words", "emotions")
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def estimate_tokens(text: str) -> int:
+    """ประเมินจำนวน token แบบหยาบ: อักษรละติน/JSON ~4 ตัวต่อ token, อักษรไทย ~2 ตัวต่อ token"""
+    # อักษรไทยเป็น 3 byte ใน UTF-8 จึงนับจำนวนอักษรที่ไม่ใช่ ASCII จากจำนวน byte ได้โดยไม่ต้องวนทีละตัว
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    return -(-(len(text) - non_ascii) // 4) + -(-non_ascii // 2)
+
+
+def sentence_max_tokens(word_count: int, sentences: int = 3, base_tokens: int = 40, word_tokens: int = 8,
+                        cap: int = 700) -> int:
+    """max_tokens สำหรับคำตอบ sentences ประโยค (ประโยคยาวขึ้นตามจำนวนคำที่ต้องใช้ แต่ไม่เกิน cap)"""
+    return min(cap, sentences * (base_tokens + word_tokens * max(word_count, 1)))
+
+
+class CaptureCompactor:
+    """ย่อรายการ capture แบบทีละรายการ (ใช้ได้ทั้งกับ request เดียวและ capture session ที่โตขึ้นเรื่อยๆ)
+
+    เก็บ JSON ของรายการที่รวมเสร็จแล้วไว้ มีเพียงรายการสุดท้ายที่ยังอาจรวม capture ถัดไปได้
+    """
+
+    def __init__(self, confidence_floor: float = 0.3, precision: int = 2):
+        self.confidence_floor = confidence_floor
+        self.precision = precision
+        self.closed_json = ""  # JSON ของรายการที่ปิดแล้ว (คั่นด้วย ", ")
+        self.closed = 0
+        self.run = None  # รายการสุดท้ายที่ยังรวม capture ได้
+        self.kept = 0
+        self.dropped = 0
+        self.best_dropped = None  # capture ที่ถูกตัดแต่ confidence สูงสุด (ใช้เมื่อไม่เหลือ capture เลย)
+        self.unknown_words = 0  # capture ที่ไม่มีคำ (Unknown) ถ้ามีจะยังส่ง summary.words ไปด้วย
+
+    def _new_run(self, entry: dict, word_confidence: float) -> dict:
+        return {
+            "key": self._key(entry),
+            "entry": entry,
+            "count": 1,
+            "word_total": word_confidence,
+            "emotion_total": _to_float(entry.get("emotionConfidence", 0))
+        }
+
+    @staticmethod
+    def _key(entry: dict) -> tuple:
+        return (
+            entry.get("word"),
+            entry.get("emotion"),
+            bool(entry.get("faceDetected", False)),
+            int(_to_float(entry.get("faceCount", 0))) > 1
+        )
+
+    def add(self, entry: dict):
+        """เพิ่ม capture หนึ่งรายการ (รูปแบบเดียวกับที่ใช้ใน prompt: word, wordConfidence, emotion, ...)"""
+        word_confidence = _to_float(entry.get("wordConfidence", 0))
+        if entry.get("word", "Unknown") == "Unknown":
+            self.unknown_words += 1
+        if word_confidence < self.confidence_floor:
+            self.dropped += 1
+            if self.best_dropped is None or word_confidence > self.best_dropped["word_total"]:
+                self.best_dropped = self._new_run(entry, word_confidence)
+            return
+
+        self.kept += 1
+        if self.run is not None and self.run["key"] == self._key(entry):
+            self.run["count"] += 1
+            self.run["word_total"] += word_confidence
+            self.run["emotion_total"] += _to_float(entry.get("emotionConfidence", 0))
+            return
+
+        if self.run is not None:
+            separator = ", " if self.closed else ""
+            self.closed_json += separator + self._run_json(self.run)
+            self.closed += 1
+        self.run = self._new_run(entry, word_confidence)
+
+    def _run_json(self, run: dict) -> str:
+        entry = run["entry"]
+        count = run["count"]
+        item = {
+            "word": entry.get("word", "Unknown"),
+            "wordConfidence": round(run["word_total"] / count, self.precision),
+            "emotion": entry.get("emotion", "neutral"),
+            "emotionConfidence": round(run["emotion_total"] / count, self.precision)
+        }
+        if count > 1:
+            item["count"] = count
+        if not entry.get("faceDetected", False):
+            item["faceDetected"] = False
+        face_count = int(_to_float(entry.get("faceCount", 0)))
+        if face_count > 1:
+            item["faceCount"] = face_count
+        return json.dumps(item, ensure_ascii=False)
+
+    @property
+    def runs(self) -> int:
+        if self.run is not None:
+            return self.closed + 1
+        return 1 if self.best_dropped is not None else 0
+
+    def captures_json(self) -> str:
+        """JSON array ของ capture ที่ย่อแล้ว"""
+        if self.run is None:
+            return f"[{self._run_json(self.best_dropped)}]" if self.best_dropped is not None else "[]"
+        separator = ", " if self.closed else ""
+        return f"[{self.closed_json}{separator}{self._run_json(self.run)}]"
+
+
+def compact_summary(summary: dict, precision: int = 2, drop=DUPLICATE_SUMMARY_FIELDS) -> dict:
+    """summary ที่ตัด field ซ้ำกับ captures (drop) ออกและปัดเศษตัวเลข"""
+    def rounded(value):
+        if isinstance(value, float):
+            return round(value, precision)
+        if isinstance(value, dict):
+            return {key: rounded(item) for key, item in value.items()}
+        return value
+
+    return {key: rounded(value) for key, value in summary.items() if key not in drop}
+
+
+def compact_data_json(compactor: CaptureCompactor, summary: Optional[dict]) -> str:
+    """JSON ของข้อมูลสำหรับ prompt หลังย่อ (โครงสร้างเดียวกับแบบเดิม: captures และ summary)"""
+    # ตัด summary.words เฉพาะเมื่อทุก capture มีคำจริง ไม่งั้น summary เป็นที่เดียวที่ยังมีคำอยู่
+    drop = DUPLICATE_SUMMARY_FIELDS if not compactor.unknown_words else ("emotions",)
+    summary_json = json.dumps(compact_summary(summary or {}, compactor.precision, drop), ensure_ascii=False)
+    return f'{{"captures": {compactor.captures_json()}, "summary": {summary_json}}}'
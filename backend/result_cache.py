@@ -0,0 +1,275 @@
+"""
+Result cache สำหรับประโยคที่สร้างจาก Typhoon
+- hot tier: LRU ในหน่วยความจำ พร้อม TTL
+- warm tier: SQLite (mmap) บนดิสก์ อยู่รอดข้ามการ restart และจำกัดขนาดด้วย eviction
+"""
+
+from collections import OrderedDict
+from typing import List, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def bucket_confidences(confidences: Optional[List[float]], step: float) -> List[int]:
+    """ปัดค่า confidence ลงเป็น bucket เพื่อให้ค่าที่ใกล้กันได้ key เดียวกัน"""
+    if not confidences:
+        return []
+    buckets = []
+    for conf in confidences:
+        try:
+            conf = float(conf)
+        except (TypeError, ValueError):
+            conf = 0.0
+        buckets.append(int(round(min(max(conf, 0.0), 1.0) / step)))
+    return buckets
+
+
+def make_cache_key(kind: str, words: List[str], emotion: str,
+                   word_confidences: Optional[List[float]] = None,
+                   emotion_confidences: Optional[List[float]] = None,
+                   bucket_step: float = 0.1) -> str:
+    """สร้าง key จากรูปแบบมาตรฐานของ request: ลำดับคำ อารมณ์หลัก และ confidence แบบ bucket"""
+    canonical = {
+        "kind": kind,
+        "words": [str(word).strip() for word in words],
+        "emotion": (emotion or "neutral").strip().lower(),
+        "wordConfidences": bucket_confidences(word_confidences, bucket_step),
+        "emotionConfidences": bucket_confidences(emotion_confidences, bucket_step)
+    }
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryLRUCache:
+    """LRU cache ในหน่วยความจำ พร้อม TTL ต่อ entry"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value, size)
+        self.bytes = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, size = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value, size: int):
+        if self.max_entries <= 0:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, value, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+
+    def _remove(self, key: str):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+class SQLiteCache:
+    """Cache บนดิสก์ด้วย SQLite (WAL + mmap) จำกัดขนาดรวมเป็น bytes"""
+
+    def __init__(self, path: str, max_bytes: int = 16 * 1024 * 1024, ttl: float = 7 * 24 * 3600.0,
+                 mmap_size: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.mmap_size = mmap_size
+        self.conn = None
+        self.lock = threading.Lock()
+        self.bytes = 0
+
+    def open(self):
+        if self.conn is not None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed_at)")
+        self.conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+        self.bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def get(self, key: str):
+        if self.conn is None:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            now = time.time()
+            if created_at < now - self.ttl:
+                self._delete(key)
+                return None
+            self.conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        return value
+
+    def put(self, key: str, value: str):
+        if self.conn is None:
+            return
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            self._delete(key)
+            self.conn.execute(
+                "INSERT INTO results (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self.bytes += size
+            self._evict()
+
+    def _delete(self, key: str):
+        row = self.conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.bytes -= row[0]
+
+    def _evict(self):
+        # ลบ entry ที่ถูกใช้ล่าสุดนานที่สุดก่อน จนขนาดรวมไม่เกิน max_bytes
+        while self.bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM results ORDER BY accessed_at LIMIT 32"
+            ).fetchall()
+            if not rows:
+                self.bytes = 0
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.bytes -= size
+                if self.bytes <= self.max_bytes:
+                    break
+
+    def count(self) -> int:
+        if self.conn is None:
+            return 0
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self):
+        if self.conn is None:
+            return
+        with self.lock:
+            self.conn.execute("DELETE FROM results")
+            self.bytes = 0
+
+
+class ResultCache:
+    """Cache สองชั้น: ค้นหาในหน่วยความจำก่อน แล้วจึงค้นบนดิสก์ (และดึงขึ้นมาไว้ในหน่วยความจำ)"""
+
+    def __init__(self, memory: MemoryLRUCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def open(self):
+        if self.disk is not None:
+            try:
+                self.disk.open()
+            except sqlite3.Error as e:
+                print(f"[WARNING] Result cache disk tier disabled: {e}")
+                self.disk = None
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return list(value)
+
+        if self.disk is not None:
+            try:
+                raw = self.disk.get(key)
+            except sqlite3.Error as e:
+                print(f"[WARNING] Result cache read failed: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self.memory.put(key, tuple(value), len(raw.encode("utf-8")))
+                self.disk_hits += 1
+                return list(value)
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, sentences: List[str]):
+        if not sentences:
+            return
+        raw = json.dumps(sentences, ensure_ascii=False)
+        self.memory.put(key, tuple(sentences), len(raw.encode("utf-8")))
+        if self.disk is not None:
+            try:
+                self.disk.put(key, raw)
+            except sqlite3.Error as e:
+                print(f"[WARNING] Result cache write failed: {e}")
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": {
+                "entries": len(self.memory.entries),
+                "bytes": self.memory.bytes,
+                "max_entries": self.memory.max_entries,
+                "ttl": self.memory.ttl
+            },
+            "disk": {
+                "enabled": self.disk is not None,
+                "path": self.disk.path if self.disk is not None else None,
+                "entries": self.disk.count() if self.disk is not None else 0,
+                "bytes": self.disk.bytes if self.disk is not None else 0,
+                "max_bytes": self.disk.max_bytes if self.disk is not None else 0
+            }
+        }
@@ -0,0 +1,378 @@
+"""
+ตัวสร้างประโยคแบบ offline (ไม่ต้องเรียก LLM) สำหรับเส้นทาง fallback
+- คำแต่ละคำใน vocabulary ของ hand model มีชนิดคำ (กริยา, คำนาม, คำถาม, คำปฏิเสธ) และรูปประโยคของตัวเอง
+- เรียงคำเป็นประโยคตามกฎ: คำนามเป็นกรรมของกริยาที่อยู่ใกล้ที่สุด, กริยาหลายตัวต่อกันด้วย "แล้ว",
+  "อย่างไร" ทำให้เป็นประโยคคำถาม และ "ไม่ใช่" ปฏิเสธคำที่ตามมา
+- ตอน startup สร้างตารางประโยคล่วงหน้าสำหรับทุกลำดับคำ (ไม่เกิน precompute_length คำ) × ทุกอารมณ์
+  ตอนใช้งานจึงเป็นแค่การค้น dict ไม่มี I/O
+"""
+
+from itertools import permutations
+from typing import Dict, List, Optional, Sequence, Tuple
+import json
+import time
+
+UNKNOWN_WORD = "unknown"
+IDLE_LABELS = {"สถานะว่าง"}  # ท่าว่าง ไม่ใช่คำที่ผู้ใช้ตั้งใจสื่อ
+
+EMOTIONS = ("neutral", "happy", "sad", "angry", "surprised", "fear", "disgust")
+EMOTION_ALIASES = {
+    "surprise": "surprised",
+    "fearful": "fear",
+    "disgusted": "disgust",
+    "sadness": "sad",
+    "joy": "happy"
+}
+
+# น้ำเสียงของแต่ละอารมณ์: ข้อความนำหน้าประโยคที่สอง และ emoji ท้ายประโยค
+EMOTION_TONES = {
+    "neutral": {"lead": "", "emoji": ""},
+    "happy": {"lead": "ดีใจจัง ", "emoji": " 😊"},
+    "sad": {"lead": "ตอนนี้ไม่ค่อยสบายใจ ", "emoji": " 😢"},
+    "angry": {"lead": "ตอนนี้หงุดหงิดมาก ", "emoji": " 😠"},
+    "surprised": {"lead": "จริงเหรอ ", "emoji": " 😮"},
+    "fear": {"lead": "กังวลนิดหน่อย ", "emoji": " 😟"},
+    "disgust": {"lead": "ไม่ค่อยชอบเลย ", "emoji": ""}
+}
+
+# ประโยคเมื่อไม่มีคำที่จับได้ (มีแต่ Unknown) ใช้อารมณ์อย่างเดียว
+EMOTION_ONLY_SENTENCES = {
+    "neutral": ("สวัสดีครับ/ค่ะ", "ยินดีที่ได้พบกันครับ/ค่ะ", "มีอะไรให้ช่วยไหมครับ/คะ"),
+    "happy": ("ดีใจมากเลยครับ/ค่ะ 😊", "มีความสุขจังเลย 😊", "วันนี้อารมณ์ดีมากครับ/ค่ะ 😊"),
+    "sad": ("เศร้าใจนิดหน่อยครับ/ค่ะ 😢", "รู้สึกไม่ค่อยดีเท่าไหร่ 😢", "วันนี้ใจไม่ค่อยดีครับ/ค่ะ 😢"),
+    "angry": ("รู้สึกหงุดหงิดนิดหน่อย 😠", "อารมณ์ไม่ค่อยดีครับ/ค่ะ 😠", "รู้สึกไม่พอใจเล็กน้อย 😠"),
+    "surprised": ("ตกใจมากเลยครับ/ค่ะ 😮", "ไม่คิดว่าจะเป็นแบบนี้ 😮", "จริงเหรอครับ/คะ 😮"),
+    "fear": ("รู้สึกกังวลนิดหน่อยครับ/ค่ะ 😟", "ไม่ค่อยแน่ใจเลย 😟", "ช่วยอยู่ด้วยกันก่อนได้ไหมครับ/คะ 😟"),
+    "disgust": ("ไม่ค่อยชอบแบบนี้เลยครับ/ค่ะ", "รู้สึกไม่ดีกับเรื่องนี้", "ขอเปลี่ยนเป็นอย่างอื่นได้ไหมครับ/คะ")
+}
+
+# ชนิดคำและรูปประโยคของคำใน vocabulary ({object} คือกรรมของกริยา)
+LEXICON = {
+    "เริ่ม": {
+        "class": "verb",
+        "aspect": True,  # ต่อหน้ากริยาอื่นได้โดยตรง (เริ่มเรียนรู้)
+        "bare": "เริ่ม{object}",
+        "object_prefix": "ใช้",
+        "command": "เริ่ม{object}กันเลย",
+        "want": "อยากเริ่ม{object}",
+        "ask": "จะเริ่ม{object}อย่างไร"
+    },
+    "เรียนรู้": {
+        "class": "verb",
+        "bare": "เรียนรู้{object}",
+        "object_prefix": "เรื่อง",
+        "command": "มาเรียนรู้{object}กัน",
+        "want": "อยากเรียนรู้{object}",
+        "ask": "จะเรียนรู้{object}อย่างไร"
+    },
+    "ช่วยเหลือ": {
+        "class": "verb",
+        "bare": "ช่วยเหลือ{object}",
+        "object_prefix": "เรื่อง",
+        "command": "ช่วยเหลือ{object}หน่อย",
+        "want": "อยากได้ความช่วยเหลือ{object}",
+        "ask": "จะขอความช่วยเหลือ{object}ได้อย่างไร"
+    },
+    "หยุด": {
+        "class": "verb",
+        "aspect": True,
+        "bare": "หยุด{object}",
+        "object_prefix": "ใช้",
+        "command": "หยุด{object}ก่อน",
+        "want": "อยากหยุด{object}ก่อน",
+        "ask": "จะหยุด{object}อย่างไร"
+    },
+    "AI": {
+        "class": "noun",
+        "object": "AI",
+        "command": "มาคุยเรื่อง{object}กัน",
+        "want": "อยากรู้เรื่อง{object}",
+        "ask": "{object}ทำงานอย่างไร"
+    },
+    "ถัดไป": {
+        "class": "noun",
+        "object": "ขั้นตอนถัดไป",
+        "standalone_object": True,  # ไม่ต้องเติม object_prefix ของกริยา
+        "command": "ไป{object}กันเลย",
+        "want": "อยากไป{object}",
+        "ask": "{object}คืออะไร"
+    },
+    "อย่างไร": {"class": "question"},
+    "ไม่ใช่": {"class": "negation"}
+}
+
+# คำที่ไม่มีใน LEXICON (label ใหม่ของโมเดล) ถือเป็นคำนามทั่วไป
+GENERIC_NOUN = {
+    "class": "noun",
+    "command": "{object}",
+    "want": "อยากสื่อว่า{object}",
+    "ask": "{object}ใช่ไหม"
+}
+
+# ประโยคเมื่อมีแต่ "อย่างไร" และ/หรือ "ไม่ใช่" (ข้อความ, เป็นคำถามหรือไม่)
+MARKER_SENTENCES = {
+    "question": (("ทำอย่างไรดี", True), ("อยากรู้ว่าต้องทำอย่างไร", False),
+                 ("ช่วยอธิบายหน่อยได้ไหมว่าทำอย่างไร", True)),
+    "negation": (("ไม่ใช่แบบนั้น", False), ("ไม่ใช่สิ่งที่ต้องการ", False), ("ขอเปลี่ยนเป็นอย่างอื่นได้ไหม", True)),
+    "both": (("ไม่ใช่แบบนี้ แล้วต้องทำอย่างไร", True), ("อยากรู้ว่าที่ถูกต้องทำอย่างไร", False),
+             ("ช่วยบอกวิธีที่ถูกต้องหน่อยได้ไหม", True))
+}
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _is_latin(char: str) -> bool:
+    return char.isascii() and char.isalnum()
+
+
+def _space_latin(phrase: str) -> str:
+    """เว้นวรรครอบคำภาษาอังกฤษ (เช่น AI) ที่อยู่ติดกับคำไทย"""
+    if not phrase:
+        return phrase
+    if _is_latin(phrase[0]):
+        phrase = " " + phrase
+    if _is_latin(phrase[-1]):
+        phrase = phrase + " "
+    return phrase
+
+
+def _tidy(sentence: str) -> str:
+    return " ".join(sentence.split())
+
+
+def normalize_emotion(emotion: Optional[str]) -> str:
+    emotion = (emotion or "neutral").lower()
+    emotion = EMOTION_ALIASES.get(emotion, emotion)
+    return emotion if emotion in EMOTION_TONES else "neutral"
+
+
+class SentenceEngine:
+    """สร้างประโยคไทย 3 ประโยคจากลำดับคำภาษามือและอารมณ์ โดยค้นจากตารางที่สร้างไว้ตอน startup"""
+
+    def __init__(self, min_confidence: float = 0.5, max_words: int = 4, precompute_length: int = 3):
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self.precompute_length = precompute_length
+        self.vocabulary = [word for word in LEXICON]
+        self.table: Dict[Tuple[Tuple[str, ...], str], Tuple[str, ...]] = {}
+        self.build_ms = 0.0
+
+        # สถิติ
+        self.lookups = 0
+        self.table_hits = 0
+        self.composed = 0
+
+    def build(self, labels: Sequence[str]):
+        """สร้างตารางประโยคสำหรับทุกลำดับคำของ label (คำละไม่ซ้ำ ไม่เกิน precompute_length คำ) × ทุกอารมณ์"""
+        started = time.perf_counter()
+        self.vocabulary = [label for label in labels if label not in IDLE_LABELS and label.lower() != UNKNOWN_WORD]
+        table = {}
+        for length in range(1, min(self.precompute_length, len(self.vocabulary)) + 1):
+            for words in permutations(self.vocabulary, length):
+                for emotion in EMOTIONS:
+                    table[(words, emotion)] = self.compose(words, emotion)
+        for emotion in EMOTIONS:
+            table[((), emotion)] = self.compose((), emotion)
+        self.table = table
+        self.build_ms = (time.perf_counter() - started) * 1000
+
+    def load(self, metadata_path: str):
+        """สร้างตารางจาก label ใน metadata.json ของ hand model"""
+        with open(metadata_path, encoding="utf-8") as f:
+            self.build(json.load(f)["labels"])
+
+    def key(self, words: Sequence[str], emotion: str = "neutral",
+            word_confidences: Sequence[float] = None) -> Tuple[Tuple[str, ...], str]:
+        """key ของตาราง: คำที่สื่อความหมาย (ตัด Unknown, ท่าว่าง, confidence ต่ำ และคำซ้ำ) ตามลำดับเดิม + อารมณ์"""
+        pairs = [
+            (word, word_confidences[index] if word_confidences and len(word_confidences) == len(words) else None)
+            for index, word in enumerate(words)
+            if word and word.lower() != UNKNOWN_WORD and word not in IDLE_LABELS
+        ]
+        confident = [word for word, confidence in pairs
+                     if confidence is None or _to_float(confidence) >= self.min_confidence]
+        selected = []
+        for word in confident or [word for word, _ in pairs]:
+            if word not in selected:
+                selected.append(word)
+        return tuple(selected[:self.max_words]), normalize_emotion(emotion)
+
+    def generate(self, words: Sequence[str], emotion: str = "neutral",
+                 word_confidences: Sequence[float] = None) -> List[str]:
+        """ประโยค 3 ประโยค (ค้นจากตาราง ถ้าไม่มีในตารางจึงประกอบตามกฎ)"""
+        key = self.key(words, emotion, word_confidences)
+        self.lookups += 1
+        sentences = self.table.get(key)
+        if sentences is None:
+            self.composed += 1
+            sentences = self.compose(*key)
+        else:
+            self.table_hits += 1
+        return list(sentences)
+
+    def generate_many(self, items: Sequence[tuple]) -> List[List[str]]:
+        """สร้างประโยคหลายชุดในครั้งเดียว: items คือ (words, emotion, word_confidences)
+
+        คำนวณ key ทั้งหมดก่อน แล้วประกอบประโยคเพียงครั้งเดียวต่อ key ที่ไม่ซ้ำกัน
+        """
+        keys = [self.key(*item) for item in items]
+        resolved = {}
+        for key in keys:
+            if key in resolved:
+                continue
+            sentences = self.table.get(key)
+            if sentences is None:
+                self.composed += 1
+                sentences = self.compose(*key)
+            else:
+                self.table_hits += 1
+            resolved[key] = sentences
+        self.lookups += len(keys)
+        return [list(resolved[key]) for key in keys]
+
+    # กฎการเรียงคำ
+    def _parse(self, words: Sequence[str]) -> dict:
+        """แยกลำดับคำเป็น clause (กริยา + กรรม), กรรมที่ไม่มีกริยา และเครื่องหมายคำถาม/ปฏิเสธ"""
+        clauses = []
+        loose_objects = []
+        question = False
+        negation_seen = False
+        negate_next = False
+        for word in words:
+            entry = LEXICON.get(word) or dict(GENERIC_NOUN, object=word)
+            word_class = entry["class"]
+            if word_class == "question":
+                question = True
+            elif word_class == "negation":
+                negate_next = True
+                negation_seen = True
+            elif word_class == "verb":
+                clause = {"verb": entry, "objects": [], "negated": negate_next}
+                if loose_objects and not clauses:
+                    # คำนามมาก่อนกริยาตัวแรก (เช่น "AI เรียนรู้") ให้เป็นกรรมของกริยานั้น
+                    clause["objects"], loose_objects = loose_objects, []
+                clauses.append(clause)
+                negate_next = False
+            else:
+                target = clauses[-1]["objects"] if clauses else loose_objects
+                target.append({"entry": entry, "negated": negate_next})
+                negate_next = False
+
+        if negate_next:
+            # "ไม่ใช่" อยู่ท้ายสุด ให้ปฏิเสธคำก่อนหน้า
+            if clauses and clauses[-1]["objects"]:
+                clauses[-1]["objects"][-1]["negated"] = True
+            elif clauses:
+                clauses[-1]["negated"] = True
+            elif loose_objects:
+                loose_objects[-1]["negated"] = True
+        return {
+            "clauses": clauses,
+            "objects": loose_objects,
+            "question": question,
+            "negation": negation_seen
+        }
+
+    @staticmethod
+    def _object_phrase(objects: List[dict], verb: Optional[dict] = None) -> str:
+        phrases = []
+        for obj in objects:
+            entry = obj["entry"]
+            phrase = entry["object"]
+            if obj["negated"]:
+                phrase = "เรื่องอื่นที่ไม่ใช่" + _space_latin(phrase)
+            elif verb is not None and not entry.get("standalone_object"):
+                phrase = verb.get("object_prefix", "") + _space_latin(phrase)
+            phrases.append(_space_latin(phrase))
+        return "และ".join(phrases)
+
+    def _clause_bare(self, clause: dict) -> str:
+        verb = clause["verb"]
+        bare = verb["bare"].format(object=self._object_phrase(clause["objects"], verb))
+        return ("ไม่" + bare) if clause["negated"] else bare
+
+    def _content_sentences(self, parsed: dict) -> List[tuple]:
+        """ประโยค 3 แบบ (สั่ง/ชวน, ความต้องการ, คำถาม) คืนเป็น (ข้อความ, เป็นคำถามหรือไม่)"""
+        clauses = parsed["clauses"]
+        if len(clauses) == 1:
+            clause = clauses[0]
+            verb = clause["verb"]
+            obj = self._object_phrase(clause["objects"], verb)
+            bare = verb["bare"].format(object=obj)
+            if clause["negated"]:
+                return [("ยังไม่ต้อง" + bare, False), ("ฉันยังไม่อยาก" + bare, False), ("ไม่" + bare + "ได้ไหม", True)]
+            return [
+                (verb["command"].format(object=obj), False),
+                ("ฉัน" + verb["want"].format(object=obj), False),
+                (verb["ask"].format(object=obj), True)
+            ]
+
+        if clauses:
+            # กริยาบอกลักษณะ (เริ่ม/หยุด) ที่ไม่มีกรรมต่อกับกริยาถัดไปได้เลย นอกนั้นต่อด้วย "แล้ว"
+            chain = self._clause_bare(clauses[0])
+            for previous, clause in zip(clauses, clauses[1:]):
+                joiner = "" if previous["verb"].get("aspect") and not previous["objects"] and not clause["negated"] else "แล้ว"
+                chain += joiner + self._clause_bare(clause)
+            return [(chain + "กันเลย", False), ("ฉันอยาก" + chain, False), ("ต้อง" + chain + "อย่างไร", True)]
+
+        objects = parsed["objects"]
+        if len(objects) == 1 and not objects[0]["negated"]:
+            entry = objects[0]["entry"]
+            obj = _space_latin(entry["object"])
+            return [
+                (entry["command"].format(object=obj), False),
+                ("ฉัน" + entry["want"].format(object=obj), False),
+                (entry["ask"].format(object=obj), True)
+            ]
+        if all(obj["negated"] for obj in objects):
+            phrase = "และ".join(_space_latin(obj["entry"]["object"]) for obj in objects)
+            return [("ไม่ใช่" + phrase, False), ("สิ่งที่ต้องการไม่ใช่" + phrase, False), ("ไม่ใช่" + phrase + "ใช่ไหม", True)]
+        phrase = self._object_phrase(objects)
+        return [
+            ("มาคุยเรื่อง" + phrase + "กัน", False),
+            ("ฉันอยากรู้เรื่อง" + phrase, False),
+            (phrase + "เกี่ยวข้องกันอย่างไร", True)
+        ]
+
+    def compose(self, words: Sequence[str], emotion: str = "neutral") -> Tuple[str, ...]:
+        """ประกอบประโยคตามกฎ (words ต้องผ่าน key() มาแล้ว)"""
+        emotion = normalize_emotion(emotion)
+        parsed = self._parse(words)
+        if not parsed["clauses"] and not parsed["objects"]:
+            if parsed["question"] or parsed["negation"]:
+                marker = "both" if parsed["question"] and parsed["negation"] else (
+                    "question" if parsed["question"] else "negation")
+                sentences = list(MARKER_SENTENCES[marker])
+            else:
+                return EMOTION_ONLY_SENTENCES[emotion]
+        else:
+            sentences = self._content_sentences(parsed)
+            if parsed["question"]:
+                # มี "อย่างไร" ให้ประโยคคำถามขึ้นก่อน
+                sentences = [sentences[2], sentences[1], sentences[0]]
+
+        tone = EMOTION_TONES[emotion]
+        finished = []
+        for index, (text, is_question) in enumerate(sentences):
+            if index == 0:
+                particle = "ครับ/คะ" if is_question else "ครับ/ค่ะ"
+                text += (" " if _is_latin(text[-1]) else "") + particle
+            elif index == 1:
+                text = tone["lead"] + text
+            finished.append(_tidy(text + tone["emoji"]))
+        return tuple(finished)
+
+    def stats(self) -> dict:
+        return {
+            "vocabulary": len(self.vocabulary),
+            "table_entries": len(self.table),
+            "build_ms": round(self.build_ms, 2),
+            "lookups": self.lookups,
+            "table_hits": self.table_hits,
+            "composed": self.composed
+        }
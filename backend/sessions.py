@@ -0,0 +1,285 @@
+"""
+Capture session ฝั่ง server
+- client สร้าง session แล้วส่งภาพที่จับได้ (capture) เข้ามาทีละภาพ แทนการส่งรายการทั้งหมดทุกครั้งที่สร้างประโยค
+- session เก็บสรุปแบบอัปเดตทีละ capture (ลำดับคำ, histogram อารมณ์, สถิติ confidence)
+  และเก็บส่วนของ prompt ที่ serialize แล้ว ทำให้งานตอน generate ไม่โตตามจำนวน capture
+- ถ้ากำหนด compactor จะย่อ capture (รวมภาพที่ซ้ำกันติดกัน) ไปพร้อมกันทีละ capture ด้วย
+- หมดอายุตาม TTL และจำกัดหน่วยความจำรวม (ลบ session ที่ไม่ได้ใช้นานที่สุดก่อน)
+"""
+
+from collections import OrderedDict
+from typing import Optional
+import json
+import secrets
+import time
+
+from prompt_compaction import compact_data_json
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class InvalidCaptureError(ValueError):
+    pass
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ConfidenceStats:
+    """สถิติ confidence แบบสะสม (ไม่ต้องวนรายการทั้งหมดใหม่)"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def summary(self) -> dict:
+        return {
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "min": round(self.minimum, 4) if self.minimum is not None else 0.0,
+            "max": round(self.maximum, 4) if self.maximum is not None else 0.0
+        }
+
+
+class CaptureSession:
+    """ข้อมูลของ session หนึ่ง: capture ที่สะสมไว้ สรุป และ prompt fragment ที่ serialize แล้ว"""
+
+    def __init__(self, session_id: str, compactor=None):
+        self.id = session_id
+        self.created_at = time.time()
+        self.touched_at = time.monotonic()
+        self.version = 0  # เพิ่มทุกครั้งที่ข้อมูลเปลี่ยน ใช้ตรวจว่าค่าที่ cache ไว้ยังใช้ได้หรือไม่
+
+        self.words = []
+        self.emotions = []
+        self.word_confidences = []
+        self.emotion_confidences = []
+        self.emotion_counts = {}
+        self.word_stats = ConfidenceStats()
+        self.emotion_stats = ConfidenceStats()
+        self.latest_emotion = "neutral"
+
+        # JSON ของแต่ละส่วนที่ต่อท้ายทีละ capture (รูปแบบเดียวกับ json.dumps ของ prompt แบบ unified)
+        self.captures_json = ""
+        self.words_json = ""
+        self.emotions_json = ""
+        self.bytes = 0
+        self.compactor = compactor  # CaptureCompactor (None = ไม่ย่อ)
+
+        self._data_json = None
+        self._data_version = -1
+        self._cache_key = None
+        self._cache_key_version = -1
+        self._compact_json = None
+        self._compact_version = -1
+
+    def append(self, capture: dict) -> dict:
+        """เพิ่ม capture หนึ่งภาพและอัปเดตสรุป คืนข้อมูลของ capture ในรูปแบบที่ใช้ใน prompt"""
+        sign = capture.get("signLanguage") or {}
+        emotion_data = capture.get("emotion") or {}
+        face = capture.get("face") or {}
+
+        word = sign.get("bestWord") or sign.get("word") or "Unknown"
+        word_confidence = _to_float(sign.get("confidence", 0))
+        emotion = emotion_data.get("emotion") or emotion_data.get("bestEmotion") or "neutral"
+        # ตรวจก่อนแก้ข้อมูลใดๆ ค่าที่ไม่ใช่ข้อความจะทำให้ทุกการ generate ของ session นี้ล้มเหลว
+        if not isinstance(word, str):
+            raise InvalidCaptureError("word ต้องเป็นข้อความ")
+        if not isinstance(emotion, str):
+            raise InvalidCaptureError("emotion ต้องเป็นข้อความ")
+        emotion_confidence = _to_float(emotion_data.get("confidence", 0))
+
+        entry = {
+            "word": word,
+            "wordConfidence": sign.get("confidence", 0),
+            "emotion": emotion,
+            "emotionConfidence": emotion_data.get("confidence", 0),
+            "faceDetected": face.get("detected", False),
+            "faceCount": face.get("faceCount", 0)
+        }
+        entry_json = json.dumps(entry, ensure_ascii=False)
+        word_json = json.dumps(word, ensure_ascii=False)
+        emotion_json = json.dumps(emotion, ensure_ascii=False)
+
+        separator = ", " if self.words else ""
+        self.captures_json += separator + entry_json
+        self.words_json += separator + word_json
+        self.emotions_json += separator + emotion_json
+        self.bytes += len(entry_json) + len(word_json) + len(emotion_json) + 3 * len(separator)
+
+        self.words.append(word)
+        self.emotions.append(emotion)
+        self.word_confidences.append(word_confidence)
+        if emotion_data:
+            self.emotion_confidences.append(emotion_confidence)
+            self.emotion_stats.add(emotion_confidence)
+        self.word_stats.add(word_confidence)
+        self.emotion_counts[emotion] = self.emotion_counts.get(emotion, 0) + 1
+        if self.compactor is not None:
+            before = len(self.compactor.closed_json)
+            self.compactor.add(entry)
+            self.bytes += len(self.compactor.closed_json) - before
+        self.latest_emotion = emotion
+        self.version += 1
+        return entry
+
+    @property
+    def overall_emotion(self) -> str:
+        # เหมือน frontend: ใช้อารมณ์ล่าสุดเป็นอารมณ์หลัก
+        return self.latest_emotion
+
+    def summary(self) -> dict:
+        return {
+            "words": list(self.words),
+            "emotions": list(self.emotions),
+            "overallEmotion": self.overall_emotion,
+            "totalCaptures": len(self.words),
+            "emotionCounts": dict(self.emotion_counts),
+            "wordConfidence": self.word_stats.summary(),
+            "emotionConfidence": self.emotion_stats.summary()
+        }
+
+    def data_json(self) -> str:
+        """JSON ของข้อมูลทั้งหมดสำหรับ prompt (ประกอบจาก fragment ที่ serialize ไว้แล้ว)"""
+        if self._data_version != self.version:
+            summary_json = (
+                "{"
+                f'"words": [{self.words_json}], '
+                f'"emotions": [{self.emotions_json}], '
+                f'"overallEmotion": {json.dumps(self.overall_emotion, ensure_ascii=False)}, '
+                f'"totalCaptures": {len(self.words)}, '
+                f'"emotionCounts": {json.dumps(self.emotion_counts, ensure_ascii=False)}, '
+                f'"wordConfidence": {json.dumps(self.word_stats.summary())}, '
+                f'"emotionConfidence": {json.dumps(self.emotion_stats.summary())}'
+                "}"
+            )
+            self._data_json = f'{{"captures": [{self.captures_json}], "summary": {summary_json}}}'
+            self._data_version = self.version
+        return self._data_json
+
+    def compact_json(self) -> str:
+        """JSON ของข้อมูลสำหรับ prompt หลังย่อ (ถ้าไม่มี compactor จะเหมือน data_json)"""
+        if self.compactor is None:
+            return self.data_json()
+        if self._compact_version != self.version:
+            self._compact_json = compact_data_json(self.compactor, self.summary())
+            self._compact_version = self.version
+        return self._compact_json
+
+    def cache_key(self, make_key) -> str:
+        """key ของ result cache (คำนวณใหม่เฉพาะเมื่อข้อมูลเปลี่ยน)"""
+        if self._cache_key_version != self.version:
+            self._cache_key = make_key(self)
+            self._cache_key_version = self.version
+        return self._cache_key
+
+    def info(self) -> dict:
+        return {
+            "sessionId": self.id,
+            "createdAt": self.created_at,
+            "version": self.version,
+            "summary": self.summary()
+        }
+
+
+class SessionStore:
+    """เก็บ session ในหน่วยความจำ เรียงตามเวลาใช้งานล่าสุด พร้อม TTL และเพดานหน่วยความจำ"""
+
+    def __init__(self, ttl: float = 1800.0, max_sessions: int = 1000, max_bytes: int = 8 * 1024 * 1024,
+                 max_captures: int = 100, compactor_factory=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_captures = max_captures
+        self.compactor_factory = compactor_factory  # สร้าง CaptureCompactor ให้แต่ละ session
+        self.sessions = OrderedDict()  # session_id -> CaptureSession (เก่าสุดอยู่หน้า)
+        self.bytes = 0
+        self.on_remove = None  # callback(session) เมื่อ session ถูกลบ (หมดอายุ, ถูก evict หรือถูกลบเอง)
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def create(self) -> CaptureSession:
+        self.evict_expired()
+        compactor = self.compactor_factory() if self.compactor_factory is not None else None
+        session = CaptureSession(secrets.token_urlsafe(12), compactor)
+        self.sessions[session.id] = session
+        self.created += 1
+        self._enforce_limits()
+        return session
+
+    def get(self, session_id: str) -> Optional[CaptureSession]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if session.touched_at + self.ttl < now:
+            self._remove(session_id)
+            self.expired += 1
+            return None
+        session.touched_at = now
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def append(self, session: CaptureSession, capture: dict) -> dict:
+        if len(session.words) >= self.max_captures:
+            raise SessionLimitError(f"Session capture limit reached ({self.max_captures})")
+        before = session.bytes
+        entry = session.append(capture)
+        self.bytes += session.bytes - before
+        self._enforce_limits()
+        return entry
+
+    def delete(self, session_id: str) -> bool:
+        if session_id not in self.sessions:
+            return False
+        self._remove(session_id)
+        return True
+
+    def evict_expired(self):
+        # session เรียงตามเวลาใช้งาน จึงหยุดได้ทันทีที่เจอ session ที่ยังไม่หมดอายุ
+        now = time.monotonic()
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.touched_at + self.ttl >= now:
+                break
+            self._remove(session_id)
+            self.expired += 1
+
+    def _enforce_limits(self):
+        while self.sessions and (len(self.sessions) > self.max_sessions or self.bytes > self.max_bytes):
+            oldest = next(iter(self.sessions))
+            self._remove(oldest)
+            self.evicted += 1
+
+    def _remove(self, session_id: str):
+        session = self.sessions.pop(session_id)
+        self.bytes -= session.bytes
+        if self.on_remove is not None:
+            self.on_remove(session)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.sessions),
+            "bytes": self.bytes,
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "ttl": self.ttl,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "max_captures": self.max_captures
+        }
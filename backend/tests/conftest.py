@@ -0,0 +1,25 @@
+"""
+ตั้งค่าร่วมของ test ฝั่ง backend
+- ให้ import โมดูลของ backend ได้ตรงๆ (เหมือนตอนรัน python app.py ในโฟลเดอร์ backend)
+- ตั้ง environment ก่อน import app: ไม่เรียก Typhoon จริง ไม่เขียน cache ลงดิสก์ และไม่โหลด hand model
+"""
+
+import asyncio
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# load_dotenv ไม่ทับค่าที่มีอยู่แล้ว ค่าจาก .env ของเครื่องจึงไม่มีผลกับ test
+os.environ["TYPHOON_API_KEY"] = ""
+os.environ["TYPHOON_ENDPOINTS"] = ""
+os.environ["CACHE_DB_PATH"] = ""
+os.environ["RATE_LIMIT_BACKEND"] = "local"
+os.environ["HAND_MODEL_ENABLED"] = "false"
+os.environ["UPSTREAM_WARMUP"] = "false"
+
+
+def run(coroutine):
+    """รัน coroutine ใน event loop ใหม่ (ไม่ต้องพึ่ง plugin async ของ pytest)"""
+    return asyncio.run(coroutine)
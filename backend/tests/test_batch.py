@@ -0,0 +1,139 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from conftest import run
+
+PACKED_CONTENT = """[1]
+1. สวัสดีครับ
+2. สวัสดีตอนเช้า
+3. สวัสดีทุกคน
+[2]
+1. ขอบคุณมาก
+2. ขอบคุณที่ช่วย
+3. ขอบคุณครับ"""
+
+
+@pytest.fixture
+def packed_upstream(monkeypatch):
+    """upstream ปลอมที่ตอบคำตอบของโหมด pack สำหรับสองชุด"""
+    payloads = []
+
+    async def fake_request(payload):
+        payloads.append(payload)
+        return PACKED_CONTENT
+
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test")
+    monkeypatch.setattr(app, "request_typhoon_content", fake_request)
+    app.result_cache.clear()
+    yield payloads
+    app.result_cache.clear()
+
+
+def test_pack_results_are_split_by_set(packed_upstream):
+    jobs = {0: app.GenerateJob(["สวัสดี"], "happy"), 1: app.GenerateJob(["ขอบคุณ"], "neutral")}
+    results = run(app.resolve_batch_packed(jobs, pack_size=10, semaphore=asyncio.Semaphore(1)))
+
+    assert len(packed_upstream) == 1
+    assert results[0][:2] == (["สวัสดีครับ", "สวัสดีตอนเช้า", "สวัสดีทุกคน"], "typhoon-packed")
+    assert results[1][:2] == (["ขอบคุณมาก", "ขอบคุณที่ช่วย", "ขอบคุณครับ"], "typhoon-packed")
+
+
+def test_pack_results_are_not_served_to_single_requests(packed_upstream):
+    jobs = {0: app.GenerateJob(["สวัสดี"], "happy"), 1: app.GenerateJob(["ขอบคุณ"], "neutral")}
+    run(app.resolve_batch_packed(jobs, pack_size=10, semaphore=asyncio.Semaphore(1)))
+
+    single = app.GenerateJob(["สวัสดี"], "happy")
+    assert app.result_cache.get(single.cache_key) is None
+    assert app.result_cache.get(app.packed_cache_key(single)) == ["สวัสดีครับ", "สวัสดีตอนเช้า", "สวัสดีทุกคน"]
+
+    # pack ครั้งถัดไปใช้ผลที่ cache ไว้ได้โดยไม่เรียก upstream
+    results = run(app.resolve_batch_packed({0: single}, pack_size=10, semaphore=asyncio.Semaphore(1)))
+    assert results[0][1] == "typhoon-cache"
+    assert len(packed_upstream) == 1
+
+
+@pytest.fixture
+def client():
+    with TestClient(app.app) as client:
+        yield client
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """upstream ปลอม: handler(payload_text) คืนข้อความคำตอบหรือ raise, บันทึก payload ทุกครั้ง"""
+    state = {"payloads": [], "handler": None}
+
+    async def fake_request(payload):
+        text = json.dumps(payload, ensure_ascii=False)
+        state["payloads"].append(text)
+        return await state["handler"](text)
+
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test")
+    monkeypatch.setattr(app, "request_typhoon_content", fake_request)
+    app.result_cache.clear()
+    yield state
+    app.result_cache.clear()
+
+
+def batch(client, mode, words, **kwargs):
+    items = [{"words": [word], "emotion": "happy"} if word else {"words": []} for word in words]
+    response = client.post("/api/generate/batch", json={"items": items, "mode": mode, **kwargs})
+    assert response.status_code == 200
+    return response.json()["results"]
+
+
+def test_fanout_keeps_item_order_and_falls_back_per_item(client, upstream):
+    async def handler(text):
+        # item แรกตอบช้าสุด ผลลัพธ์ต้องยังเรียงตาม items
+        delay = {"หนึ่ง": 0.05, "สอง": 0.0, "สาม": 0.02}
+        word = next(word for word in delay if word in text)
+        if word == "สอง":
+            raise Exception("API Error: 500 - boom")
+        await asyncio.sleep(delay[word])
+        return f"1. {word}ก\n2. {word}ข\n3. {word}ค"
+
+    upstream["handler"] = handler
+    results = batch(client, "fanout", ["หนึ่ง", "สอง", "สาม", None])
+
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["provider"] for result in results] == ["typhoon", "fallback", "typhoon", "error"]
+    assert results[0]["sentences"] == ["หนึ่งก", "หนึ่งข", "หนึ่งค"]
+    assert results[2]["sentences"] == ["สามก", "สามข", "สามค"]
+    assert len(results[1]["sentences"]) == 3
+    assert results[3]["error"]
+
+
+def test_pack_splits_items_into_prompts_and_falls_back_per_set(client, upstream):
+    async def handler(text):
+        if "หนึ่ง" in text:
+            # ชุดที่ 2 (สอง) หายไปจากคำตอบ
+            return "[1]\n1. หนึ่งก\n2. หนึ่งข\n3. หนึ่งค"
+        raise Exception("API Timeout - request took too long")
+
+    upstream["handler"] = handler
+    results = batch(client, "pack", ["หนึ่ง", "สอง", "สาม"], packSize=2)
+
+    assert len(upstream["payloads"]) == 2
+    assert "สาม" not in upstream["payloads"][0] and "สาม" in upstream["payloads"][1]
+    assert [result["provider"] for result in results] == ["typhoon-packed", "fallback", "fallback"]
+    assert results[0]["sentences"] == ["หนึ่งก", "หนึ่งข", "หนึ่งค"]
+    assert all(len(result["sentences"]) == 3 for result in results)
+
+
+def test_offline_mode_never_calls_upstream_and_keeps_order(client, upstream):
+    upstream["handler"] = None
+    results = batch(client, "offline", ["เริ่ม", "หยุด", "เริ่ม"])
+
+    assert upstream["payloads"] == []
+    assert [result["provider"] for result in results] == ["offline"] * 3
+    assert results[0]["sentences"] == results[2]["sentences"]
+    assert all("หยุด" in sentence for sentence in results[1]["sentences"])
+
+
+def test_unknown_mode_is_rejected(client):
+    response = client.post("/api/generate/batch", json={"items": [{"words": ["ไป"]}], "mode": "serial"})
+    assert response.status_code == 400
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import app
+from app import CircuitBreaker
+from conftest import run
+
+
+def open_breaker(**kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker(min_requests=2, error_rate=0.5, **kwargs)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_opens_after_error_rate_and_rejects_until_open_seconds():
+    breaker = CircuitBreaker(min_requests=4, error_rate=0.5, open_seconds=60)
+    breaker.record_success(100)
+    breaker.record_failure()
+    breaker.record_success(100)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_slow_responses_count_as_errors():
+    breaker = CircuitBreaker(min_requests=2, error_rate=0.5, slow_ms=100)
+    breaker.record_success(500)
+    breaker.record_success(500)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_allows_one_probe_and_closes_on_success():
+    breaker = open_breaker(open_seconds=0)
+    assert breaker.probe_due()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # probe ค้างอยู่ ให้ผ่านได้ทีละหนึ่ง
+    breaker.record_success(50)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["window_requests"] == 0
+
+
+def test_failed_probe_reopens():
+    breaker = open_breaker(open_seconds=0)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+
+
+def test_release_returns_probe_slot():
+    breaker = open_breaker(open_seconds=0)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_upstream_monitor_survives_failed_iteration(monkeypatch):
+    calls = []
+    refresh_health = app.refresh_health
+
+    def flaky_refresh():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return refresh_health()
+
+    monkeypatch.setattr(app, "refresh_health", flaky_refresh)
+    monkeypatch.setattr(app, "HEALTH_REFRESH_SECONDS", 0.01)
+
+    async def main():
+        task = asyncio.create_task(app.upstream_monitor())
+        await asyncio.sleep(0.1)
+        alive = not task.done()
+        task.cancel()
+        return alive
+
+    assert run(main())
+    assert len(calls) > 2
+
+
+def test_health_payload_reports_open_breaker(monkeypatch):
+    breaker = open_breaker(open_seconds=60)
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test")
+    monkeypatch.setattr(app.typhoon_router.primary, "breaker", breaker)
+    app.refresh_health()
+    upstream = json.loads(app.health_payload)["upstream"]
+    assert upstream["state"] == CircuitBreaker.OPEN
+    assert upstream["endpoints_available"] == 0
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import app  # noqa: E402
+from conftest import run  # noqa: E402
+from hand_model import HandModel, MicroBatcher  # noqa: E402
+
+LABELS = ["สวัสดี", "ขอบคุณ", "รัก"]
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """โมเดล Teachable Machine ขนาดเล็ก (Dense 5 -> 4 relu -> Dropout -> Dense 3 softmax)"""
+    rng = np.random.default_rng(0)
+    weights = {
+        "dense_1/kernel": rng.normal(size=(5, 4)).astype(np.float32),
+        "dense_1/bias": rng.normal(size=4).astype(np.float32),
+        "dense_2/kernel": rng.normal(size=(4, 3)).astype(np.float32),
+        "dense_2/bias": rng.normal(size=3).astype(np.float32)
+    }
+    topology = {"class_name": "Sequential", "config": {"layers": [
+        {"class_name": "Dense", "config": {"name": "dense_1", "units": 4, "activation": "relu",
+                                           "batch_input_shape": [None, 5], "use_bias": True}},
+        {"class_name": "Dropout", "config": {"name": "dropout", "rate": 0.5}},
+        {"class_name": "Dense", "config": {"name": "dense_2", "units": 3, "activation": "softmax", "use_bias": True}}
+    ]}}
+    manifest = [{"paths": ["weights.bin"], "weights": [
+        {"name": name, "shape": list(array.shape), "dtype": "float32"} for name, array in weights.items()
+    ]}]
+    (tmp_path / "model.json").write_text(json.dumps({"modelTopology": topology, "weightsManifest": manifest}))
+    (tmp_path / "metadata.json").write_text(json.dumps({"labels": LABELS}, ensure_ascii=False))
+    np.concatenate([array.ravel() for array in weights.values()]).tofile(tmp_path / "weights.bin")
+    return tmp_path, weights
+
+
+def reference(weights, x):
+    x = x.astype(np.float64)
+    hidden = np.maximum(x @ weights["dense_1/kernel"] + weights["dense_1/bias"], 0)
+    logits = hidden @ weights["dense_2/kernel"] + weights["dense_2/bias"]
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_predictions_match_reference(model_dir, mmap):
+    path, weights = model_dir
+    model = HandModel.load(str(path), mmap=mmap)
+    x = np.random.default_rng(1).normal(size=(8, 5)).astype(np.float32)
+    assert model.input_size == 5
+    assert model.labels == LABELS
+    np.testing.assert_allclose(model.predict(x), reference(weights, x), atol=1e-5)
+    assert model.info()["parameters"] == 5 * 4 + 4 + 4 * 3 + 3
+
+
+def test_top_k_is_sorted_by_confidence(model_dir):
+    model = HandModel.load(str(model_dir[0]))
+    probabilities = np.array([[0.1, 0.7, 0.2], [0.5, 0.2, 0.3]], dtype=np.float32)
+    top = model.top_k(probabilities, 2)
+    assert [label for label, _ in top[0]] == ["ขอบคุณ", "รัก"]
+    assert [label for label, _ in top[1]] == ["สวัสดี", "รัก"]
+    assert len(model.top_k(probabilities, 10)[0]) == 3
+
+
+def test_wrong_feature_size_is_rejected(model_dir):
+    model = HandModel.load(str(model_dir[0]))
+    with pytest.raises(ValueError):
+        model.predict(np.zeros((1, 4), dtype=np.float32))
+
+
+def test_label_count_must_match_outputs(model_dir):
+    path, _ = model_dir
+    (path / "metadata.json").write_text(json.dumps({"labels": ["a", "b"]}))
+    with pytest.raises(Exception, match="labels"):
+        HandModel.load(str(path))
+
+
+def test_micro_batcher_coalesces_concurrent_requests(model_dir):
+    path, weights = model_dir
+    batcher = MicroBatcher(HandModel.load(str(path)), max_batch=64, max_wait_ms=20)
+    rows = [np.random.default_rng(seed).normal(size=(seed + 1, 5)).astype(np.float32) for seed in range(4)]
+
+    async def main():
+        try:
+            return await asyncio.gather(*(batcher.predict(x) for x in rows))
+        finally:
+            await batcher.close()
+
+    results = run(main())
+    for x, probabilities in zip(rows, results):
+        np.testing.assert_allclose(probabilities, reference(weights, x), atol=1e-5)
+    stats = batcher.stats()
+    assert (stats["requests"], stats["batches"], stats["rows"]) == (4, 1, 10)
+
+
+@pytest.fixture
+def client(model_dir, monkeypatch):
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(app, "HAND_MODEL_ENABLED", True)
+    monkeypatch.setattr(app, "HAND_MODEL_DIR", str(model_dir[0]))
+    for name in ("hand_model", "hand_batcher", "hand_model_error", "np"):
+        monkeypatch.setattr(app, name, getattr(app, name))
+    with TestClient(app.app) as client:
+        yield client
+
+
+def test_predict_endpoint(client):
+    response = client.post("/api/predict/hand", json={"features": [[0.1] * 5, [0.2] * 5], "topK": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["predictions"]) == 2
+    assert len(body["predictions"][0]) == 2
+
+
+@pytest.mark.parametrize("payload", [
+    {"features": [[0.1] * 5, [0.1] * 4]},
+    {"features": [[0.1] * 3]},
+    {"featuresBase64": ["not base64!"]},
+    {}
+])
+def test_predict_endpoint_rejects_bad_features_with_400(client, payload):
+    assert client.post("/api/predict/hand", json=payload).status_code == 400
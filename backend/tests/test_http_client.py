@@ -0,0 +1,48 @@
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+import app
+
+
+def test_one_pooled_client_is_reused_and_closed_at_shutdown(monkeypatch):
+    requests = []
+    clients = []
+
+    def handler(request):
+        requests.append(request.url.host)
+        body = json.dumps({"choices": [{"message": {"content": "1. ก\n2. ข\n3. ค"}}]}).encode()
+        return httpx.Response(200, stream=httpx.ByteStream(body))
+
+    class RecordingClient(httpx.AsyncClient):
+        """AsyncClient ที่ส่ง request ไป MockTransport และนับการปิด"""
+
+        def __init__(self, **kwargs):
+            kwargs["transport"] = httpx.MockTransport(handler)
+            super().__init__(**kwargs)
+            self.closes = 0
+            clients.append(self)
+
+        async def aclose(self):
+            self.closes += 1
+            await super().aclose()
+
+    monkeypatch.setattr(httpx, "AsyncClient", RecordingClient)
+    monkeypatch.setattr(app, "typhoon_http", app.TyphoonHTTPClient())
+    monkeypatch.setattr(app, "CACHE_ENABLED", False)
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test-key")
+    monkeypatch.setattr(app.typhoon_router.primary, "limiter", app.TyphoonAPIRateLimiter(requests_per_minute=600, burst=5))
+
+    with TestClient(app.app) as client:
+        pooled = app.typhoon_http.client
+        for word in ("หนึ่ง", "สอง"):
+            response = client.post("/api/generate", json={"words": [word], "emotion": "happy"})
+            assert response.json()["provider"] == "typhoon"
+        assert app.typhoon_http.client is pooled
+        assert app.typhoon_http.stats()["total_requests"] == 2
+
+    assert len(requests) == 2
+    assert clients == [pooled]
+    assert pooled.closes == 1
+    assert app.typhoon_http.client is None
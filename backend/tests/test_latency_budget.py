@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import pytest
+
+import app
+from conftest import run
+
+
+@pytest.fixture
+def typhoon_enabled(monkeypatch):
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test")
+    app.result_cache.clear()
+    yield
+    app.result_cache.clear()
+
+
+def test_limiter_fails_fast_when_wait_cannot_meet_deadline():
+    limiter = app.TyphoonAPIRateLimiter(requests_per_minute=600, burst=1)
+
+    async def main():
+        await limiter.acquire()
+        started = time.monotonic()
+        with pytest.raises(app.RateLimitExceeded):
+            await limiter.acquire(deadline=time.monotonic() + 0.01)
+        assert time.monotonic() - started < 0.05
+        # รอได้ทันก่อน deadline: ได้ token หลังเติม (~0.1 วินาที)
+        await limiter.acquire(deadline=time.monotonic() + 1.0)
+
+    run(main())
+    assert (limiter.acquired, limiter.rejected) == (2, 1)
+
+
+def test_queued_request_falls_back_without_spending_the_budget(typhoon_enabled, monkeypatch):
+    limiter = app.TyphoonAPIRateLimiter(requests_per_minute=6, burst=1)
+    assert limiter.bucket.take() == 0  # token ถัดไปอีก 10 วินาที มากกว่างบเวลา
+    monkeypatch.setattr(app.typhoon_router.primary, "limiter", limiter)
+
+    started = time.perf_counter()
+    sentences, provider, timing = run(app.resolve_job(app.GenerateJob(["สวัสดี"], "happy"), budget_ms=2000))
+    assert provider == "fallback"
+    assert len(sentences) == 3
+    assert time.perf_counter() - started < 0.5
+    assert limiter.rejected == 1
+
+
+def test_slow_typhoon_answers_with_fallback_and_caches_late_result(typhoon_enabled, monkeypatch):
+    async def slow_request(payload):
+        await asyncio.sleep(0.1)
+        return "1. ประโยคหนึ่ง\n2. ประโยคสอง\n3. ประโยคสาม"
+
+    monkeypatch.setattr(app, "request_typhoon_content", slow_request)
+    job = app.GenerateJob(["ขอบคุณ"], "happy")
+
+    async def main():
+        first = await app.resolve_job(job, budget_ms=20)
+        await asyncio.sleep(0.2)
+        return first, await app.resolve_job(job, budget_ms=20)
+
+    (_, first_provider, _), (sentences, second_provider, _) = run(main())
+    assert first_provider == "fallback"
+    assert second_provider == "typhoon-cache"
+    assert sentences == ["ประโยคหนึ่ง", "ประโยคสอง", "ประโยคสาม"]
@@ -0,0 +1,112 @@
+import json
+import random
+
+import app
+from prompt_compaction import (CaptureCompactor, compact_data_json, compact_summary, estimate_tokens,
+                               sentence_max_tokens)
+from sessions import CaptureSession
+
+
+def entry(word, confidence=0.9, emotion="happy", emotion_confidence=0.8, face=True, faces=1):
+    return {"word": word, "wordConfidence": confidence, "emotion": emotion,
+            "emotionConfidence": emotion_confidence, "faceDetected": face, "faceCount": faces}
+
+
+def compact(entries, **kwargs):
+    compactor = CaptureCompactor(**kwargs)
+    for item in entries:
+        compactor.add(item)
+    return compactor, json.loads(compactor.captures_json())
+
+
+def test_consecutive_identical_captures_are_merged_with_average():
+    compactor, captures = compact([entry("ไป", 0.9), entry("ไป", 0.7), entry("กิน"), entry("ไป")])
+    assert captures == [
+        {"word": "ไป", "wordConfidence": 0.8, "emotion": "happy", "emotionConfidence": 0.8, "count": 2},
+        {"word": "กิน", "wordConfidence": 0.9, "emotion": "happy", "emotionConfidence": 0.8},
+        {"word": "ไป", "wordConfidence": 0.9, "emotion": "happy", "emotionConfidence": 0.8}
+    ]
+    assert compactor.runs == 3
+
+
+def test_face_changes_split_runs_and_default_face_fields_are_omitted():
+    _, captures = compact([entry("ไป"), entry("ไป", face=False, faces=0), entry("ไป", faces=2)])
+    assert [item.get("faceDetected", True) for item in captures] == [True, False, True]
+    assert [item.get("faceCount") for item in captures] == [None, None, 2]
+
+
+def test_low_confidence_captures_are_dropped_but_best_is_kept_when_none_survive():
+    compactor, captures = compact([entry("ไป", 0.1), entry("กิน", 0.9)], confidence_floor=0.3)
+    assert [item["word"] for item in captures] == ["กิน"]
+    assert compactor.dropped == 1
+
+    _, captures = compact([entry("ไป", 0.1), entry("กิน", 0.2)], confidence_floor=0.3)
+    assert [item["word"] for item in captures] == ["กิน"]
+    assert compact([])[1] == []
+
+
+def test_non_numeric_confidence_is_treated_as_zero():
+    _, captures = compact([entry("ไป", "high"), entry("กิน", None)], confidence_floor=0.0)
+    assert [item["wordConfidence"] for item in captures] == [0.0, 0.0]
+
+
+def test_incremental_session_compaction_matches_compaction_from_scratch():
+    rng = random.Random(0)
+    session = CaptureSession("s", CaptureCompactor())
+    entries = []
+    for _ in range(40):
+        word = rng.choice(["ไป", "กิน", "รัก"])
+        confidence = round(rng.random(), 3)
+        session.append({"signLanguage": {"bestWord": word, "confidence": confidence},
+                        "emotion": {"emotion": "happy", "confidence": 0.8},
+                        "face": {"detected": True, "faceCount": 1}})
+        entries.append(entry(word, confidence))
+        compactor, _ = compact(entries)
+        assert session.compact_json() == compact_data_json(compactor, session.summary())
+    assert len(session.compact_json()) < len(session.data_json())
+
+
+def test_compact_summary_drops_duplicated_fields_and_rounds():
+    summary = {"words": ["ไป"], "emotions": ["happy"], "overallEmotion": "happy",
+               "wordConfidence": {"avg": 0.123456, "min": 0.1, "max": 0.2}}
+    assert compact_summary(summary) == {"overallEmotion": "happy",
+                                        "wordConfidence": {"avg": 0.12, "min": 0.1, "max": 0.2}}
+
+
+def test_estimate_tokens_weights_thai_more_than_ascii():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("สวัสดี") == 3
+    assert estimate_tokens("abcd สวัสดี") == 5
+
+
+def test_sentence_max_tokens_grows_with_words_and_is_capped():
+    assert sentence_max_tokens(0) == sentence_max_tokens(1) == 3 * (40 + 8)
+    assert sentence_max_tokens(3) > sentence_max_tokens(1)
+    assert sentence_max_tokens(100, cap=700) == 700
+
+
+def llm_json(word, emotion="happy"):
+    """capture ในรูปแบบของ createLLMJson (src/lib/unifiedProcessor.js)"""
+    return app.LLMData(
+        signLanguage={"word": word, "confidence": 0.9, "source": "hand-model", "details": ""},
+        emotion={"emotion": emotion, "confidence": 0.8, "source": "face-api", "details": ""},
+        face={"detected": True, "faceCount": 1, "bestFaceConfidence": 0.95, "source": "face-api", "details": ""},
+        context={"processingTime": "2026-01-01T00:00:00Z", "modelVersion": "2.0.0", "systemStatus": "active"}
+    )
+
+
+def test_unified_prompt_keeps_words_from_frontend_payload():
+    summary = {"words": ["สวัสดี", "ขอบคุณ"], "emotions": ["happy", "happy"], "overallEmotion": "happy",
+               "totalCaptures": 2}
+    original_json, data_json = app.unified_prompt_data([llm_json("สวัสดี"), llm_json("ขอบคุณ")], summary)
+    data = json.loads(data_json)
+    assert [capture["word"] for capture in data["captures"]] == ["สวัสดี", "ขอบคุณ"]
+    assert "words" not in data["summary"]
+    assert [capture["word"] for capture in json.loads(original_json)["captures"]] == ["สวัสดี", "ขอบคุณ"]
+
+
+def test_summary_words_are_kept_when_capture_words_are_unknown():
+    summary = {"words": ["สวัสดี", "ขอบคุณ"], "emotions": ["happy", "happy"], "overallEmotion": "happy"}
+    _, data_json = app.unified_prompt_data([llm_json("Unknown"), llm_json("Unknown")], summary)
+    assert json.loads(data_json)["summary"]["words"] == ["สวัสดี", "ขอบคุณ"]
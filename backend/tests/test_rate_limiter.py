@@ -0,0 +1,116 @@
+import asyncio
+import email.utils
+import time
+
+import httpx
+import pytest
+
+from app import RateLimitExceeded, TyphoonAPIRateLimiter, parse_retry_after
+from conftest import run
+
+
+class Ticket:
+    """ticket ของงานเบื้องหลัง (field เดียวกับ Speculation ที่ limiter ใช้)"""
+
+    def __init__(self):
+        self.promoted = False
+        self.waiter = None
+        self.granted = 0
+
+
+def drained_limiter(requests_per_minute=1200) -> TyphoonAPIRateLimiter:
+    # token ทุก 50ms ใช้ token แรกไปก่อน ทุก request หลังจากนี้ต้องเข้าคิว
+    limiter = TyphoonAPIRateLimiter(requests_per_minute=requests_per_minute, burst=1, max_wait=5.0)
+    assert limiter.bucket.take() == 0
+    return limiter
+
+
+def test_queued_requests_are_dispatched_in_fifo_order():
+    limiter = drained_limiter()
+    order = []
+
+    async def request(name):
+        await limiter.acquire()
+        order.append(name)
+
+    async def main():
+        tasks = []
+        for name in range(5):
+            tasks.append(asyncio.create_task(request(name)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    run(main())
+    assert order == [0, 1, 2, 3, 4]
+    assert limiter.acquired == 5
+
+
+def test_user_requests_preempt_queued_background_requests():
+    limiter = drained_limiter()
+    order = []
+
+    async def request(name, ticket=None):
+        await limiter.acquire(ticket=ticket)
+        order.append(name)
+
+    async def main():
+        tickets = [Ticket(), Ticket()]
+        tasks = [asyncio.create_task(request(f"background-{index}", ticket)) for index, ticket in enumerate(tickets)]
+        await asyncio.sleep(0)
+        assert all(ticket.waiter is not None for ticket in tickets)
+        tasks.append(asyncio.create_task(request("user")))
+        await asyncio.gather(*tasks)
+        return tickets
+
+    tickets = run(main())
+    assert order == ["user", "background-0", "background-1"]
+    assert [ticket.granted for ticket in tickets] == [1, 1]
+    # เวลารอของงานเบื้องหลังไม่นับเป็น latency ของผู้ใช้
+    assert (limiter.acquired, limiter.background_acquired) == (1, 2)
+
+
+def test_promoted_background_request_moves_to_user_queue():
+    limiter = drained_limiter()
+    order = []
+
+    async def request(name, ticket=None):
+        await limiter.acquire(ticket=ticket)
+        order.append(name)
+
+    async def main():
+        first, second = Ticket(), Ticket()
+        tasks = [asyncio.create_task(request("first", first)), asyncio.create_task(request("second", second))]
+        await asyncio.sleep(0)
+        limiter.promote(second)
+        await asyncio.gather(*tasks)
+
+    run(main())
+    assert order == ["second", "first"]
+    assert limiter.promoted == 1
+
+
+def test_retry_after_blocks_later_dispatches():
+    limiter = TyphoonAPIRateLimiter(requests_per_minute=1200, burst=5, max_wait=5.0)
+
+    async def main():
+        await limiter.acquire()
+        retry_after = limiter.on_rate_limited(httpx.Response(429, headers={"Retry-After": "0.3"}))
+        # มี token เหลือใน bucket แต่ต้องรอจนพ้น Retry-After
+        started = time.monotonic()
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire(deadline=started + 0.1)
+        await limiter.acquire()
+        return retry_after, time.monotonic() - started
+
+    retry_after, waited = run(main())
+    assert retry_after == pytest.approx(0.3)
+    assert waited >= 0.25
+    assert (limiter.rate_limited, limiter.rejected) == (1, 1)
+
+
+def test_parse_retry_after_accepts_seconds_and_http_date():
+    assert parse_retry_after("2", 1.0) == 2.0
+    assert parse_retry_after(None, 1.5) == 1.5
+    assert parse_retry_after("soon", 1.5) == 1.5
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= parse_retry_after(date, 1.0) <= 30
@@ -0,0 +1,68 @@
+import time
+
+from result_cache import MemoryLRUCache, ResultCache, SQLiteCache, bucket_confidences, make_cache_key
+
+
+def test_cache_key_buckets_nearby_confidences():
+    key = make_cache_key("legacy", ["สวัสดี"], "happy", [0.91], bucket_step=0.1)
+    assert make_cache_key("legacy", [" สวัสดี "], "Happy", [0.89], bucket_step=0.1) == key
+    assert make_cache_key("legacy", ["สวัสดี"], "happy", [0.5], bucket_step=0.1) != key
+    assert make_cache_key("unified", ["สวัสดี"], "happy", [0.91], bucket_step=0.1) != key
+
+
+def test_bucket_confidences_clamps_and_ignores_bad_values():
+    assert bucket_confidences([1.7, -1, "x", 0.26], 0.1) == [10, 0, 0, 3]
+    assert bucket_confidences(None, 0.1) == []
+
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = MemoryLRUCache(max_entries=2)
+    cache.put("a", 1, 10)
+    cache.put("b", 2, 10)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 10)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.bytes == 20
+
+
+def test_memory_lru_expires_entries():
+    cache = MemoryLRUCache(ttl=0.01)
+    cache.put("a", 1, 10)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.bytes == 0
+
+
+def test_disk_tier_survives_restart_and_promotes_to_memory(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    cache = ResultCache(MemoryLRUCache(), SQLiteCache(path))
+    cache.open()
+    cache.put("k", ["หนึ่ง", "สอง", "สาม"])
+    cache.close()
+
+    restarted = ResultCache(MemoryLRUCache(), SQLiteCache(path))
+    restarted.open()
+    assert restarted.get("k") == ["หนึ่ง", "สอง", "สาม"]
+    assert restarted.get("k") == ["หนึ่ง", "สอง", "สาม"]
+    assert (restarted.disk_hits, restarted.memory_hits) == (1, 1)
+    assert restarted.get("missing") is None
+    assert restarted.stats()["misses"] == 1
+    restarted.close()
+
+
+def test_disk_tier_evicts_to_max_bytes(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "results.sqlite3"), max_bytes=100)
+    disk.open()
+    for index in range(10):
+        disk.put(f"k{index}", "x" * 30)
+    assert disk.bytes <= 100
+    assert disk.count() == 3
+    assert disk.get("k9") is not None
+    disk.close()
+
+
+def test_empty_results_are_not_cached():
+    cache = ResultCache(MemoryLRUCache())
+    cache.put("k", [])
+    assert cache.get("k") is None
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from sentence_engine import EMOTION_ONLY_SENTENCES, SentenceEngine
+
+LABELS = ["เริ่ม", "เรียนรู้", "AI", "อย่างไร", "ช่วยเหลือ", "ไม่ใช่", "หยุด", "ถัดไป", "สถานะว่าง"]
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = SentenceEngine(min_confidence=0.5, precompute_length=2)
+    engine.build(LABELS)
+    return engine
+
+
+def test_key_drops_unknown_idle_low_confidence_and_repeats():
+    engine = SentenceEngine(min_confidence=0.5, max_words=3)
+    words = ["Unknown", "เรียนรู้", "สถานะว่าง", "เรียนรู้", "AI", "หยุด"]
+    assert engine.key(words, "Happy", [0.9, 0.9, 0.9, 0.9, 0.2, 0.8]) == (("เรียนรู้", "หยุด"), "happy")
+    # ถ้าทุกคำ confidence ต่ำ ยังใช้คำเหล่านั้น
+    assert engine.key(["AI"], "unknown-emotion", [0.1]) == (("AI",), "neutral")
+    assert engine.key(words)[0] == ("เรียนรู้", "AI", "หยุด")
+
+
+def test_generate_returns_three_sentences_using_the_word(engine):
+    sentences = engine.generate(["ช่วยเหลือ"], "happy", [0.9])
+    assert len(sentences) == 3
+    assert all("ช่วยเหลือ" in sentence for sentence in sentences)
+    assert len(set(sentences)) == 3
+
+
+def test_precomputed_table_matches_composition(engine):
+    assert len(engine.table) > 0
+    for key in list(engine.table)[:200]:
+        assert engine.table[key] == engine.compose(*key)
+
+
+def test_table_hit_and_on_demand_composition(engine):
+    hits, composed = engine.table_hits, engine.composed
+    engine.generate(["เรียนรู้", "AI"], "neutral")
+    assert engine.table_hits == hits + 1
+    engine.generate(["คำใหม่"], "neutral")
+    assert engine.composed == composed + 1
+
+
+def test_question_word_puts_question_first(engine):
+    sentences = engine.generate(["เรียนรู้", "AI", "อย่างไร"])
+    assert "อย่างไร" in sentences[0]
+    assert sentences[0].endswith("ครับ/คะ")
+
+
+def test_no_meaningful_words_uses_emotion_sentences(engine):
+    assert engine.generate(["Unknown", "สถานะว่าง"], "sad") == list(EMOTION_ONLY_SENTENCES["sad"])
+
+
+def test_generate_many_matches_generate_and_composes_once_per_key(engine):
+    items = [(["คำแปลก"], "happy", None), (["คำแปลก"], "happy", None), (["หยุด"], "sad", [0.9])]
+    composed = engine.composed
+    results = engine.generate_many(items)
+    assert engine.composed == composed + 1
+    assert results == [engine.generate(*item) for item in items]
+
+
+def test_load_builds_table_from_metadata(tmp_path):
+    path = tmp_path / "metadata.json"
+    path.write_text(json.dumps({"labels": ["หยุด", "ถัดไป"]}, ensure_ascii=False))
+    engine = SentenceEngine(precompute_length=2)
+    engine.load(str(path))
+    assert (("หยุด", "ถัดไป"), "neutral") in engine.table
+    assert engine.stats()["vocabulary"] == 2
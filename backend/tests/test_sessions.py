@@ -0,0 +1,104 @@
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from sessions import CaptureSession, InvalidCaptureError, SessionLimitError, SessionStore
+
+
+def capture(word="สวัสดี", confidence=0.9, emotion="happy"):
+    return {
+        "signLanguage": {"bestWord": word, "confidence": confidence},
+        "emotion": {"emotion": emotion, "confidence": 0.8},
+        "face": {"detected": True, "faceCount": 1}
+    }
+
+
+def test_data_json_matches_full_serialization():
+    session = CaptureSession("s")
+    entries = [session.append(capture("สวัสดี")), session.append(capture("ขอบคุณ", 0.7, "sad"))]
+    expected = {"captures": entries, "summary": session.summary()}
+    assert json.loads(session.data_json()) == expected
+    assert session.summary()["emotionCounts"] == {"happy": 1, "sad": 1}
+    assert session.overall_emotion == "sad"
+
+
+def test_cached_json_is_rebuilt_after_append():
+    session = CaptureSession("s")
+    session.append(capture("สวัสดี"))
+    first = session.data_json()
+    assert session.data_json() is first
+    session.append(capture("ขอบคุณ"))
+    assert json.loads(session.data_json())["summary"]["words"] == ["สวัสดี", "ขอบคุณ"]
+
+
+@pytest.mark.parametrize("bad", [
+    {"signLanguage": {"bestWord": 5}},
+    {"signLanguage": {"bestWord": "รัก"}, "emotion": {"emotion": ["happy"]}}
+])
+def test_non_string_word_or_emotion_is_rejected_before_append(bad):
+    session = CaptureSession("s")
+    with pytest.raises(InvalidCaptureError):
+        session.append(bad)
+    assert (session.version, session.words, session.bytes) == (0, [], 0)
+
+
+def test_missing_word_is_recorded_as_unknown():
+    session = CaptureSession("s")
+    assert session.append({})["word"] == "Unknown"
+
+
+def test_capture_limit():
+    store = SessionStore(max_captures=2)
+    session = store.create()
+    store.append(session, capture())
+    store.append(session, capture())
+    with pytest.raises(SessionLimitError):
+        store.append(session, capture())
+
+
+def test_sessions_expire_after_ttl():
+    store = SessionStore(ttl=0.01)
+    session = store.create()
+    time.sleep(0.02)
+    assert store.get(session.id) is None
+    assert store.expired == 1
+
+
+def test_least_recently_used_session_is_evicted_over_byte_limit():
+    removed = []
+    store = SessionStore(max_bytes=400)
+    store.on_remove = removed.append
+    first = store.create()
+    second = store.create()
+    store.append(first, capture())
+    store.get(first.id)  # first ถูกใช้ล่าสุด second จึงถูก evict ก่อน
+    store.append(second, capture())
+    store.append(second, capture())
+    assert store.bytes <= 400
+    assert store.get(first.id) is first
+    assert removed == [second]
+    assert store.evicted == 1
+
+
+def test_session_bytes_are_released_on_delete():
+    store = SessionStore()
+    session = store.create()
+    store.append(session, capture())
+    assert store.bytes > 0
+    assert store.delete(session.id)
+    assert store.bytes == 0
+    assert not store.delete(session.id)
+
+
+def test_invalid_capture_returns_400_and_session_keeps_working():
+    with TestClient(app.app) as client:
+        session_id = client.post("/api/sessions").json()["sessionId"]
+        response = client.post(f"/api/sessions/{session_id}/captures", json={"signLanguage": {"bestWord": 5}})
+        assert response.status_code == 400
+        assert client.post(f"/api/sessions/{session_id}/captures", json=capture("รัก")).status_code == 200
+        response = client.post(f"/api/sessions/{session_id}/generate")
+        assert response.status_code == 200
+        assert response.json()["provider"] == "fallback"
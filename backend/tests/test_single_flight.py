@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from app import SingleFlight
+from conftest import run
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["ประโยค"]
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", factory) for _ in range(5)))
+
+    results = run(main())
+    assert results == [["ประโยค"]] * 5
+    assert len(calls) == 1
+    assert (flight.leaders, flight.coalesced, flight.max_waiters) == (1, 4, 5)
+    assert flight.inflight == {}
+
+
+def test_errors_reach_every_waiter_and_next_call_retries():
+    flight = SingleFlight()
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise Exception("API Error: 500")
+
+    async def main():
+        results = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, Exception) for result in results)
+        with pytest.raises(Exception):
+            await flight.do("k", failing)
+
+    run(main())
+    assert len(attempts) == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def factory():
+        await asyncio.sleep(0.02)
+        return ["ok"]
+
+    async def main():
+        leader = asyncio.create_task(flight.do("k", factory))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", factory))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert run(main()) == ["ok"]
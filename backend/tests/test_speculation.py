@@ -0,0 +1,153 @@
+import asyncio
+import uuid
+
+import pytest
+
+import app
+from app import SpeculativeGenerator
+from conftest import run
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Typhoon ปลอม: นับ call และนับ token ให้ ticket ของงานล่วงหน้าเหมือน rate limiter จริง"""
+    calls = []
+    delay = {"seconds": 0.05}
+
+    async def fake_request(payload):
+        ticket = app.background_ticket.get()
+        if ticket is not None:
+            ticket.granted += 1
+        calls.append(payload)
+        await asyncio.sleep(delay["seconds"])
+        return "1. ประโยคหนึ่ง\n2. ประโยคสอง\n3. ประโยคสาม"
+
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test-key")
+    monkeypatch.setattr(app, "request_typhoon_content", fake_request)
+    return calls, delay
+
+
+def new_session(word=None):
+    session = app.capture_sessions.create()
+    add_capture(session, word or f"คำ-{uuid.uuid4().hex[:8]}")
+    return session
+
+
+def add_capture(session, word):
+    app.capture_sessions.append(session, {"signLanguage": {"word": word, "confidence": 0.9},
+                                          "emotion": {"emotion": "happy", "confidence": 0.8}})
+
+
+def test_stable_words_are_generated_once_and_claimed(upstream):
+    calls, _ = upstream
+
+    async def scenario():
+        speculator = SpeculativeGenerator(stable_ms=10)
+        session = new_session()
+        speculator.schedule(session)
+        assert speculator.by_session[session.id].job is None  # ยังไม่ serialize session ระหว่างรอคำนิ่ง
+        await asyncio.sleep(0.15)
+        assert speculator.by_session[session.id].state == "ready"
+        return speculator, speculator.claim(session)
+
+    speculator, sentences = run(scenario())
+    assert sentences == ["ประโยคหนึ่ง", "ประโยคสอง", "ประโยคสาม"]
+    stats = speculator.stats()
+    assert (len(calls), stats["started"], stats["hits"], stats["upstream_calls"]) == (1, 1, 1, 1)
+    assert stats["wasted_upstream_calls"] == 0
+
+
+def test_append_before_stable_cancels_without_upstream_call(upstream):
+    calls, _ = upstream
+
+    async def scenario():
+        speculator = SpeculativeGenerator(stable_ms=50)
+        session = new_session()
+        speculator.schedule(session)
+        first = speculator.by_session[session.id]
+        add_capture(session, "เพิ่ม")
+        speculator.schedule(session)
+        await asyncio.sleep(0.2)
+        return speculator, first
+
+    speculator, first = run(scenario())
+    assert first.job is None
+    assert len(calls) == 1  # เฉพาะ version ล่าสุด
+    assert (speculator.stats()["cancelled"], speculator.stats()["wasted_upstream_calls"]) == (1, 0)
+
+
+def test_append_after_start_counts_wasted_call(upstream):
+    calls, delay = upstream
+    delay["seconds"] = 0.1
+
+    async def scenario():
+        speculator = SpeculativeGenerator(stable_ms=10)
+        session = new_session()
+        speculator.schedule(session)
+        await asyncio.sleep(0.05)
+        assert speculator.by_session[session.id].state == "running"
+        add_capture(session, "เพิ่ม")
+        speculator.schedule(session)
+        await asyncio.sleep(0.2)
+        return speculator
+
+    speculator = run(scenario())
+    stats = speculator.stats()
+    # version เก่าเสีย call ไปหนึ่งครั้ง ส่วน version ใหม่เริ่มงานล่วงหน้าของตัวเองต่อ
+    assert (stats["started"], stats["hits"], stats["wasted_upstream_calls"]) == (2, 0, 1)
+
+
+def test_claim_ignores_result_of_stale_version(upstream):
+    async def scenario():
+        speculator = SpeculativeGenerator(stable_ms=10)
+        session = new_session()
+        speculator.schedule(session)
+        await asyncio.sleep(0.15)
+        add_capture(session, "เพิ่ม")
+        return speculator, speculator.claim(session)
+
+    speculator, sentences = run(scenario())
+    assert sentences is None
+    assert speculator.stats()["hits"] == 0
+
+
+def test_hit_counted_only_when_a_listener_delivers(upstream):
+    async def scenario(delivered):
+        speculator = SpeculativeGenerator(stable_ms=10)
+        session = new_session()
+        received = []
+
+        def listener(version, sentences, provider):
+            received.append((version, provider))
+            return delivered
+
+        speculator.subscribe(session.id, listener)
+        speculator.schedule(session)
+        await asyncio.sleep(0.15)
+        return speculator, received
+
+    speculator, received = run(scenario(False))
+    assert received == [(1, "typhoon-speculative")]
+    assert speculator.stats()["hits"] == 0
+    speculator, _ = run(scenario(True))
+    assert speculator.stats()["hits"] == 1
+
+
+def test_speculation_deferred_by_max_inflight_starts_when_slot_frees(upstream):
+    calls, delay = upstream
+    delay["seconds"] = 0.1
+
+    async def scenario():
+        speculator = SpeculativeGenerator(stable_ms=10, max_inflight=1)
+        first, second = new_session(), new_session()
+        speculator.schedule(first)
+        speculator.schedule(second)
+        await asyncio.sleep(0.05)
+        assert speculator.by_session[second.id].state == "deferred"
+        await asyncio.sleep(0.3)
+        return speculator, first, second
+
+    speculator, first, second = run(scenario())
+    assert len(calls) == 2
+    assert speculator.by_session[first.id].state == speculator.by_session[second.id].state == "ready"
+    assert (speculator.stats()["started"], speculator.stats()["deferred"]) == (2, 1)
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+import app
+
+
+def test_upstream_warmup_runs_in_background(monkeypatch):
+    state = {"started": False, "cancelled": False}
+
+    async def unreachable_upstream(endpoint):
+        state["started"] = True
+        try:
+            await asyncio.sleep(5)  # เหมือน connect ที่รอจนหมด timeout
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    monkeypatch.setattr(app, "UPSTREAM_WARMUP", True)
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test-key")
+    monkeypatch.setattr(app, "warm_upstream", unreachable_upstream)
+
+    started = time.perf_counter()
+    with TestClient(app.app) as client:
+        assert time.perf_counter() - started < 1
+        assert client.get("/api/health").status_code == 200
+        assert state["started"]
+    # shutdown ยกเลิก warm-up ที่ยังไม่เสร็จ
+    assert state["cancelled"]
+    assert time.perf_counter() - started < 2
+
+
+def test_first_request_ignores_health_and_metrics(monkeypatch):
+    with TestClient(app.app) as client:
+        monkeypatch.setitem(app.startup_stats, "first_request", None)
+        client.get("/api/health")
+        client.get("/metrics")
+        assert app.startup_stats["first_request"] is None
+
+        client.get("/api/sessions/missing")
+        first = app.startup_stats["first_request"]
+        assert (first["method"], first["path"]) == ("GET", "/api/sessions/{session_id}")
@@ -0,0 +1,119 @@
+import json
+
+import httpx
+import pytest
+
+import app
+from app import UpstreamRouter, create_upstream_endpoint
+from conftest import run
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """body ของ SSE ที่ส่งทีละ chunk (ตัดกลางบรรทัดได้) และบันทึกว่าถูกปิดหรือไม่"""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.sent = 0
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.sent += 1
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    async def aclose(self):
+        self.closed = True
+
+
+def delta(content: str) -> str:
+    return "data: " + json.dumps({"choices": [{"delta": {"content": content}}]}, ensure_ascii=False) + "\n\n"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """ให้ stream_typhoon เรียก upstream ปลอมผ่าน httpx.MockTransport คืน dict ที่ตั้ง stream ของ response ได้"""
+    state = {}
+
+    def handler(request):
+        state["payload"] = json.loads(request.content)
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=state["stream"])
+
+    http = app.TyphoonHTTPClient()
+    http.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    endpoint = create_upstream_endpoint({"name": "stream-test", "url": "https://stream.test/v1/chat/completions",
+                                         "apiKey": "key", "model": "typhoon-test", "rateLimit": 600, "burst": 10})
+    monkeypatch.setattr(app, "typhoon_http", http)
+    monkeypatch.setattr(app, "typhoon_router", UpstreamRouter([endpoint]))
+    monkeypatch.setattr(app, "CACHE_ENABLED", False)
+    return state
+
+
+def collect_events(request: dict) -> list:
+    async def collect():
+        job = app.parse_generate_request(request)
+        return [chunk async for chunk in app.stream_generate_events(job)]
+
+    events = []
+    for chunk in run(collect()):
+        name, data = chunk.strip().split("\n")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_deltas_split_across_chunks_are_joined_into_sentences(upstream):
+    body = (delta("1. สวัสดี") + delta("ครับ\n2. ยินดี") + delta("ที่ได้รู้จัก\n3. ขอบคุณ") + delta("ครับ")
+            + "data: [DONE]\n\n").encode()
+    # ตัด byte กลางบรรทัดและกลางอักษรไทย (UTF-8 3 byte)
+    upstream["stream"] = ChunkedStream([body[i:i + 7] for i in range(0, len(body), 7)])
+
+    events = collect_events({"words": ["สวัสดี"], "emotion": "happy"})
+    assert [data["sentence"] for name, data in events if name == "sentence"] == [
+        "สวัสดีครับ", "ยินดีที่ได้รู้จัก", "ขอบคุณครับ"]
+    assert upstream["payload"]["stream"] is True
+
+
+def test_stops_after_three_sentences_and_closes_upstream(upstream):
+    lines = [delta(f"{index}. ประโยคที่ {index}\n") for index in range(1, 7)]
+    upstream["stream"] = stream = ChunkedStream([line.encode() for line in lines])
+    early_stops = app.stream_stats["early_stops"]
+
+    events = collect_events({"words": ["ไป"], "emotion": "neutral"})
+    assert [data["sentence"] for name, data in events if name == "sentence"] == [
+        "ประโยคที่ 1", "ประโยคที่ 2", "ประโยคที่ 3"]
+    assert stream.sent == 3
+    assert stream.closed
+    assert app.stream_stats["early_stops"] == early_stops + 1
+
+
+def test_mid_stream_error_is_filled_with_fallback(upstream):
+    upstream["stream"] = ChunkedStream([delta("1. ไปเที่ยวกันไหม\n2. ไปกัน").encode()],
+                                       error=httpx.ReadError("connection reset"))
+
+    events = collect_events({"words": ["ไป"], "emotion": "happy"})
+    sentences = [(data["sentence"], data["provider"]) for name, data in events if name == "sentence"]
+    assert sentences[0] == ("ไปเที่ยวกันไหม", "typhoon")
+    assert [provider for _, provider in sentences[1:]] == ["fallback", "fallback"]
+    assert events[-1][0] == "done"
+    assert events[-1][1]["provider"] == "typhoon"
+
+
+def test_done_event_reports_sentences_provider_and_timing(upstream):
+    upstream["stream"] = ChunkedStream([delta("1. ก\n2. ข\n3. ค\n").encode(), b"data: [DONE]\n\n"])
+
+    events = collect_events({"words": ["ไป"], "emotion": "happy"})
+    assert [name for name, _ in events] == ["sentence", "sentence", "sentence", "done"]
+    assert [data["index"] for _, data in events[:3]] == [0, 1, 2]
+    done = events[-1][1]
+    assert done["sentences"] == ["ก", "ข", "ค"]
+    assert done["provider"] == "typhoon"
+    assert 0 <= done["first_sentence_ms"] <= done["total_ms"]
+
+
+def test_fallback_only_when_typhoon_is_disabled(monkeypatch):
+    monkeypatch.setattr(app, "CACHE_ENABLED", False)
+    events = collect_events({"words": ["ไป"], "emotion": "happy"})
+    assert [data["provider"] for name, data in events if name == "sentence"] == ["fallback"] * 3
+    assert events[-1][1]["provider"] == "fallback"
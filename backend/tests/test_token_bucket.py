@@ -0,0 +1,100 @@
+import sqlite3
+import time
+
+import pytest
+
+from token_bucket import LocalTokenBucket, SQLiteTokenBucket
+
+
+@pytest.fixture
+def shared_bucket(tmp_path):
+    bucket = SQLiteTokenBucket(str(tmp_path / "ratelimit.sqlite3"), rate=1.0, burst=2, busy_timeout=0.05)
+    yield bucket
+    bucket.close()
+
+
+def test_local_bucket_allows_burst_then_reports_wait():
+    bucket = LocalTokenBucket(rate=1.0, burst=2)
+    assert bucket.take() == 0.0
+    assert bucket.take() == 0.0
+    wait = bucket.take()
+    assert 0.9 < wait <= 1.0
+    assert bucket.wait_time() == pytest.approx(wait, abs=0.01)
+
+
+def test_local_bucket_block_holds_tokens_for_retry_after():
+    bucket = LocalTokenBucket(rate=100.0, burst=5)
+    bucket.block(0.5)
+    assert bucket.take() >= 0.49
+    assert bucket.snapshot()["blocked_for"] > 0.4
+
+
+def test_shared_bucket_quota_is_shared_between_instances(shared_bucket, tmp_path):
+    other = SQLiteTokenBucket(shared_bucket.path, rate=1.0, burst=2)
+    assert shared_bucket.take() == 0.0
+    assert other.take() == 0.0
+    assert shared_bucket.take() > 0.9
+    assert other.wait_time() > 0.9
+    other.close()
+
+
+def test_shared_bucket_block_applies_to_all_instances(shared_bucket):
+    other = SQLiteTokenBucket(shared_bucket.path, rate=1.0, burst=2)
+    other.block(5)
+    assert shared_bucket.wait_time() > 4.9
+    assert shared_bucket.snapshot()["tokens"] == pytest.approx(0.0, abs=0.01)
+    other.close()
+
+
+def test_shared_bucket_reads_do_not_write(shared_bucket):
+    shared_bucket.take()
+    conn = sqlite3.connect(shared_bucket.path)
+    before = conn.execute("SELECT tokens, updated_at FROM token_buckets").fetchone()
+    time.sleep(0.01)
+    shared_bucket.wait_time()
+    shared_bucket.snapshot()
+    assert conn.execute("SELECT tokens, updated_at FROM token_buckets").fetchone() == before
+    conn.close()
+
+
+def test_shared_bucket_stays_usable_while_another_process_holds_the_lock(shared_bucket):
+    shared_bucket.take()
+    locker = sqlite3.connect(shared_bucket.path, isolation_level=None)
+    locker.execute("BEGIN IMMEDIATE")
+    try:
+        # อ่านได้ระหว่างที่ worker อื่นถือ write lock และ take/block ไม่ raise
+        assert shared_bucket.wait_time() == 0.0
+        assert shared_bucket.snapshot()["tokens"] >= 1.0
+        assert shared_bucket.take() == shared_bucket.busy_retry
+        shared_bucket.block(1)
+    finally:
+        locker.execute("ROLLBACK")
+        locker.close()
+
+
+def test_shared_bucket_read_falls_back_to_last_state_when_database_fails(shared_bucket, monkeypatch):
+    shared_bucket.take()
+    shared_bucket.take()
+
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(shared_bucket, "_connection", locked)
+    assert 0.9 < shared_bucket.wait_time() <= 1.0
+    assert shared_bucket.snapshot()["tokens"] < 0.1
+
+
+def test_busy_database_does_not_block_for_long(tmp_path):
+    bucket = SQLiteTokenBucket(str(tmp_path / "ratelimit.sqlite3"), rate=1.0, burst=2)
+    bucket.take()
+    locker = sqlite3.connect(bucket.path, isolation_level=None)
+    locker.execute("BEGIN IMMEDIATE")
+    try:
+        # take ถูกเรียกบน event loop: ต้องคืนภายในไม่กี่ ms และให้ลองใหม่แทนการรอ lock
+        started = time.perf_counter()
+        assert bucket.take() == bucket.busy_retry
+        assert time.perf_counter() - started < 0.1
+    finally:
+        locker.execute("ROLLBACK")
+        locker.close()
+        bucket.close()
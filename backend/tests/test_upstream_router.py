@@ -0,0 +1,145 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+import app
+from app import CircuitBreaker, CircuitOpenError, UpstreamRouter, create_upstream_endpoint
+from conftest import run
+
+
+def make_endpoint(name: str, api_key: str = "key"):
+    return create_upstream_endpoint({
+        "name": name,
+        "url": f"https://{name}.test/v1/chat/completions",
+        "apiKey": api_key,
+        "model": "typhoon-test",
+        "rateLimit": 600,
+        "burst": 10
+    })
+
+
+def open_circuit(endpoint):
+    endpoint.breaker.open_seconds = 60
+    endpoint.breaker._set_state(CircuitBreaker.OPEN)
+
+
+def completion(content: str, status_code: int = 200) -> httpx.Response:
+    # ใช้ stream เหมือน response จริง (response ที่อ่านไว้แล้วจะไม่มี .elapsed)
+    body = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+    return httpx.Response(status_code, stream=httpx.ByteStream(body))
+
+
+def use_transport(monkeypatch, handler):
+    """ให้ request ไป upstream ผ่าน httpx.MockTransport แทน network จริง"""
+    http = app.TyphoonHTTPClient()
+    http.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(app, "typhoon_http", http)
+
+
+def upstream_count(name: str, outcome: str) -> float:
+    return app.UPSTREAM_REQUESTS_TOTAL.values.get((name, outcome), 0.0)
+
+
+def test_routes_to_endpoint_with_lowest_expected_latency():
+    slow, fast = make_endpoint("slow"), make_endpoint("fast")
+    slow.observe(900)
+    fast.observe(100)
+    router = UpstreamRouter([slow, fast])
+    assert router.select() is fast
+
+    fast.observe(5000)
+    assert router.select() is slow
+
+
+def test_endpoints_without_key_or_with_open_circuit_are_skipped():
+    primary, backup, unset = make_endpoint("primary"), make_endpoint("backup"), make_endpoint("unset", api_key="")
+    router = UpstreamRouter([primary, backup, unset])
+    open_circuit(primary)
+
+    assert router.candidates() == [backup]
+    # candidates() ใช้ใน health จึงไม่นับ rejected แต่ route() นับ
+    assert primary.breaker.rejected == 0
+    assert router.route() == [backup]
+    assert primary.breaker.rejected == 1
+    assert unset.breaker.rejected == 0
+
+
+def test_all_circuits_open_raises_and_counts_rejection():
+    primary = make_endpoint("primary")
+    router = UpstreamRouter([primary])
+    open_circuit(primary)
+    try:
+        run(router.request({"messages": []}, time.monotonic() + 1))
+    except CircuitOpenError:
+        pass
+    else:
+        raise AssertionError("expected CircuitOpenError")
+    assert primary.breaker.rejected == 1
+
+
+def test_failover_to_next_endpoint_on_upstream_error(monkeypatch):
+    def handler(request):
+        if request.url.host == "primary.test":
+            return completion("boom", status_code=500)
+        body = json.loads(request.content)
+        assert body["model"] == "typhoon-test"
+        return completion("ok")
+
+    use_transport(monkeypatch, handler)
+    primary, backup = make_endpoint("primary"), make_endpoint("backup")
+    primary.observe(10)
+    backup.observe(20)
+    router = UpstreamRouter([primary, backup])
+
+    assert run(router.request({"messages": []}, time.monotonic() + 5)) == "ok"
+    assert router.failovers == 1
+    assert (primary.failures, backup.successes) == (1, 1)
+    assert primary.inflight == backup.inflight == 0
+
+
+def test_hedged_request_cancels_slower_endpoint(monkeypatch):
+    async def handler(request):
+        if request.url.host == "slow.test":
+            await asyncio.sleep(5)
+        return completion(request.url.host)
+
+    use_transport(monkeypatch, handler)
+    slow, fast = make_endpoint("slow"), make_endpoint("fast")
+    slow.observe(10)
+    fast.observe(20)
+    router = UpstreamRouter([slow, fast], hedge_enabled=True, hedge_min_delay_ms=50, hedge_default_delay_ms=50)
+    cancelled = upstream_count("slow", "cancelled")
+
+    started = time.perf_counter()
+    assert run(router.request({"messages": []}, time.monotonic() + 10)) == "fast.test"
+    assert time.perf_counter() - started < 2
+    assert (router.hedges, router.hedge_wins, fast.hedge_wins) == (1, 1, 1)
+    assert slow.cancelled == 1 and slow.failures == 0
+    # เวลาที่ตัวแพ้รอไปแล้วถูกบันทึกเป็น latency ขั้นต่ำ จึงไม่ถูกเลือกก่อนอีก
+    assert slow.ewma_ms > 10
+    assert upstream_count("slow", "cancelled") == cancelled + 1
+
+
+def test_stream_records_upstream_metrics(monkeypatch):
+    def handler(request):
+        lines = [
+            'data: {"choices": [{"delta": {"content": "สวัสดีครับ\\nขอบคุณ"}}]}',
+            'data: {"choices": [{"delta": {"content": "ครับ\\n"}}]}',
+            "data: [DONE]"
+        ]
+        return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                              content="\n\n".join(lines).encode())
+
+    use_transport(monkeypatch, handler)
+    endpoint = make_endpoint("stream")
+    monkeypatch.setattr(app, "typhoon_router", UpstreamRouter([endpoint]))
+    successes = upstream_count("stream", "success")
+
+    async def collect():
+        return [sentence async for sentence in app.stream_typhoon({"messages": []})]
+
+    assert run(collect()) == ["สวัสดีครับ", "ขอบคุณครับ"]
+    assert upstream_count("stream", "success") == successes + 1
+    assert (endpoint.successes, endpoint.inflight) == (1, 0)
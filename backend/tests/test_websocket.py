@@ -0,0 +1,89 @@
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+@pytest.fixture
+def client():
+    with TestClient(app.app) as client:
+        yield client
+
+
+def test_capture_gets_ack_and_fallback_suggestion(client):
+    with client.websocket_connect("/ws") as websocket:
+        ready = websocket.receive_json()
+        assert ready["type"] == "ready"
+        websocket.send_json({"type": "capture", "word": "สวัสดี", "confidence": 0.9, "emotion": "happy"})
+        ack = websocket.receive_json()
+        assert (ack["type"], ack["word"], ack["totalCaptures"]) == ("ack", "สวัสดี", 1)
+        suggestion = websocket.receive_json()
+        assert suggestion["type"] == "suggestion"
+        assert suggestion["final"] is False
+        assert len(suggestion["sentences"]) == 3
+
+
+@pytest.mark.parametrize("frame", [
+    {"type": "capture", "word": 123},
+    {"type": "capture", "word": ""},
+    {"type": "capture"},
+    {"type": "capture", "data": {"signLanguage": {"bestWord": ["ไป"]}}},
+    {"type": "capture", "data": "ไป"}
+])
+def test_invalid_capture_gets_error_and_socket_stays_open(client, frame):
+    with client.websocket_connect("/ws") as websocket:
+        websocket.receive_json()
+        websocket.send_json(frame)
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+
+def test_non_json_message_and_unknown_type_get_errors(client):
+    with client.websocket_connect("/ws") as websocket:
+        websocket.receive_json()
+        websocket.send_text("not json")
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"type": "dance"})
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"type": "generate"})
+        assert websocket.receive_json()["type"] == "error"  # ยังไม่มีคำใน session
+
+
+def test_binary_frame_gets_error_and_socket_stays_open(client):
+    with client.websocket_connect("/ws") as websocket:
+        websocket.receive_json()
+        websocket.send_bytes(b"\x00\x01")
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+
+def test_final_suggestion_is_sent_and_counted_once_per_version(client, monkeypatch):
+    async def fake_request(payload):
+        return "1. ประโยคหนึ่ง\n2. ประโยคสอง\n3. ประโยคสาม"
+
+    monkeypatch.setattr(app.typhoon_router.primary, "api_key", "test-key")
+    monkeypatch.setattr(app, "request_typhoon_content", fake_request)
+    monkeypatch.setattr(app.speculator, "stable_ms", 10)
+    monkeypatch.setattr(app.speculator, "enabled", True)
+    word = f"ทดสอบ-{uuid.uuid4().hex[:8]}"
+
+    with client.websocket_connect("/ws") as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "capture", "word": word, "confidence": 0.9, "emotion": "happy"})
+        websocket.receive_json()  # ack
+        assert websocket.receive_json()["final"] is False
+        speculative = websocket.receive_json()
+        assert (speculative["provider"], speculative["final"]) == ("typhoon-speculative", True)
+        responses = sum(app.RESPONSES_TOTAL.values.values())
+
+        # generate ของ version เดียวกันได้ผลจากงานล่วงหน้า: ไม่ส่งและไม่นับซ้ำ
+        websocket.send_json({"type": "generate"})
+        time.sleep(0.1)
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+        assert sum(app.RESPONSES_TOTAL.values.values()) == responses
@@ -0,0 +1,207 @@
+"""
+Token bucket สำหรับ rate limiter ของ Typhoon API
+- LocalTokenBucket: อยู่ในหน่วยความจำของ process เดียว
+- SQLiteTokenBucket: แชร์ระหว่าง worker หลาย process บนเครื่องเดียวกันผ่านไฟล์ SQLite
+  (ทุก worker เห็นจำนวน token ที่เหลือชุดเดียวกัน จึงไม่เกิน quota ของ upstream)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class LocalTokenBucket:
+    """Token bucket ในหน่วยความจำ (ใช้ได้เมื่อรัน worker เดียว)"""
+
+    shared = False
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate  # token ต่อวินาที
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        # updated_at อาจอยู่ในอนาคตถ้าโดน 429 (ยังไม่เติม token จนกว่าจะพ้น Retry-After)
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def _wait(self, now: float) -> float:
+        blocked = max(self.updated_at - now, 0.0)
+        return blocked + max(1 - self.tokens, 0.0) / self.rate
+
+    def take(self) -> float:
+        """หยิบ token หนึ่งตัว คืน 0 ถ้าได้ ไม่งั้นคืนจำนวนวินาทีที่ต้องรอจนมี token"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1 and self.updated_at <= now:
+            self.tokens -= 1
+            return 0.0
+        return max(self._wait(now), 1e-3)
+
+    def wait_time(self) -> float:
+        """จำนวนวินาทีจนกว่าจะมี token ว่าง (ไม่หยิบ)"""
+        now = time.monotonic()
+        self._refill(now)
+        return self._wait(now)
+
+    def block(self, seconds: float):
+        """หยุดปล่อย token เป็นเวลา seconds (ตาม Retry-After ของ upstream)"""
+        self.tokens = 0.0
+        self.updated_at = max(self.updated_at, time.monotonic() + seconds)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "tokens": max(self.tokens, 0.0),
+            "blocked_for": max(self.updated_at - now, 0.0)
+        }
+
+    def close(self):
+        pass
+
+
+class SQLiteTokenBucket:
+    """Token bucket ที่เก็บสถานะในไฟล์ SQLite แชร์ระหว่าง process (อัปเดตแบบ atomic ด้วย BEGIN IMMEDIATE)
+
+    ถูกเรียกตรงๆ บน event loop จึงรอ lock ของ worker อื่นแค่ busy_timeout (หลักมิลลิวินาที)
+    ถ้าฐานข้อมูลไม่ว่างจะถือว่ายังไม่ได้ token และให้ลองใหม่ในอีก busy_retry วินาที แทนการบล็อกทุก coroutine
+    """
+
+    shared = True
+    busy_retry = 0.02
+
+    def __init__(self, path: str, rate: float, burst: int, name: str = "typhoon", busy_timeout: float = 0.005):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self.busy_timeout = busy_timeout
+        self.conn = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.last_state = (float(burst), time.time())  # (tokens, updated_at) ที่อ่านได้ล่าสุด ใช้เมื่อฐานข้อมูลไม่ว่าง
+
+    def _connection(self) -> sqlite3.Connection:
+        # เปิด connection ใหม่หลัง fork (แต่ละ worker ต้องมี connection ของตัวเอง)
+        if self.conn is not None and self.pid == os.getpid():
+            return self.conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # สถานะ token หายได้ถ้าเครื่องดับ ไม่จำเป็นต้อง fsync
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            " name TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+            (self.name, float(self.burst), time.time())
+        )
+        self.conn = conn
+        self.pid = os.getpid()
+        return conn
+
+    def _update(self, take: bool = False, block_seconds: float = None) -> tuple:
+        """อ่าน-เติม-เขียนสถานะใน transaction เดียว คืน (tokens, updated_at, now, taken)"""
+        with self.lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, updated_at = conn.execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                # ใช้เวลาจริง (time.time) เพราะ monotonic clock ของแต่ละ process ไม่ตรงกัน
+                now = time.time()
+                elapsed = now - updated_at
+                if elapsed > 0:
+                    tokens = min(self.burst, tokens + elapsed * self.rate)
+                    updated_at = now
+                taken = False
+                if take and tokens >= 1 and updated_at <= now:
+                    tokens -= 1
+                    taken = True
+                if block_seconds is not None:
+                    tokens = 0.0
+                    updated_at = max(updated_at, now + block_seconds)
+                conn.execute(
+                    "UPDATE token_buckets SET tokens = ?, updated_at = ? WHERE name = ?",
+                    (tokens, updated_at, self.name)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.last_state = (tokens, updated_at)
+        return tokens, updated_at, now, taken
+
+    def _read(self) -> tuple:
+        """อ่านสถานะแล้วคำนวณการเติม token ในหน่วยความจำ (SELECT อย่างเดียว ไม่แย่ง write lock กับ worker อื่น)
+
+        ถ้าฐานข้อมูลไม่ว่างจะใช้สถานะที่อ่านได้ล่าสุดแทน คืน (tokens, updated_at, now)
+        """
+        try:
+            with self.lock:
+                row = self._connection().execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+            if row is not None:
+                self.last_state = row
+        except sqlite3.OperationalError as e:
+            print(f"[WARNING] Shared rate limiter busy: {e}")
+        tokens, updated_at = self.last_state
+        now = time.time()
+        elapsed = now - updated_at
+        if elapsed > 0:
+            tokens = min(self.burst, tokens + elapsed * self.rate)
+            updated_at = now
+        return tokens, updated_at, now
+
+    def _wait(self, tokens: float, updated_at: float, now: float) -> float:
+        blocked = max(updated_at - now, 0.0)
+        return blocked + max(1 - tokens, 0.0) / self.rate
+
+    def take(self) -> float:
+        """หยิบ token หนึ่งตัว คืน 0 ถ้าได้ ไม่งั้นคืนจำนวนวินาทีที่ต้องรอจนมี token"""
+        try:
+            tokens, updated_at, now, taken = self._update(take=True)
+        except sqlite3.OperationalError as e:
+            # worker อื่นถือ lock นานเกิน busy_timeout: ถือว่ายังไม่มี token แล้วให้ dispatcher ลองใหม่
+            print(f"[WARNING] Shared rate limiter busy: {e}")
+            return self.busy_retry
+        if taken:
+            return 0.0
+        return max(self._wait(tokens, updated_at, now), 1e-3)
+
+    def wait_time(self) -> float:
+        """จำนวนวินาทีจนกว่าจะมี token ว่าง (ไม่หยิบ)"""
+        tokens, updated_at, now = self._read()
+        return self._wait(tokens, updated_at, now)
+
+    def block(self, seconds: float):
+        """หยุดปล่อย token ของทุก worker เป็นเวลา seconds (ตาม Retry-After ของ upstream)"""
+        try:
+            self._update(block_seconds=seconds)
+        except sqlite3.OperationalError as e:
+            # worker ที่หยิบ token ครั้งถัดไปจะโดน 429 แล้ว block เองอีกครั้ง
+            print(f"[WARNING] Shared rate limiter busy, Retry-After not shared: {e}")
+
+    def snapshot(self) -> dict:
+        tokens, updated_at, now = self._read()
+        return {
+            "tokens": max(tokens, 0.0),
+            "blocked_for": max(updated_at - now, 0.0)
+        }
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.conn.close()
+            self.conn = None
@@ -1,12 +1,50 @@
-import React, { useState } from 'react'
+import React, { useState, useRef } from 'react'
 import { CONFIG } from '../lib/config.js'
 
+// สร้าง capture session ฝั่ง backend (ส่ง capture ทีละภาพแทนการส่งทั้งหมดตอนสร้างประโยค)
+async function createSession() {
+  const response = await fetch(`${CONFIG.API_BASE_URL}/api/sessions`, { method: 'POST' })
+  if (!response.ok) {
+    throw new Error(`สร้าง session ไม่สำเร็จ (${response.status})`)
+  }
+  const data = await response.json()
+  return data.sessionId
+}
+
 export default function RightPanel() {
   const [capturedWords, setCapturedWords] = useState([])
   const [generatedSentence, setGeneratedSentence] = useState('')
   const [isGenerating, setIsGenerating] = useState(false)
   const [latestEmotion, setLatestEmotion] = useState('neutral') // เก็บอารมณ์ล่าสุด
   
+  // session ฝั่ง backend: ok = false เมื่อส่ง capture ไม่ครบ (จะกลับไปส่งข้อมูลทั้งหมดแบบเดิม)
+  const sessionRef = useRef({ id: null, ok: true, pending: Promise.resolve() })
+  
+  // ส่ง capture เข้า session ตามลำดับที่จับได้
+  const appendToSession = (llmJson) => {
+    const session = sessionRef.current
+    const { imageBlob, ...capture } = llmJson
+    session.pending = session.pending.then(async () => {
+      if (!session.ok) return
+      try {
+        if (!session.id) {
+          session.id = await createSession()
+        }
+        const response = await fetch(`${CONFIG.API_BASE_URL}/api/sessions/${session.id}/captures`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(capture)
+        })
+        if (!response.ok) {
+          throw new Error(`เพิ่ม capture ไม่สำเร็จ (${response.status})`)
+        }
+      } catch (error) {
+        console.warn('[WARNING] ใช้ session ไม่ได้ จะส่งข้อมูลทั้งหมดตอนสร้างประโยค:', error)
+        session.ok = false
+      }
+    })
+  }
+  
   // ฟังก์ชันรับผลการจับภาพจาก CameraFeed
   React.useEffect(() => {
     // Listen for capture events from CameraFeed
@@ -28,6 +66,11 @@ export default function RightPanel() {
       }
       
       setCapturedWords(prev => [...prev, wordData])
+      if (captureData.llmJson) {
+        appendToSession(captureData.llmJson)
+      } else {
+        sessionRef.current.ok = false
+      }
       console.log('📝 เพิ่มคำ:', captureData.hands?.bestWord || 'Unknown', 
                  `(${((captureData.hands?.confidence || 0) * 100).toFixed(1)}%)`)
       
@@ -65,6 +108,21 @@ export default function RightPanel() {
       
       console.log('📤 ส่งข้อมูลไป Backend:', { words, emotion: latestEmotion })
       
+      // ใช้ session ถ้าส่ง capture ครบทุกภาพแล้ว (backend มีข้อมูลอยู่แล้ว ไม่ต้องส่งซ้ำ)
+      const session = sessionRef.current
+      await session.pending
+      if (session.ok && session.id) {
+        const response = await fetch(`${CONFIG.API_BASE_URL}/api/sessions/${session.id}/generate`, {
+          method: 'POST'
+        })
+        if (response.ok) {
+          const data = await response.json()
+          setGeneratedSentence(data.sentences[0] || 'ไม่สามารถสร้างประโยคได้')
+          return
+        }
+        console.warn('[WARNING] สร้างประโยคจาก session ไม่สำเร็จ:', response.status)
+      }
+      
       // รวม JSON จากทุกภาพที่จับได้
       const llmData = {
         capturedData: capturedWords.map(item => item.llmJson).filter(Boolean),
@@ -110,6 +168,11 @@ export default function RightPanel() {
   
   // ลบคำทั้งหมด
   const handleClearWords = () => {
+    const session = sessionRef.current
+    if (session.id) {
+      fetch(`${CONFIG.API_BASE_URL}/api/sessions/${session.id}`, { method: 'DELETE' }).catch(() => {})
+    }
+    sessionRef.current = { id: null, ok: true, pending: Promise.resolve() }
     setCapturedWords([])
     setGeneratedSentence('')
     setLatestEmotion('neutral') // รีเซ็ตอารมณ์ด้วย